@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +42,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'school.middleware.QueryInstrumentationMiddleware',
+    'school.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'school.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -69,6 +73,35 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Finale.wsgi.application'
+# Serve through ASGI (e.g. `uvicorn Finale.asgi:application`) so the async
+# dashboards wait on their queries without holding a worker thread each
+ASGI_APPLICATION = 'Finale.asgi.application'
+# Run each dashboard query in its own thread and connection (see school/dashboards.py)
+SCHOOL_DASHBOARD_PARALLEL = True
+
+# Announcements reaching up to this many users are copied into each inbox when
+# posted; larger audiences (e.g. the whole school) are merged in at read time
+SCHOOL_ANNOUNCEMENT_INBOX_LIMIT = 500
+
+# Background jobs (see school/jobs.py), run by `manage.py run_jobs`. A worker holds
+# a job for the lease; failed jobs are retried after the backoff, doubled each attempt.
+SCHOOL_JOB_LEASE_SECONDS = 300
+SCHOOL_JOB_BACKOFF_SECONDS = 30
+SCHOOL_JOB_MAX_BACKOFF_SECONDS = 6 * 60 * 60
+
+# Each worker's in-memory user autocomplete index (school/autocomplete.py) sees its
+# own writes at once and other workers' writes after a background rebuild this often
+SCHOOL_AUTOCOMPLETE_MAX_AGE = 300
+
+
+# Email
+# https://docs.djangoproject.com/en/5.0/topics/email/
+
+# Printed to the worker's console unless another backend is configured, e.g.
+# SCHOOL_EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend with EMAIL_HOST
+EMAIL_BACKEND = os.environ.get('SCHOOL_EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('SCHOOL_EMAIL_HOST', 'localhost')
+DEFAULT_FROM_EMAIL = os.environ.get('SCHOOL_FROM_EMAIL', 'school@localhost')
 
 
 # Database
@@ -81,6 +114,92 @@ DATABASES = {
     }
 }
 
+# Optional read replica for dashboards, reports and exports (see school/routers.py).
+# Locally this is a second SQLite file, refreshed with `manage.py refresh_replica`.
+if os.environ.get('SCHOOL_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['SCHOOL_REPLICA_DB'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['school.routers.ReplicaRouter']
+SCHOOL_READ_DATABASE = 'replica' if 'replica' in DATABASES else None
+# How long a client reads the primary after writing; keep it above the replica's lag
+SCHOOL_PRIMARY_PIN_SECONDS = 30
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Resolved permission sets per user. Swap for a shared backend such as
+    # 'django.core.cache.backends.filebased.FileBasedCache' (with a LOCATION)
+    # when several worker processes should share it.
+    'permissions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'school-permissions',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+SCHOOL_PERMISSION_CACHE = 'permissions'
+SCHOOL_PERMISSION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# The student ids each parent and teacher may see (school/visibility.py); dropped
+# from the cache whenever they change
+SCHOOL_VISIBILITY_CACHE = 'permissions'
+SCHOOL_VISIBILITY_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.0/topics/logging/
+
+# Per-request SQL statistics from QueryInstrumentationMiddleware. Every request is
+# logged at INFO (set SCHOOL_SQL_LOG_LEVEL=INFO to see them), requests with an N+1
+# pattern (the same statement run more than SCHOOL_N_PLUS_ONE_THRESHOLD times) at
+# WARNING.
+SCHOOL_N_PLUS_ONE_THRESHOLD = 5
+SCHOOL_SERVER_TIMING = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'school.sql': {
+            'handlers': ['console'],
+            'level': os.environ.get('SCHOOL_SQL_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'school.jobs': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
+# Authentication backends
+# https://docs.djangoproject.com/en/5.0/topics/auth/customizing/
+
+AUTHENTICATION_BACKENDS = [
+    'school.backends.CachedPermissionBackend',
+    # Row-level rules of school/rules.py for has_perm(perm, obj)
+    'school.backends.RuleBackend',
+]
+
+LOGIN_URL = 'login'
+LOGIN_REDIRECT_URL = 'dashboard'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -1,16 +1,110 @@
 from django.contrib import admin
-from .models import CustomUser, AdminProfile, StaffProfile, TeacherProfile, StudentProfile, ParentProfile
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth import get_permission_codename
+from .models import CustomUser, AdminProfile, StaffProfile, TeacherProfile, StudentProfile, ParentProfile, Subject, Class, Schedule, Attendance, Exam, Grade, Fee, FeeReminder, Announcement, InboxItem, Job, StudentVisibility
+from . import search
+from .pagination import EstimatedCountPaginator, estimated_count
+from .rules import has_model_perm, permitted, rules
 from django.contrib.auth.admin import UserAdmin
 
+
+class EstimatedCountChangeList(ChangeList):
+    def get_results(self, request):
+        # The admin's show_full_result_count is off, so the exact COUNT(*) of the
+        # whole table was skipped; show an estimate when filters make it useful
+        super().get_results(request)
+        if (self.query and self.search_fields) or self.has_active_filters:
+            self.full_result_count = estimated_count(self.root_queryset, self.model_admin.count_exact_limit)[0]
+        else:
+            self.full_result_count = self.result_count
+        self.show_full_result_count = True
+
+
+class QueryBudgetMixin:
+    """
+    Keeps changelists at a fixed number of queries whatever the table size: rows are
+    joined to what their __str__ needs via list_select_related, and the paginator and
+    full result count use estimated_count() above count_exact_limit rows.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    count_exact_limit = 10000
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        paginator = super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+        paginator.exact_limit = self.count_exact_limit
+        return paginator
+
+
+class RowPermissionMixin:
+    """
+    Applies the row-level rules of school/rules.py: changelists fetch only the rows
+    the user may view, filtered in SQL, and object pages check the object itself.
+    Users with the model-wide permission see every row as before.
+    """
+
+    def _perm(self, action):
+        return f'{self.opts.app_label}.{get_permission_codename(action, self.opts)}'
+
+    def _has_row_perm(self, request, action, obj):
+        perm = self._perm(action)
+        if obj is None:
+            return request.user.has_perm(perm) or rules.get(perm, request.user.role) is not None
+        return request.user.has_perm(perm, obj)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if has_model_perm(request.user, self._perm('change')):
+            return queryset
+        return permitted(request.user, self._perm('view'), queryset)
+
+    def has_view_permission(self, request, obj=None):
+        return self._has_row_perm(request, 'view', obj) or self._has_row_perm(request, 'change', obj)
+
+    def has_change_permission(self, request, obj=None):
+        return self._has_row_perm(request, 'change', obj)
+
+
+class SchoolAdmin(RowPermissionMixin, QueryBudgetMixin, admin.ModelAdmin):
+    pass
+
+
+class ProfileAdmin(SchoolAdmin):
+    list_select_related = ['user']
+
+
 # Register the CustomUser model
 @admin.register(CustomUser)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(QueryBudgetMixin, UserAdmin):
     list_display = ['username', 'email', 'is_staff']
     fieldsets = UserAdmin.fieldsets
 
+    def get_search_results(self, request, queryset, search_term):
+        # Prefix search through the user search index instead of icontains over search_fields
+        if not search_term.strip():
+            return queryset, False
+        return search.matching(queryset, search_term), False
+
 # Register each Profile model in the admin interface
-admin.site.register(AdminProfile)
-admin.site.register(StaffProfile)
-admin.site.register(TeacherProfile)
-admin.site.register(StudentProfile)
-admin.site.register(ParentProfile)
+admin.site.register(AdminProfile, ProfileAdmin)
+admin.site.register(StaffProfile, ProfileAdmin)
+admin.site.register(TeacherProfile, ProfileAdmin)
+admin.site.register(StudentProfile, ProfileAdmin)
+admin.site.register(ParentProfile, ProfileAdmin)
+
+# Register the school models, joined to the relations their __str__ uses
+admin.site.register(Subject, SchoolAdmin)
+admin.site.register(Class, SchoolAdmin)
+admin.site.register(Schedule, SchoolAdmin, list_select_related=['class_instance'])
+admin.site.register(Attendance, SchoolAdmin, list_select_related=['student__user'])
+admin.site.register(Exam, SchoolAdmin, list_select_related=['subject'])
+admin.site.register(Grade, SchoolAdmin, list_select_related=['student__user', 'exam__subject'])
+admin.site.register(Fee, SchoolAdmin, list_select_related=['student__user'])
+admin.site.register(FeeReminder, SchoolAdmin, list_select_related=['student__user'])
+admin.site.register(Announcement, SchoolAdmin, list_select_related=['author', 'class_instance'])
+admin.site.register(InboxItem, SchoolAdmin, list_select_related=['user', 'announcement'])
+admin.site.register(Job, SchoolAdmin)
+admin.site.register(StudentVisibility, SchoolAdmin, list_select_related=['viewer', 'student__user'])
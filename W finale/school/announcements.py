@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Announcement, Class, CustomUser, InboxItem
+
+
+def inbox_limit():
+    """Audiences up to this size get inbox rows when posted; larger ones are read as a feed."""
+    return getattr(settings, 'SCHOOL_ANNOUNCEMENT_INBOX_LIMIT', 500)
+
+
+def recipients(class_instance=None):
+    """
+    Users an announcement reaches, as one set-based query of user ids: the students
+    of a class and the parents of those students, or every active user.
+    """
+    if class_instance is None:
+        return CustomUser.objects.filter(is_active=True).values('id')
+    students = CustomUser.objects.filter(is_active=True, studentprofile__classes=class_instance).values('id')
+    parents = CustomUser.objects.filter(is_active=True, parentprofile__children__classes=class_instance).values('id')
+    return students.union(parents)
+
+
+def deliver_to_inboxes(announcement, users):
+    """Insert an InboxItem for every user id in `users` with one INSERT ... SELECT. Returns the row count."""
+    select, params = users.query.get_compiler(connection=connection).as_sql()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(InboxItem._meta.db_table)} ({quote("user_id")}, {quote("announcement_id")}) '
+            f'SELECT {quote("recipient")}.{quote("id")}, %s FROM ({select}) {quote("recipient")}',
+            [announcement.pk, *params],
+        )
+        return cursor.rowcount
+
+
+def post_announcement(author, title, body='', class_instance=None):
+    """
+    Post to a class or, without one, the whole school. The recipients are counted
+    once; up to inbox_limit() of them get inbox rows, otherwise the announcement
+    is stored once as a feed entry. Either way posting is a few queries,
+    whatever the audience size.
+    """
+    users = recipients(class_instance)
+    count = users.count()
+    with transaction.atomic():
+        announcement = Announcement.objects.create(
+            author=author, title=title, body=body, class_instance=class_instance,
+            audience='class' if class_instance is not None else 'school',
+            delivery='inbox' if count <= inbox_limit() else 'feed',
+            recipient_count=count,
+        )
+        if announcement.delivery == 'inbox':
+            deliver_to_inboxes(announcement, users)
+    return announcement
+
+
+def inbox_queryset(user, limit=None):
+    """
+    A user's announcements, newest first, with a `read` flag: the ones delivered
+    to their inbox merged with the feeds of the school and of every class they or
+    their children attend, as a single query.
+
+    Each source is its own indexed subquery (the inbox through the (user,
+    announcement) index, the feeds through announcement_feed_idx), newest first
+    and cut at `limit` when one is given, so only the rows that can make the page
+    are sorted, not every announcement ever posted.
+    """
+    newest = ('-created_at', '-pk')
+
+    def top(announcements):
+        ids = announcements.order_by(*newest).values('pk')
+        return ids if limit is None else ids[:limit]
+
+    enrolments = Class.students.through.objects
+    classes = enrolments.filter(studentprofile__user=user).values('class_id').union(
+        enrolments.filter(studentprofile__parents__user=user).values('class_id'),
+    )
+    feeds = Announcement.objects.filter(delivery='feed')
+    sources = (
+        Q(pk__in=top(Announcement.objects.filter(inbox_items__user=user)))
+        | Q(pk__in=top(feeds.filter(audience='school', class_instance__isnull=True)))
+        | Q(pk__in=top(feeds.filter(audience='class', class_instance__in=classes)))
+    )
+    return Announcement.objects.filter(sources).annotate(
+        read=Exists(InboxItem.objects.filter(user=user, announcement=OuterRef('pk'), read_at__isnull=False)),
+    ).select_related('author').order_by(*newest)
+
+
+def inbox(user, limit=50):
+    return inbox_queryset(user, limit)[:limit]
+
+
+def mark_read(user, announcement_ids):
+    """Mark announcements in the user's inbox as read, feed ones included. Returns how many."""
+    visible = list(inbox_queryset(user).filter(pk__in=announcement_ids).values_list('pk', flat=True))
+    now = timezone.now()
+    InboxItem.objects.bulk_create(
+        [InboxItem(user=user, announcement_id=pk, read_at=now) for pk in visible],
+        update_conflicts=True, unique_fields=['user', 'announcement'], update_fields=['read_at'],
+    )
+    return len(visible)
@@ -6,3 +6,4 @@ class SchoolConfig(AppConfig):
     name = 'school'
     def ready(self):
         import school.signals  # Ensure signals are imported
+        import school.tasks  # Register the background tasks
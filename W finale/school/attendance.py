@@ -0,0 +1,167 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .models import Attendance, AttendanceSummary, Class
+
+VALID_STATUSES = {status for status, label in Attendance.STATUS_CHOICES}
+
+
+def enrolled_student_ids(class_instance):
+    # Read the through table directly, no join with the profiles
+    return set(Class.students.through.objects.filter(
+        class_id=class_instance.pk
+    ).values_list('studentprofile_id', flat=True))
+
+
+def mark_attendance(class_instance, date, statuses):
+    """
+    Record a roll call for a class on a date. `statuses` maps student profile ids
+    to 'Present' or 'Absent'; every student must be enrolled in the class.
+
+    Rows are written with one batched upsert on (class_instance, date, student),
+    so submitting the same roll call again updates it in place. The number of
+    queries does not depend on the size of the class.
+
+    The class row is locked for the transaction, so concurrent roll calls of the
+    same class are serialized and each one moves the summary by what it actually
+    replaced. SQLite ignores the lock; it allows one writer at a time anyway, and
+    the second roll call fails as busy instead of double counting.
+    """
+    bad_statuses = sorted({status for status in statuses.values() if status not in VALID_STATUSES})
+    if bad_statuses:
+        raise ValidationError(f'Unknown attendance status: {", ".join(bad_statuses)}')
+
+    not_enrolled = set(statuses) - enrolled_student_ids(class_instance)
+    if not_enrolled:
+        raise ValidationError(
+            f'Students not enrolled in {class_instance}: {", ".join(map(str, sorted(not_enrolled)))}'
+        )
+
+    records = [
+        Attendance(student_id=student_id, class_instance=class_instance, date=date, status=status)
+        for student_id, status in statuses.items()
+    ]
+    with transaction.atomic():
+        list(Class.objects.select_for_update().filter(pk=class_instance.pk).values_list('pk'))
+        # Statuses being replaced, so the monthly summary can be moved by the difference
+        previous = dict(Attendance.objects.filter(
+            class_instance=class_instance, date=date, student_id__in=statuses,
+        ).values_list('student_id', 'status'))
+        changes = []
+        for record in records:
+            old_status = previous.get(record.student_id)
+            if old_status != record.status:
+                if old_status is not None:
+                    changes.append(((*record.summary_key[:4], old_status), -1))
+                changes.append((record.summary_key, 1))
+
+        Attendance.objects.bulk_create(
+            records,
+            update_conflicts=True,
+            unique_fields=['class_instance', 'date', 'student'],
+            update_fields=['status'],
+            batch_size=500,
+        )
+        apply_summary_changes(changes)
+    return len(records)
+
+
+def apply_summary_changes(changes):
+    """
+    Add (summary_key, +1/-1) changes to AttendanceSummary, where summary_key is
+    Attendance.summary_key. Counters are incremented inside the upsert itself, so
+    concurrent writers never overwrite each other.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for (student_id, class_id, year, month, status), change in changes:
+        deltas[(student_id, class_id, year, month)][0 if status == 'Present' else 1] += change
+    deltas = [(*key, present, absent) for key, (present, absent) in deltas.items() if present or absent]
+    if not deltas:
+        return
+
+    table = connection.ops.quote_name(AttendanceSummary._meta.db_table)
+    for start in range(0, len(deltas), 500):
+        batch = deltas[start:start + 500]
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(batch))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (student_id, class_instance_id, year, month, present, absent) '
+                f'VALUES {placeholders} '
+                f'ON CONFLICT (student_id, class_instance_id, year, month) DO UPDATE SET '
+                f'present = {table}.present + excluded.present, absent = {table}.absent + excluded.absent',
+                [value for row in batch for value in row],
+            )
+
+
+def summary_rows_from_attendance():
+    """Monthly counters computed from the full attendance history, as dicts."""
+    return Attendance.objects.annotate(
+        year=ExtractYear('date'), month=ExtractMonth('date'),
+    ).values('student_id', 'class_instance_id', 'year', 'month').annotate(
+        present=Count('pk', filter=Q(status='Present')),
+        absent=Count('pk', filter=Q(status='Absent')),
+    ).order_by()
+
+
+def rebuild_summary(batch_size=5000):
+    """Replace AttendanceSummary with counters computed from scratch. Returns the row count."""
+    count = 0
+    with transaction.atomic():
+        AttendanceSummary.objects.all().delete()
+        batch = []
+        for row in summary_rows_from_attendance().iterator(chunk_size=batch_size):
+            batch.append(AttendanceSummary(**row))
+            if len(batch) >= batch_size:
+                AttendanceSummary.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        AttendanceSummary.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def verify_summary():
+    """Return the summary keys whose stored counters differ from the attendance history."""
+    expected = {
+        (row['student_id'], row['class_instance_id'], row['year'], row['month']): (row['present'], row['absent'])
+        for row in summary_rows_from_attendance().iterator()
+    }
+    stored = {
+        (student_id, class_id, year, month): (present, absent)
+        for student_id, class_id, year, month, present, absent in AttendanceSummary.objects.values_list(
+            'student_id', 'class_instance_id', 'year', 'month', 'present', 'absent',
+        ).iterator()
+        # Rows emptied by corrections are harmless
+        if present or absent
+    }
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def attendance_rates(student=None, class_instance=None, year=None, month=None):
+    """
+    Monthly attendance rates read from AttendanceSummary, optionally narrowed to a
+    student, a class, a year or a month. Returns dicts with year, month, present,
+    absent and rate (None when nothing was recorded).
+    """
+    summaries = AttendanceSummary.objects.all()
+    if student is not None:
+        summaries = summaries.filter(student=student)
+    if class_instance is not None:
+        summaries = summaries.filter(class_instance=class_instance)
+    if year is not None:
+        summaries = summaries.filter(year=year)
+    if month is not None:
+        summaries = summaries.filter(month=month)
+
+    rates = []
+    for row in summaries.values('year', 'month').annotate(
+        present=Sum('present'), absent=Sum('absent'),
+    ).order_by('year', 'month'):
+        total = row['present'] + row['absent']
+        row['rate'] = row['present'] / total if total else None
+        rates.append(row)
+    return rates
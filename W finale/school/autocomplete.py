@@ -0,0 +1,320 @@
+"""
+Type-ahead for user pickers, answered from memory. Each worker process keeps the
+usernames and names of active users in sorted arrays, one set per role, and
+finds a prefix with a binary search, so a keystroke costs no query.
+
+The index is built from one values_list query by the first query each process
+answers (so a master process that preloads the app and forks workers never
+builds one) and updated from the CustomUser signal handlers once their
+transaction commits. Writes made by other processes are picked up by rebuilding
+in the background every SCHOOL_AUTOCOMPLETE_MAX_AGE seconds.
+"""
+import heapq
+import os
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+
+from .models import CustomUser
+
+Suggestion = namedtuple('Suggestion', ['id', 'username', 'name', 'role'])
+
+# Keys looked at per role for one query at most, so a query that matches many
+# keys but few users (e.g. a common first name and a rare surname) stays cheap
+MAX_SCAN = 1000
+
+# In multi-word queries, words matching up to this many keys narrow the search
+# by intersecting the ids they match; the matches are ranked directly when
+# there are at most RANK_LIMIT of them
+SELECTIVE = 20000
+RANK_LIMIT = 64
+
+# Seconds a query waits for the first build of the index started by another
+# query, before answering with no suggestions
+BUILD_WAIT = 2.0
+
+
+def normalize(text):
+    """Lowercase and drop accents, so 'zoe' finds 'Zoë'."""
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def user_keys(username, first_name, last_name):
+    """The normalized words a user can be found by."""
+    words = [normalize(username), *normalize(f'{first_name} {last_name}').split()]
+    return tuple(dict.fromkeys(word for word in words if word))
+
+
+def has_prefixes(keys, words):
+    """Whether every word is the prefix of one of the keys."""
+    for word in words:
+        for key in keys:
+            if key.startswith(word):
+                break
+        else:
+            return False
+    return True
+
+
+class Partition:
+    """Sorted keys with the id of the user each belongs to, in parallel arrays."""
+
+    __slots__ = ('keys', 'ids')
+
+    def __init__(self, pairs=()):
+        pairs = sorted(pairs)
+        self.keys = [key for key, user_id in pairs]
+        self.ids = array('q', (user_id for key, user_id in pairs))
+
+    def add(self, key, user_id):
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.ids.insert(index, user_id)
+
+    def remove(self, key, user_id):
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.ids[index] == user_id:
+                del self.keys[index]
+                del self.ids[index]
+                return
+            index += 1
+
+    def span(self, prefix):
+        """Positions [start, end) of the keys starting with `prefix`."""
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + '\U0010ffff')
+
+    def scan(self, prefix):
+        """Yield (key, user id) of the keys starting with `prefix`, in key order."""
+        start, end = self.span(prefix)
+        for index in range(start, end):
+            yield self.keys[index], self.ids[index]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()  # One build at a time
+        self.partitions = None
+        self.users = {}  # id: (Suggestion, keys)
+        self.built_at = None
+        self.rebuilding = False
+        self.pending = []  # Updates made while a rebuild was reading the table
+
+    @property
+    def ready(self):
+        return self.partitions is not None
+
+    def load(self, rows):
+        """Replace the index with `rows` of (id, username, first_name, last_name, role)."""
+        pairs = {}
+        users = {}
+        for user_id, username, first_name, last_name, role in rows:
+            keys = user_keys(username, first_name, last_name)
+            users[user_id] = (Suggestion(user_id, username, f'{first_name} {last_name}'.strip() or username, role), keys)
+            pairs.setdefault(role, []).extend((key, user_id) for key in keys)
+        partitions = {role: Partition(role_pairs) for role, role_pairs in pairs.items()}
+        with self.lock:
+            self.partitions, self.users, self.built_at = partitions, users, time.monotonic()
+            self.rebuilding = False
+            pending, self.pending = self.pending, []
+        # Writes seen while the table was being read may be missing from it
+        for update in pending:
+            update()
+
+    def build(self):
+        """Load every active user with one query."""
+        with self.build_lock:
+            self._build()
+
+    def _build(self):
+        with self.lock:
+            self.rebuilding = True
+            self.pending = []
+        try:
+            self.load(CustomUser.objects.filter(is_active=True).values_list(
+                'pk', 'username', 'first_name', 'last_name', 'role',
+            ).iterator(chunk_size=10000))
+        finally:
+            self.rebuilding = False
+
+    def ensure_built(self):
+        """
+        Build the index if this process has none yet. Queries arriving during
+        that build wait up to BUILD_WAIT seconds for it instead of building
+        again. Returns whether the index is ready.
+        """
+        if self.ready:
+            return True
+        if not self.build_lock.acquire(timeout=BUILD_WAIT):
+            return self.ready
+        try:
+            if not self.ready:
+                self._build()
+        finally:
+            self.build_lock.release()
+        return True
+
+    def warm(self):
+        """Build the index in a background thread."""
+        def build():
+            try:
+                self.build()
+            finally:
+                connection.close()
+        threading.Thread(target=build, name='autocomplete-build', daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.partitions, self.users, self.built_at, self.pending = None, {}, None, []
+
+    def _remove(self, user_id):
+        entry = self.users.pop(user_id, None)
+        if entry is not None:
+            suggestion, keys = entry
+            for key in keys:
+                self.partitions[suggestion.role].remove(key, user_id)
+
+    def update(self, user_id, username, first_name, last_name, role, is_active=True):
+        """Add, refresh or (for an inactive user) drop one user."""
+        with self.lock:
+            if self.rebuilding:
+                self.pending.append(lambda: self.update(user_id, username, first_name, last_name, role, is_active))
+            if self.partitions is None:
+                return
+            self._remove(user_id)
+            if not is_active:
+                return
+            keys = user_keys(username, first_name, last_name)
+            name = f'{first_name} {last_name}'.strip() or username
+            self.users[user_id] = (Suggestion(user_id, username, name, role), keys)
+            partition = self.partitions.setdefault(role, Partition())
+            for key in keys:
+                partition.add(key, user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            if self.rebuilding:
+                self.pending.append(lambda: self.remove(user_id))
+            if self.partitions is not None:
+                self._remove(user_id)
+
+    def complete(self, query, role=None, limit=10):
+        """
+        Up to `limit` users with a word starting with the first word of `query`
+        and, for the other words, a word starting with each; in key order.
+        """
+        words = normalize(query).split()
+        if not words:
+            return []
+        if not self.ensure_built():
+            return []
+        self.refresh_if_stale()
+        with self.lock:
+            partitions = [self.partitions.get(role)] if role else list(self.partitions.values())
+            partitions = [partition for partition in partitions if partition]
+            candidates = self._candidates(words, partitions) if len(words) > 1 else None
+            if candidates is not None and len(candidates) <= RANK_LIMIT:
+                return self._ranked(candidates, words, limit)
+            suggestions, complete = self._scanned(words, partitions, limit, candidates)
+            if complete:
+                return suggestions
+            # Some matches may lie beyond the first MAX_SCAN keys: rank every user
+            # matching the narrowest word instead
+            return self._ranked(self._narrowest(words, partitions, candidates), words, limit)
+
+    def _candidates(self, words, partitions):
+        """
+        Users with a key starting with each of the words that match few keys, by
+        intersecting id sets; None when no word is selective enough.
+        """
+        candidates = None
+        for word in words:
+            ranges = [(partition, *partition.span(word)) for partition in partitions]
+            if sum(end - start for partition, start, end in ranges) > SELECTIVE:
+                continue
+            ids = set()
+            for partition, start, end in ranges:
+                ids.update(partition.ids[start:end])
+            candidates = ids if candidates is None else candidates & ids
+        return candidates
+
+    def _narrowest(self, words, partitions, candidates=None):
+        """The users with a key starting with the word that matches the fewest keys."""
+        spans = {word: [(partition, *partition.span(word)) for partition in partitions] for word in words}
+        word = min(words, key=lambda word: sum(end - start for partition, start, end in spans[word]))
+        ids = set()
+        for partition, start, end in spans[word]:
+            ids.update(partition.ids[start:end])
+        return ids if candidates is None else ids & candidates
+
+    def _ranked(self, candidates, words, limit):
+        first = words[0]
+        matches = []
+        for user_id in candidates:
+            suggestion, keys = self.users[user_id]
+            if has_prefixes(keys, words):
+                matches.append((min(own for own in keys if own.startswith(first)), user_id, suggestion))
+        return [suggestion for key, user_id, suggestion in heapq.nsmallest(limit, matches)]
+
+    def _scanned(self, words, partitions, limit, candidates=None):
+        """
+        The first `limit` matches of each partition in key order, merged, and
+        whether they are complete: False when a partition stopped at MAX_SCAN keys
+        before finding `limit` matches.
+        """
+        first, rest = words[0], words[1:]
+        matches = []
+        complete = True
+        for partition in partitions:
+            keys, ids = partition.keys, partition.ids
+            start, end = partition.span(first)
+            found = 0
+            seen = set()
+            stop = min(end, start + MAX_SCAN)
+            for index in range(start, stop):
+                user_id = ids[index]
+                if user_id in seen or candidates is not None and user_id not in candidates:
+                    continue
+                suggestion, own = self.users[user_id]
+                if rest and not has_prefixes(own, rest):
+                    continue
+                seen.add(user_id)
+                matches.append((keys[index], user_id, suggestion))
+                found += 1
+                if found == limit:
+                    break
+            else:
+                if stop < end:
+                    complete = False
+        return [suggestion for key, user_id, suggestion in heapq.nsmallest(limit, matches)], complete
+
+    def refresh_if_stale(self):
+        max_age = getattr(settings, 'SCHOOL_AUTOCOMPLETE_MAX_AGE', 300)
+        if max_age is None or self.rebuilding or time.monotonic() - self.built_at < max_age:
+            return
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        self.warm()
+
+
+autocomplete = AutocompleteIndex()
+
+# A forked worker starts without the parent's index, and with fresh locks in
+# case a thread of the parent held one
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=autocomplete.__init__)
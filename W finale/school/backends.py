@@ -0,0 +1,113 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import BaseBackend, ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+from .rules import has_object_perm, rules
+
+# Version of everything that affects all users at once (Permission rows themselves)
+GLOBAL_VERSION_KEY = 'perms:version'
+
+
+def permission_cache():
+    return caches[getattr(settings, 'SCHOOL_PERMISSION_CACHE', 'default')]
+
+
+def _version_key(user_id):
+    return f'perms:version:{user_id}'
+
+
+def _new_version():
+    # Random tokens instead of integers, so an evicted version key can never
+    # bring an older cached permission set back to life
+    return uuid4().hex[:12]
+
+
+def _bump_now_and_on_commit(bump):
+    # The bump takes effect at once for the current transaction's own reads, and
+    # again once it commits: a concurrent request may have cached the old
+    # permissions under the first new version before the change was visible
+    bump()
+    transaction.on_commit(bump)
+
+
+def bump_permission_versions(user_ids):
+    """Invalidate the cached permission sets of the given users."""
+    keys = [_version_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        _bump_now_and_on_commit(
+            lambda: permission_cache().set_many({key: _new_version() for key in keys}, timeout=None)
+        )
+
+
+def bump_global_permission_version():
+    """Invalidate the cached permission sets of every user."""
+    _bump_now_and_on_commit(lambda: permission_cache().set(GLOBAL_VERSION_KEY, _new_version(), timeout=None))
+
+
+def permission_cache_key(user):
+    cache = permission_cache()
+    user_key = _version_key(user.pk)
+    versions = cache.get_many([GLOBAL_VERSION_KEY, user_key])
+    for key in (GLOBAL_VERSION_KEY, user_key):
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+    # Superusers are granted every permission, so the flag is part of the key
+    return f'perms:{user.pk}:{int(user.is_superuser)}:{versions[GLOBAL_VERSION_KEY]}:{versions[user_key]}'
+
+
+class CachedPermissionBackend(ModelBackend):
+    """
+    ModelBackend that keeps each user's resolved permission set in a shared cache,
+    so it is computed once per version instead of once per request.
+    """
+
+    def get_user(self, user_id):
+        # Load the session's user and its role profile in one query
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.with_profile().get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = await UserModel._default_manager.with_profile().aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            cache = permission_cache()
+            key = permission_cache_key(user_obj)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, getattr(settings, 'SCHOOL_PERMISSION_CACHE_TIMEOUT', 24 * 60 * 60))
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
+
+
+class RuleBackend(BaseBackend):
+    """
+    Object permissions from the rule registry in school/rules.py: has_perm(perm, obj)
+    is true when the user holds perm on every row, or when a rule for their role
+    covers obj. Model-wide checks (obj=None) are left to CachedPermissionBackend.
+    """
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if obj is None or user_obj.is_anonymous:
+            return False
+        return has_object_perm(user_obj, perm, obj)
+
+    def has_module_perms(self, user_obj, app_label):
+        return user_obj.is_active and not user_obj.is_anonymous and bool(rules.perms_for(user_obj.role, app_label))
@@ -0,0 +1,175 @@
+"""
+In-process load benchmark: seeds a fixed dataset, drives the views through the
+test client and reports latency percentiles and throughput per scenario. Run it
+with `manage.py benchmark`, which uses a throwaway test database.
+"""
+import math
+import time
+from abc import ABC, abstractmethod
+
+from django.test import Client
+
+from .generator import GENERATED_PASSWORD, ROLE_CYCLE, SchoolGenerator, username
+from .models import CustomUser
+
+# Dataset sizes (users) the benchmark can seed
+SIZES = {'1k': 1_000, '100k': 100_000, '1m': 1_000_000}
+
+BENCHMARK_PASSWORD = GENERATED_PASSWORD
+
+
+def bench_username(n):
+    return username('bench', n)
+
+
+def seed_users(count, batch_size=50000):
+    """
+    Generate a school of `count` users (people and classes, no history) plus a staff
+    superuser 'benchstaff' for the views that need one. Returns it.
+    """
+    SchoolGenerator(count, prefix='bench', years=0, batch_size=batch_size).generate()
+    return CustomUser.objects.create_user(
+        'benchstaff', password=BENCHMARK_PASSWORD, role='staff', is_staff=True, is_superuser=True,
+    )
+
+
+class Scenario(ABC):
+    """One kind of request. request(client, i) sends the i-th request and returns the response."""
+
+    name = None
+    expected_status = 200
+    needs_login = True
+
+    def __init__(self, users, staff):
+        self.users = users
+        self.staff = staff
+
+    @abstractmethod
+    def request(self, client, i):
+        """Send the i-th request with `client` and return the response."""
+
+
+class Registration(Scenario):
+    name = 'register'
+    expected_status = 302
+    needs_login = False
+
+    def request(self, client, i):
+        return client.post('/register/', {
+            'username': f'newbench{i:07d}', 'email': f'newbench{i}@example.com', 'role': 'student',
+            'password1': BENCHMARK_PASSWORD, 'password2': BENCHMARK_PASSWORD,
+        })
+
+
+class Login(Scenario):
+    name = 'login'
+    expected_status = 302
+    needs_login = False
+
+    def request(self, client, i):
+        return client.post('/login/', {'username': bench_username(i % self.users), 'password': BENCHMARK_PASSWORD})
+
+
+class PermissionCheck(Scenario):
+    name = 'check_permissions'
+
+    def request(self, client, i):
+        return client.get('/check-permissions/', {'username': bench_username(i % self.users)})
+
+
+class UserListing(Scenario):
+    """Walks the JSON user listing page by page, so later requests read deep pages."""
+
+    name = 'user_list'
+    cursor = None
+
+    def request(self, client, i):
+        response = client.get('/api/users/', {'per_page': 50, 'count': 'estimate', 'cursor': self.cursor or ''})
+        self.cursor = response.json()['next_cursor']
+        return response
+
+
+class AdminChangelist(Scenario):
+    name = 'admin_changelist'
+
+    def request(self, client, i):
+        pages = max(1, math.ceil(self.users * ROLE_CYCLE.count('student') / len(ROLE_CYCLE) / 100))
+        return client.get('/admin/school/studentprofile/', {'p': i % pages + 1})
+
+
+class Autocomplete(Scenario):
+    """Type-ahead for short and long prefixes of usernames and names, with and without a role."""
+
+    name = 'autocomplete'
+    queries = [
+        ('a', ''), ('be', 'student'), ('bench00', ''), ('hana g', ''), ('lena i', 'parent'), ('kha', 'teacher'),
+        ('diaz', ''), ('bench0000', 'student'),
+    ]
+
+    def request(self, client, i):
+        query, role = self.queries[i % len(self.queries)]
+        return client.get('/api/users/autocomplete/', {'q': query, 'role': role})
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (
+    Registration, Login, PermissionCheck, UserListing, AdminChangelist, Autocomplete,
+)}
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+def measure(scenario, requests, warmup=5):
+    client = Client()
+    if scenario.needs_login:
+        client.force_login(scenario.staff)
+    for i in range(warmup):
+        scenario.request(client, requests + i)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        sent = time.perf_counter()
+        response = scenario.request(client, i)
+        latencies.append(time.perf_counter() - sent)
+        if response.status_code != scenario.expected_status:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'rps': round(requests / elapsed, 1),
+    }
+
+
+def run_benchmark(users, staff, requests, scenarios=None):
+    """{scenario name: stats} for the seeded dataset of `users` users."""
+    return {
+        name: measure(SCENARIOS[name](users, staff), requests)
+        for name in scenarios or SCENARIOS
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regressions of `results` against a baseline run: a scenario whose p95 latency
+    grew, or whose throughput fell, by more than `tolerance`.
+    """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['rps'] < previous['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {previous['rps']} -> {current['rps']} requests/s")
+    return regressions
@@ -0,0 +1,221 @@
+"""
+Data for the role dashboards. Each dashboard is a handful of independent queries,
+fetched at the same time with asyncio.gather so a dashboard takes about as long as
+its slowest query rather than the sum of all of them.
+
+Django's async ORM runs every query on one shared thread, so gathering async
+queries would still run them one after another. The loaders are plain sync
+functions instead, each run by gather_queries() in its own thread with its own
+database connection.
+"""
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, Count, IntegerField, Sum, When
+from django.utils import timezone
+
+from .models import AttendanceSummary, Class, CustomUser, Exam, Fee, FeeReminder, Grade, Schedule
+
+
+def _in_own_connection(loader):
+    def run(*args):
+        try:
+            return loader(*args)
+        finally:
+            # The worker thread's connection is not closed by the request cycle
+            close_old_connections()
+    return run
+
+
+async def gather_queries(**loaders):
+    """
+    Run {name: (function, *args)} concurrently and return {name: result}. With
+    SCHOOL_DASHBOARD_PARALLEL off (e.g. in tests, whose data other connections
+    cannot see) they run one after another on the request's connection instead.
+    """
+    parallel = getattr(settings, 'SCHOOL_DASHBOARD_PARALLEL', True)
+    calls = [
+        sync_to_async(_in_own_connection(function), thread_sensitive=False)(*args) if parallel
+        else sync_to_async(function)(*args)
+        for function, *args in loaders.values()
+    ]
+    return dict(zip(loaders, await asyncio.gather(*calls)))
+
+
+def attendance_by_student(student_ids):
+    """{student id: [{class, present, absent, rate}]} over all recorded months."""
+    rows = defaultdict(list)
+    for row in AttendanceSummary.objects.filter(student_id__in=student_ids).values(
+        'student_id', 'class_instance__title',
+    ).annotate(present=Sum('present'), absent=Sum('absent')).order_by('student_id', 'class_instance__title'):
+        total = row['present'] + row['absent']
+        rows[row['student_id']].append({
+            'class': row['class_instance__title'], 'present': row['present'], 'absent': row['absent'],
+            'rate': row['present'] / total if total else None,
+        })
+    return rows
+
+
+def recent_grades_by_student(student_ids, limit=10):
+    """{student id: the latest `limit` grades}, newest first."""
+    rows = defaultdict(list)
+    for row in Grade.objects.filter(student_id__in=student_ids).order_by('student_id', '-exam__date').values(
+        'student_id', 'exam__title', 'exam__subject__name', 'exam__date', 'grade_value',
+    ):
+        grades = rows[row['student_id']]
+        if len(grades) < limit:
+            grades.append({
+                'exam': row['exam__title'] or f"{row['exam__subject__name']} exam",
+                'subject': row['exam__subject__name'], 'date': row['exam__date'].isoformat(),
+                'grade': str(row['grade_value']),
+            })
+    return rows
+
+
+def unpaid_fees_by_student(student_ids):
+    rows = defaultdict(list)
+    for row in Fee.objects.unpaid().filter(student_id__in=student_ids).order_by('student_id', 'due_date').values(
+        'student_id', 'amount_due', 'due_date',
+    ):
+        rows[row['student_id']].append({'amount': str(row['amount_due']), 'due_date': row['due_date'].isoformat()})
+    return rows
+
+
+def in_choice_order(field, choices):
+    """Sorts `field` by its position in `choices`, e.g. Monday before Friday."""
+    return Case(
+        *(When(**{field: value}, then=position) for position, (value, label) in enumerate(choices)),
+        output_field=IntegerField(),
+    )
+
+
+TIMETABLE_ORDER = (
+    in_choice_order('day_of_week', Schedule.DAY_CHOICES), in_choice_order('section', Schedule.SECTION_CHOICES),
+)
+
+
+def timetable_by_student(student_ids):
+    rows = defaultdict(list)
+    for row in Schedule.objects.filter(class_instance__students__in=student_ids).order_by(*TIMETABLE_ORDER).values('class_instance__students', 'class_instance__title', 'day_of_week', 'section', 'class_instance__room_number'):
+        rows[row['class_instance__students']].append({
+            'class': row['class_instance__title'], 'day': row['day_of_week'], 'section': row['section'],
+            'room': row['class_instance__room_number'],
+        })
+    return rows
+
+
+def student_names(student_ids):
+    return {
+        pk: f'{first} {last}'.strip() or username
+        for pk, username, first, last in CustomUser.objects.filter(studentprofile__in=student_ids).values_list(
+            'studentprofile', 'username', 'first_name', 'last_name',
+        )
+    }
+
+
+def teacher_classes(teacher_id):
+    return list(Class.objects.filter(assigned_teacher_id=teacher_id).annotate(
+        student_count=Count('students'),
+    ).order_by('title').values('id', 'title', 'room_number', 'student_count'))
+
+
+def class_attendance_rates(teacher_id):
+    rates = {}
+    for row in AttendanceSummary.objects.filter(class_instance__assigned_teacher_id=teacher_id).values(
+        'class_instance_id',
+    ).annotate(present=Sum('present'), absent=Sum('absent')).order_by():
+        total = row['present'] + row['absent']
+        rates[row['class_instance_id']] = row['present'] / total if total else None
+    return rates
+
+
+def upcoming_exams(teacher_id, today):
+    return [
+        {'class': row['class_instance__title'], 'exam': row['title'] or f"{row['subject__name']} exam", 'date': row['date'].isoformat()}
+        for row in Exam.objects.filter(class_instance__assigned_teacher_id=teacher_id, date__gte=today).order_by('date').values(
+            'class_instance__title', 'title', 'subject__name', 'date',
+        )[:20]
+    ]
+
+
+def teacher_timetable(teacher_id):
+    return [
+        {'class': row['class_instance__title'], 'day': row['day_of_week'], 'section': row['section']}
+        for row in Schedule.objects.filter(class_instance__assigned_teacher_id=teacher_id).order_by(
+            *TIMETABLE_ORDER,
+        ).values('class_instance__title', 'day_of_week', 'section')
+    ]
+
+
+def users_by_role():
+    return dict(CustomUser.objects.values_list('role').annotate(count=Count('pk')).order_by())
+
+
+def overdue_fee_totals(today):
+    totals = Fee.objects.overdue(today).aggregate(amount=Sum('amount_due'), count=Count('pk'), students=Count('student', distinct=True))
+    return {'amount': str(totals['amount'] or 0), 'count': totals['count'], 'students': totals['students']}
+
+
+def pending_reminders():
+    return FeeReminder.objects.filter(sent_at__isnull=True).count()
+
+
+def attendance_this_month(today):
+    totals = AttendanceSummary.objects.filter(year=today.year, month=today.month).aggregate(
+        present=Sum('present'), absent=Sum('absent'),
+    )
+    present, absent = totals['present'] or 0, totals['absent'] or 0
+    return {'present': present, 'absent': absent, 'rate': present / (present + absent) if present + absent else None}
+
+
+def students_view(student_ids, data):
+    return [
+        {
+            'id': pk, 'name': data['names'].get(pk), 'attendance': data['attendance'].get(pk, []),
+            'grades': data['grades'].get(pk, []), 'fees': data['fees'].get(pk, []),
+            'timetable': data['timetable'].get(pk, []),
+        }
+        for pk in student_ids
+    ]
+
+
+async def dashboard_data(user):
+    """The dashboard of a user's role as plain, JSON-ready data."""
+    profile = user.profile
+    today = timezone.localdate()
+    if user.role in ('student', 'parent') and profile is not None:
+        if user.role == 'parent':
+            student_ids = [pk async for pk in profile.children.order_by('pk').values_list('pk', flat=True)]
+        else:
+            student_ids = [profile.pk]
+        data = await gather_queries(
+            names=(student_names, student_ids),
+            attendance=(attendance_by_student, student_ids),
+            grades=(recent_grades_by_student, student_ids),
+            fees=(unpaid_fees_by_student, student_ids),
+            timetable=(timetable_by_student, student_ids),
+        )
+        return {'role': user.role, 'students': students_view(student_ids, data)}
+
+    if user.role == 'teacher' and profile is not None:
+        data = await gather_queries(
+            classes=(teacher_classes, profile.pk),
+            attendance=(class_attendance_rates, profile.pk),
+            exams=(upcoming_exams, profile.pk, today),
+            timetable=(teacher_timetable, profile.pk),
+        )
+        rates = data.pop('attendance')
+        for row in data['classes']:
+            row['attendance_rate'] = rates.get(row['id'])
+        return {'role': user.role, **data}
+
+    data = await gather_queries(
+        users=(users_by_role,),
+        overdue_fees=(overdue_fee_totals, today),
+        pending_reminders=(pending_reminders,),
+        attendance=(attendance_this_month, today),
+    )
+    return {'role': user.role, **data}
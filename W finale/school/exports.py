@@ -0,0 +1,113 @@
+import csv
+import json
+
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from .models import Attendance, CustomUser, Fee, Grade
+
+# Rows are read straight off the cursor in chunks of this size, so memory use
+# does not depend on the size of the export
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def user_rows(role=None, class_id=None, start=None, end=None):
+    users = CustomUser.objects.annotate(
+        profile_id=Coalesce(
+            'adminprofile__id', 'staffprofile__id', 'teacherprofile__id', 'studentprofile__id', 'parentprofile__id',
+        ),
+    )
+    if role:
+        users = users.filter(role=role)
+    if class_id:
+        users = users.filter(studentprofile__classes=class_id)
+    if start:
+        users = users.filter(date_joined__date__gte=start)
+    if end:
+        users = users.filter(date_joined__date__lte=end)
+    fields = ('id', 'username', 'first_name', 'last_name', 'email', 'role', 'profile_id', 'is_active', 'date_joined')
+    return fields, users.order_by('pk').values_list(*fields)
+
+
+def attendance_rows(role=None, class_id=None, start=None, end=None):
+    records = Attendance.objects.all()
+    if class_id:
+        records = records.filter(class_instance=class_id)
+    if start:
+        records = records.filter(date__gte=start)
+    if end:
+        records = records.filter(date__lte=end)
+    fields = ('id', 'date', 'class_instance_id', 'student_id', 'username', 'status')
+    return fields, records.annotate(username=F('student__user__username')).order_by('pk').values_list(*fields)
+
+
+def grade_rows(role=None, class_id=None, start=None, end=None):
+    grades = Grade.objects.all()
+    if class_id:
+        grades = grades.filter(exam__class_instance=class_id)
+    if start:
+        grades = grades.filter(exam__date__gte=start)
+    if end:
+        grades = grades.filter(exam__date__lte=end)
+    fields = ('id', 'exam_id', 'date', 'class_instance_id', 'subject', 'student_id', 'username', 'grade_value')
+    return fields, grades.annotate(
+        date=F('exam__date'), class_instance_id=F('exam__class_instance_id'), subject=F('exam__subject__name'),
+        username=F('student__user__username'),
+    ).order_by('pk').values_list(*fields)
+
+
+def fee_rows(role=None, class_id=None, start=None, end=None):
+    fees = Fee.objects.all()
+    if class_id:
+        fees = fees.filter(student__classes=class_id)
+    if start:
+        fees = fees.filter(due_date__gte=start)
+    if end:
+        fees = fees.filter(due_date__lte=end)
+    fields = ('id', 'student_id', 'username', 'amount_due', 'due_date', 'paid', 'payment_date')
+    return fields, fees.annotate(username=F('student__user__username')).order_by('pk').values_list(*fields)
+
+
+DATASETS = {
+    'users': user_rows,
+    'attendance': attendance_rows,
+    'grades': grade_rows,
+    'fees': fee_rows,
+}
+
+
+class Echo:
+    """File-like object that hands back what csv.writer writes, instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(dataset, fmt, **filters):
+    """
+    Return an iterator over the lines of an export in CSV or JSONL. Filters: role,
+    class_id, start, end (each dataset applies the ones that make sense for it).
+    Arguments are checked here, before anything is streamed.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f'Unknown export {dataset!r}')
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt!r}')
+    fields, rows = DATASETS[dataset](**filters)
+    return _lines(fields, rows, fmt)
+
+
+def _lines(fields, rows, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield writer.writerow(row)
+    else:
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            yield json.dumps(dict(zip(fields, row)), default=str) + '\n'
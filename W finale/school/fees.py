@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+from .jobs import enqueue
+from .models import Fee, FeeReminder
+
+
+def refresh_fee_statistics():
+    """
+    Refresh the planner statistics of the fee table. Without them SQLite can pick
+    the plain student_id index over the smaller unpaid-only one.
+    """
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(Fee._meta.db_table)}')
+
+
+def outstanding_balance(student):
+    """Total unpaid amount for a student, read from the unpaid rows only."""
+    total = Fee.objects.unpaid().filter(student=student).aggregate(total=Sum('amount_due'))['total']
+    return total or Decimal('0.00')
+
+
+def overdue_arrears(today=None):
+    """Per-student arrears (student_id, total, fee_count, oldest_due_date) in one aggregate query."""
+    return Fee.objects.overdue(today).values('student_id').annotate(
+        total=Sum('amount_due'), fee_count=Count('pk'), oldest_due_date=Min('due_date'),
+    ).order_by('student_id')
+
+
+def queue_fee_reminders(today=None, chunk_size=1000):
+    """
+    Queue one FeeReminder per student in arrears for today's run, inserted in
+    chunks with one transaction each. Re-running on the same day skips students
+    that already have a reminder. The emails are sent by a send_fee_reminders
+    job. Returns the number of arrears rows seen.
+    """
+    today = today or timezone.localdate()
+    seen = 0
+    chunk = []
+
+    def flush():
+        with transaction.atomic():
+            FeeReminder.objects.bulk_create(chunk, ignore_conflicts=True)
+        chunk.clear()
+
+    for row in overdue_arrears(today).iterator(chunk_size=chunk_size):
+        chunk.append(FeeReminder(
+            student_id=row['student_id'], run_date=today, amount=row['total'],
+            fee_count=row['fee_count'], oldest_due_date=row['oldest_due_date'],
+        ))
+        seen += 1
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    if seen:
+        enqueue('send_fee_reminders', {'run_date': today.isoformat()})
+    return seen
@@ -0,0 +1,234 @@
+"""
+Deterministic synthetic school: users in every role with their profiles and
+groups, classes and enrolments, parent-child links, and years of attendance,
+exams, grades and fees. Rows are written with executemany in large
+transactions, bypassing model save() and signals, so millions of rows take
+minutes.
+"""
+import math
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import (
+    Attendance, AttendanceSummary, Class, CustomUser, Exam, Fee, Grade, ParentProfile, Subject,
+)
+from .roles import ROLE_GROUPS, ROLE_PROFILE_MODELS, role_registry
+from .search import index_users
+from .visibility import rebuild as rebuild_visibility
+
+# Role of user n is ROLE_CYCLE[n % 100], so every school has the same mix
+ROLE_CYCLE = ['admin'] + ['staff'] * 2 + ['teacher'] * 7 + ['parent'] * 20 + ['student'] * 70
+
+GENERATED_PASSWORD = 'school-Pass-2024'
+
+SUBJECTS = ['Mathematics', 'English', 'Science', 'History', 'Geography', 'Art', 'Music', 'Physical Education']
+FIRST_NAMES = ['Amara', 'Ben', 'Chen', 'Dara', 'Eli', 'Farah', 'Gus', 'Hana', 'Ivo', 'Jun', 'Kai', 'Lena', 'Milo', 'Nia']
+LAST_NAMES = ['Adams', 'Baker', 'Costa', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes', 'Ito', 'Jensen', 'Khan', 'Lopez']
+
+
+def username(prefix, n):
+    return f'{prefix}{n:07d}'
+
+
+def school_days(start, count):
+    """The first `count` weekdays from `start`."""
+    days = []
+    day = start
+    while len(days) < count:
+        if day.weekday() < 5:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class SchoolGenerator:
+    """
+    generate() writes a school of `users` users. Everything random comes from a
+    Random(seed), so the same arguments always give the same rows (ids are offset
+    by what is already in the tables). `years=0` writes people and classes only.
+    """
+
+    def __init__(self, users, seed=0, prefix='user', years=1, start=date(2023, 9, 4), school_days=180,
+                 class_size=30, classes_per_student=4, exams_per_year=4, fees_per_year=3,
+                 batch_size=50000, progress=None):
+        self.users = users
+        self.random = random.Random(seed)
+        self.prefix = prefix
+        self.years = years
+        self.start = start
+        self.school_days = school_days
+        self.class_size = class_size
+        self.classes_per_student = min(classes_per_student, len(SUBJECTS))
+        self.exams_per_year = exams_per_year
+        self.fees_per_year = fees_per_year
+        self.batch_size = batch_size
+        self.progress = progress or (lambda message: None)
+        self.counts = {}
+
+    def insert(self, model, fields, rows):
+        """executemany `rows` into a model's table, batch_size rows per transaction."""
+        table = model._meta.db_table
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(table), ', '.join(quote(field) for field in fields), ', '.join(['%s'] * len(fields)),
+        )
+        rows = iter(rows)
+        count = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            count += len(batch)
+        if 'id' in fields:
+            # Rows with explicit ids leave the table's sequence behind on databases
+            # that have one (PostgreSQL), so the next ORM create() would collide
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), [model]):
+                    cursor.execute(statement)
+        self.counts[table] = self.counts.get(table, 0) + count
+        self.progress(f'{table}: {self.counts[table]} rows')
+        return count
+
+    def generate(self):
+        if CustomUser.objects.filter(username=username(self.prefix, 0)).exists():
+            raise ValueError(f'A school with the prefix {self.prefix!r} was already generated.')
+        self.generate_people()
+        self.generate_classes()
+        rebuild_visibility(CustomUser.objects.filter(pk__gte=self.first_user, pk__lt=self.first_user + self.users))
+        for year in range(self.years):
+            start = self.start.replace(year=self.start.year + year)
+            self.generate_year(school_days(start, self.school_days))
+        return self.counts
+
+    def generate_people(self):
+        password = make_password(GENERATED_PASSWORD)
+        joined = datetime.combine(self.start, time(8))
+        if settings.USE_TZ:
+            joined = timezone.make_aware(joined)
+        joined = connection.ops.adapt_datetimefield_value(joined)
+        first_user = self.first_user = next_id(CustomUser)
+        self.user_ids = {role: [] for role in ROLE_PROFILE_MODELS}
+        rows = []
+        for n in range(self.users):
+            role = ROLE_CYCLE[n % len(ROLE_CYCLE)]
+            self.user_ids[role].append(first_user + n)
+            rows.append((
+                first_user + n, password, False, username(self.prefix, n),
+                self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES), f'{username(self.prefix, n)}@example.com',
+                role in ('admin', 'staff'), True, joined, role,
+            ))
+        self.insert(CustomUser, [
+            'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+            'is_staff', 'is_active', 'date_joined', 'role',
+        ], rows)
+        with transaction.atomic():
+            index_users(CustomUser.objects.filter(pk__gte=first_user, pk__lt=first_user + self.users))
+
+        self.profile_ids = {}
+        for role, model in ROLE_PROFILE_MODELS.items():
+            first_profile = next_id(model)
+            self.profile_ids[role] = list(range(first_profile, first_profile + len(self.user_ids[role])))
+            self.insert(model, ['id', 'user_id'], zip(self.profile_ids[role], self.user_ids[role]))
+
+        group_ids = {role: role_registry.get(role).group_id for role in ROLE_GROUPS}
+        self.insert(CustomUser.groups.through, ['customuser_id', 'group_id'], (
+            (user_id, group_ids[role]) for role in ROLE_GROUPS for user_id in self.user_ids[role]
+        ))
+
+        # One to three children per parent
+        students = self.profile_ids['student']
+        if students:
+            self.insert(ParentProfile.children.through, ['parentprofile_id', 'studentprofile_id'], (
+                (parent_id, students[index])
+                for parent_id in self.profile_ids['parent']
+                for index in self.random.sample(range(len(students)), min(len(students), self.random.randint(1, 3)))
+            ))
+
+    def generate_classes(self):
+        subjects = {}
+        for name in SUBJECTS:
+            subjects[name] = Subject.objects.get_or_create(name=name)[0].pk
+        students = self.profile_ids['student']
+        teachers = self.profile_ids['teacher']
+        first_class = next_id(Class)
+
+        # Students are split into cohorts of class_size; each cohort takes
+        # classes_per_student classes together, in different subjects
+        self.classes = []
+        rows = []
+        for cohort, offset in enumerate(range(0, len(students), self.class_size)):
+            members = students[offset:offset + self.class_size]
+            for subject_name in SUBJECTS[:self.classes_per_student]:
+                class_id = first_class + len(self.classes)
+                self.classes.append((class_id, subjects[subject_name], members))
+                teacher = teachers[len(self.classes) % len(teachers)] if teachers else None
+                rows.append((class_id, f'{subject_name} {cohort + 1}', teacher, subjects[subject_name], str(100 + cohort % 400), 1))
+        self.insert(Class, ['id', 'title', 'assigned_teacher_id', 'subject_id', 'room_number', 'weekly_sections'], rows)
+        self.insert(Class.students.through, ['class_id', 'studentprofile_id'], (
+            (class_id, student_id) for class_id, subject_id, members in self.classes for student_id in members
+        ))
+
+    def attendance_rows(self, classes, days, day_values, summaries):
+        for class_id, subject_id, members in classes:
+            counts = {}
+            for day, value in zip(days, day_values):
+                for student_id in members:
+                    present = self.random.random() < 0.93
+                    counts.setdefault((student_id, day.year, day.month), [0, 0])[0 if present else 1] += 1
+                    yield (student_id, class_id, value, 'Present' if present else 'Absent')
+            summaries.extend(
+                (student_id, class_id, year, month, present, absent)
+                for (student_id, year, month), (present, absent) in counts.items()
+            )
+
+    def generate_year(self, days):
+        if not days:
+            return
+        adapt = connection.ops.adapt_datefield_value
+        day_values = [adapt(day) for day in days]
+
+        # Written a chunk of classes at a time; the monthly summaries of a chunk are
+        # counted while its attendance is generated, so memory stays flat
+        for offset in range(0, len(self.classes), 1000):
+            summaries = []
+            self.insert(Attendance, ['student_id', 'class_instance_id', 'date', 'status'],
+                        self.attendance_rows(self.classes[offset:offset + 1000], days, day_values, summaries))
+            self.insert(AttendanceSummary, ['student_id', 'class_instance_id', 'year', 'month', 'present', 'absent'], summaries)
+
+        first_exam = next_id(Exam)
+        exam_days = [days[(len(days) * (n + 1)) // (self.exams_per_year + 1)] for n in range(self.exams_per_year)]
+        exams = []
+        for class_id, subject_id, members in self.classes:
+            for number, day in enumerate(exam_days, 1):
+                exams.append((first_exam + len(exams), class_id, subject_id, adapt(day), f'Term {number} exam', members))
+        self.insert(Exam, ['id', 'class_instance_id', 'subject_id', 'date', 'title'], (exam[:5] for exam in exams))
+        self.insert(Grade, ['exam_id', 'student_id', 'grade_value', 'feedback'], (
+            (exam[0], student_id, Decimal(f'{min(100.0, max(0.0, self.random.gauss(74, 12))):.2f}'), '')
+            for exam in exams for student_id in exam[5]
+        ))
+
+        term = math.ceil(len(days) / max(1, self.fees_per_year))
+        due_dates = [days[min(len(days) - 1, n * term)] for n in range(self.fees_per_year)]
+
+        def fee_rows():
+            for student_id in self.profile_ids['student']:
+                for due in due_dates:
+                    paid = self.random.random() < 0.85
+                    payment = adapt(due - timedelta(days=self.random.randint(0, 20))) if paid else None
+                    yield (student_id, Decimal(self.random.choice(['250.00', '300.00', '450.00'])), adapt(due), paid, payment)
+        self.insert(Fee, ['student_id', 'amount_due', 'due_date', 'paid', 'payment_date'], fee_rows())
@@ -0,0 +1,107 @@
+from collections import namedtuple
+
+import numpy as np
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, ExtractDay, ExtractMonth, ExtractYear
+
+from .models import Grade
+
+# Columns a report can be grouped by, and where they come from
+GROUP_COLUMNS = {
+    'class': F('exam__class_instance_id'),
+    'subject': F('exam__subject_id'),
+    # YYYYMMDD as an integer, so the column loads straight into an int64 array
+    'date': ExtractYear('exam__date') * 10000 + ExtractMonth('exam__date') * 100 + ExtractDay('exam__date'),
+}
+
+# Letter bands for the grade distribution: below 60 is F, 60-69 D, ... 90 and up A
+BAND_EDGES = np.array([60, 70, 80, 90])
+BAND_LABELS = ('F', 'D', 'C', 'B', 'A')
+
+# One entry per group in every array; `keys` maps each group-by column to an array,
+# `percentiles` is (groups, len(percentiles)) and `distribution` is (groups, bands)
+GradeStats = namedtuple('GradeStats', [
+    'keys', 'count', 'mean', 'median', 'std', 'min', 'max', 'percentiles', 'distribution',
+])
+
+
+def load_grade_columns(grades, by):
+    """Read the group-by columns and grade values as one structured array, without model instances."""
+    columns = {name: GROUP_COLUMNS[name] for name in by}
+    rows = grades.annotate(
+        **{f'_{name}': expression for name, expression in columns.items()},
+        _value=Cast('grade_value', FloatField()),
+    ).values_list(*[f'_{name}' for name in by], '_value').order_by()
+    dtype = [(name, np.int64) for name in by] + [('value', np.float64)]
+    return np.fromiter((tuple(row) for row in rows.iterator(chunk_size=10000)), dtype=dtype)
+
+
+def _as_dates(yyyymmdd):
+    years = (yyyymmdd // 10000 - 1970).astype('datetime64[Y]')
+    months = years.astype('datetime64[M]') + (yyyymmdd // 100 % 100 - 1).astype('timedelta64[M]')
+    return months.astype('datetime64[D]') + (yyyymmdd % 100 - 1).astype('timedelta64[D]')
+
+
+def grade_statistics(grades=None, by=('class', 'subject', 'date'), percentiles=(10, 25, 75, 90)):
+    """
+    Grade statistics for every group of `grades` (a Grade queryset, default all),
+    grouped by any of 'class', 'subject' and 'date' (an empty `by` gives one
+    school-wide group). All groups are computed in a single vectorized pass over
+    the sorted values.
+    """
+    unknown = set(by) - GROUP_COLUMNS.keys()
+    if unknown:
+        raise ValueError(f'Cannot group grades by {", ".join(sorted(unknown))}')
+    by = tuple(by)
+    data = load_grade_columns(Grade.objects.all() if grades is None else grades, by)
+
+    # Sort by group, then by value, so each group is a contiguous sorted run
+    order = np.lexsort((data['value'],) + tuple(data[name] for name in reversed(by)))
+    data = data[order]
+    values = data['value']
+
+    if len(values):
+        changed = np.zeros(len(values) - 1, dtype=bool)
+        for name in by:
+            changed |= data[name][1:] != data[name][:-1]
+        starts = np.flatnonzero(np.concatenate(([True], changed)))
+    else:
+        starts = np.zeros(0, dtype=np.intp)
+    counts = np.diff(np.append(starts, len(values)))
+    ends = starts + counts - 1
+
+    if len(values):
+        means = np.add.reduceat(values, starts) / counts
+        deviations = values - np.repeat(means, counts)
+        stds = np.sqrt(np.add.reduceat(deviations * deviations, starts) / counts)
+    else:
+        means = stds = np.zeros(0)
+
+    def percentile(q):
+        # Linear interpolation between the closest ranks, like np.percentile
+        position = starts + (counts - 1) * (q / 100)
+        lower = np.floor(position).astype(np.intp)
+        upper = np.ceil(position).astype(np.intp)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    group_of_row = np.repeat(np.arange(len(starts)), counts)
+    bands = np.digitize(values, BAND_EDGES)
+    distribution = np.bincount(
+        group_of_row * len(BAND_LABELS) + bands, minlength=len(starts) * len(BAND_LABELS),
+    ).reshape(len(starts), len(BAND_LABELS))
+
+    keys = {name: data[name][starts] for name in by}
+    if 'date' in keys:
+        keys['date'] = _as_dates(keys['date'])
+
+    return GradeStats(
+        keys=keys,
+        count=counts,
+        mean=means,
+        median=percentile(50),
+        std=stds,
+        min=values[starts],
+        max=values[ends],
+        percentiles=np.column_stack([percentile(q) for q in percentiles]) if len(percentiles) else np.zeros((len(starts), 0)),
+        distribution=distribution,
+    )
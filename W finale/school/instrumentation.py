@@ -0,0 +1,108 @@
+"""
+SQL instrumentation: count, time and fingerprint every query run on any database
+connection, so repeated statements (N+1 patterns) can be spotted per request or
+per test.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_STRING = re.compile(r"'(?:''|[^'])*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_VALUES_LIST = re.compile(r'(VALUES\s*\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    Normalize SQL so statements that differ only in their values compare equal:
+    literals and placeholders become ?, and lists of them (IN (...), multi-row
+    VALUES) collapse to (...), whatever their length.
+    """
+    sql = sql.replace('%s', '?')
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    sql = _VALUES_LIST.sub(r'\1', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Tallies queries, their total time and their fingerprints, on one database alias or all of them."""
+
+    def __init__(self, using=None):
+        self.using = using
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        # Queries can be reported from several threads (sync_to_async workers)
+        self.lock = threading.Lock()
+
+    def add(self, alias, sql, duration):
+        if self.using is not None and alias != self.using:
+            return
+        with self.lock:
+            self.duration += duration
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def repeated(self, more_than=1):
+        """{fingerprint: count} of the statements run more than `more_than` times, most repeated first."""
+        return {sql: count for sql, count in self.fingerprints.most_common() if count > more_than}
+
+
+# The recorders of the current context. A context variable rather than a wrapper
+# installed on the recording thread's connections, because it follows the
+# request into the threads sync_to_async runs the ORM on (under ASGI the event
+# loop thread runs no queries at all)
+_recorders = ContextVar('school_query_recorders', default=())
+
+
+def _report_to_recorders(execute, sql, params, many, context):
+    recorders = _recorders.get()
+    if not recorders:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for recorder in recorders:
+            recorder.add(context['connection'].alias, sql, duration)
+
+
+def install(connection):
+    """Let the recorders of whichever context runs a query on `connection` see it."""
+    if _report_to_recorders not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_report_to_recorders)
+
+
+@receiver(connection_created)
+def install_on_new_connection(sender, connection, **kwargs):
+    install(connection)
+
+
+@contextmanager
+def record_queries(using=None):
+    """
+    Record the queries run inside the block, on one database alias or all of
+    them, by this context: this thread, and the threads sync_to_async and
+    async_to_sync hand its work to.
+    """
+    recorder = QueryRecorder(using)
+    # Connections opened before this module was imported missed connection_created
+    for alias in [using] if using else connections:
+        install(connections[alias])
+    token = _recorders.set((*_recorders.get(), recorder))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
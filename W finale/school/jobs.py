@@ -0,0 +1,184 @@
+"""
+Database-backed job queue. Jobs are rows of the Job table, so no broker is needed
+and a job enqueued inside a transaction commits or rolls back with the work that
+caused it.
+
+Workers (`manage.py run_jobs`) claim jobs in batches, highest priority first, by
+leasing them for SCHOOL_JOB_LEASE_SECONDS. A job is finished only by the worker
+holding its lease; if that worker dies, the lease runs out and another worker
+claims the job again. Failed jobs are retried with exponential backoff until
+they run out of attempts.
+"""
+import logging
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger('school.jobs')
+
+Task = namedtuple('Task', ['function', 'batch'])
+
+# Registered tasks by name (see school/tasks.py)
+TASKS = {}
+
+CLAIMABLE = ['queued', 'running']
+
+
+def task(name, batch=False):
+    """
+    Register a function as the task `name`. It is called with a job's payload, or,
+    with batch=True, with the payloads of every claimed job of the task at once and
+    returns one entry per payload: None on success, otherwise the exception.
+    """
+    def register(function):
+        TASKS[name] = Task(function, batch)
+        return function
+    return register
+
+
+def lease_seconds():
+    return getattr(settings, 'SCHOOL_JOB_LEASE_SECONDS', 300)
+
+
+def backoff(attempts):
+    """Seconds before retrying a job that failed its `attempts`-th attempt."""
+    base = getattr(settings, 'SCHOOL_JOB_BACKOFF_SECONDS', 30)
+    return min(base * 2 ** (attempts - 1), getattr(settings, 'SCHOOL_JOB_MAX_BACKOFF_SECONDS', 6 * 60 * 60))
+
+
+def enqueue(name, payload=None, priority=0, delay=0, max_attempts=5):
+    return Job.objects.create(
+        name=name, payload=payload or {}, priority=priority, max_attempts=max_attempts,
+        available_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def enqueue_many(name, payloads, priority=0, max_attempts=5, batch_size=1000):
+    """Enqueue one job per payload with bulk INSERTs. Returns the number of jobs."""
+    now = timezone.now()
+    jobs = [Job(name=name, payload=payload, priority=priority, max_attempts=max_attempts, available_at=now, created_at=now)
+            for payload in payloads]
+    Job.objects.bulk_create(jobs, batch_size=batch_size)
+    return len(jobs)
+
+
+def claim(limit=10, names=None, lease=None):
+    """
+    Lease up to `limit` claimable jobs and return them. The jobs are picked and
+    leased by a single UPDATE whose conditions are checked again on every row,
+    so two workers never hold the same job.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+
+    # A job whose lease ran out on its last attempt is not retried again
+    Job.objects.filter(status='running', available_at__lte=now, attempts__gte=F('max_attempts')).update(
+        status='failed', lease='', finished_at=now, last_error='Lease expired on the last attempt.',
+    )
+
+    claimable = Job.objects.filter(status__in=CLAIMABLE, available_at__lte=now)
+    if names:
+        claimable = claimable.filter(name__in=names)
+    picked = claimable.order_by('-priority', 'available_at', 'id').values('id')[:limit]
+    claimable.filter(pk__in=picked).update(
+        status='running', lease=token, attempts=F('attempts') + 1,
+        available_at=now + timedelta(seconds=lease or lease_seconds()),
+    )
+    return list(Job.objects.filter(status__in=CLAIMABLE, lease=token).order_by('-priority', 'available_at', 'id'))
+
+
+def complete(job):
+    """Mark a leased job done. Returns False if the job's lease was lost meanwhile."""
+    return bool(Job.objects.filter(pk=job.pk, status='running', lease=job.lease).update(
+        status='done', lease='', finished_at=timezone.now(),
+    ))
+
+
+def fail(job, error):
+    """Schedule a retry of a leased job, or fail it for good after its last attempt."""
+    now = timezone.now()
+    message = f'{type(error).__name__}: {error}'
+    if job.attempts >= job.max_attempts:
+        changes = {'status': 'failed', 'finished_at': now}
+    else:
+        changes = {'status': 'queued', 'available_at': now + timedelta(seconds=backoff(job.attempts))}
+    return bool(Job.objects.filter(pk=job.pk, status='running', lease=job.lease).update(
+        lease='', last_error=message, **changes,
+    ))
+
+
+def run_jobs(jobs):
+    """Run claimed jobs, grouping those of batch tasks into one call. Returns {'done': n, 'failed': n}."""
+    stats = {'done': 0, 'failed': 0}
+
+    def finish(job, error):
+        if error is None:
+            complete(job)
+            stats['done'] += 1
+        else:
+            fail(job, error)
+            stats['failed'] += 1
+
+    by_name = {}
+    for job in jobs:
+        by_name.setdefault(job.name, []).append(job)
+    for name, group in by_name.items():
+        registered = TASKS.get(name)
+        if registered is None:
+            for job in group:
+                job.attempts = job.max_attempts
+                finish(job, LookupError(f'Unknown task {name!r}'))
+        elif registered.batch:
+            try:
+                errors = registered.function([job.payload for job in group])
+            except Exception as error:
+                logger.exception('Batch of %s %s jobs failed', len(group), name)
+                errors = [error] * len(group)
+            for job, error in zip(group, errors):
+                if error is not None:
+                    logger.warning('Job %s (%s) failed on attempt %s: %r', job.pk, name, job.attempts, error)
+                finish(job, error)
+        else:
+            for job in group:
+                try:
+                    with transaction.atomic():
+                        registered.function(job.payload)
+                except Exception as error:
+                    logger.exception('Job %s (%s) failed on attempt %s', job.pk, name, job.attempts)
+                    finish(job, error)
+                else:
+                    finish(job, None)
+    return stats
+
+
+def work(batch=10, names=None, lease=None, idle_sleep=1.0, once=False, max_jobs=None, stop=lambda: False):
+    """
+    Claim and run jobs until stop() is true, `max_jobs` jobs have run, or, with
+    once=True, no job is claimable. Returns the totals of run_jobs().
+    """
+    totals = {'done': 0, 'failed': 0}
+    while not stop() and (max_jobs is None or sum(totals.values()) < max_jobs):
+        limit = batch if max_jobs is None else min(batch, max_jobs - sum(totals.values()))
+        jobs = claim(limit, names=names, lease=lease)
+        if not jobs:
+            if once:
+                break
+            time.sleep(idle_sleep)
+            continue
+        for key, count in run_jobs(jobs).items():
+            totals[key] += count
+    return totals
+
+
+def purge_finished(days=7):
+    """Delete done and failed jobs that finished more than `days` days ago. Returns how many."""
+    cutoff = timezone.now() - timedelta(days=days)
+    return Job.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff).delete()[0]
@@ -0,0 +1,94 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.utils import timezone
+
+from school.benchmark import SCENARIOS, SIZES, compare, run_benchmark, seed_users
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark registration, login, permission checks and list views in-process against '
+        'a throwaway test database seeded with a fixed dataset. Writes latency percentiles and '
+        'throughput as JSON and, given a baseline run, fails on regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', default='1k', help=f'Seeded users: {", ".join(SIZES)} or a number')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--scenario', dest='scenarios', action='append', choices=list(SCENARIOS),
+                            help='Scenario to run (repeatable, default all)')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95/throughput change against the baseline (0.2 = 20%%)')
+        parser.add_argument('--fast-hashers', action='store_true',
+                            help='Hash passwords with MD5, to measure everything but the hashing cost')
+        parser.add_argument('--label', help='Name for this run (default: the git commit)')
+
+    def handle(self, *args, **options):
+        size = options['size'].lower()
+        try:
+            users = SIZES[size] if size in SIZES else int(size)
+        except ValueError:
+            raise CommandError(f'Unknown size {size}.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+
+        setup_test_environment(debug=False)
+        databases = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+        try:
+            hashers = ['django.contrib.auth.hashers.MD5PasswordHasher'] if options['fast_hashers'] else None
+            with override_settings(**({'PASSWORD_HASHERS': hashers} if hashers else {})):
+                self.stdout.write(f'Seeding {users} users...')
+                staff = seed_users(users)
+                self.stdout.write(f"Running {options['requests']} requests per scenario...")
+                scenarios = run_benchmark(users, staff, options['requests'], options['scenarios'])
+                vendor = connection.vendor
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+
+        results = {
+            'label': options['label'] or git_commit(),
+            'created': timezone.now().isoformat(),
+            'users': users,
+            'database': vendor,
+            'fast_hashers': options['fast_hashers'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'scenarios': scenarios,
+        }
+        for name, stats in scenarios.items():
+            self.stdout.write(
+                f"{name:<20} p50 {stats['p50_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms  "
+                f"p99 {stats['p99_ms']:>9.2f}ms  {stats['rps']:>8.1f} req/s  {stats['errors']} errors"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {baseline.get('label') or options['baseline']}"))
@@ -0,0 +1,35 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from school.exports import DATASETS, FORMATS, export_lines
+from school.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Stream an export of users, attendance, grades or fees as CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=list(DATASETS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write (default: standard output)')
+        parser.add_argument('--role', choices=[role for role, label in CustomUser.ROLE_CHOICES])
+        parser.add_argument('--class', dest='class_id', type=int)
+        parser.add_argument('--from', dest='start', type=date.fromisoformat)
+        parser.add_argument('--to', dest='end', type=date.fromisoformat)
+
+    def handle(self, *args, **options):
+        try:
+            lines = export_lines(
+                options['dataset'], options['format'], role=options['role'], class_id=options['class_id'],
+                start=options['start'], end=options['end'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,194 @@
+import os
+import tempfile
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.template.loader import render_to_string
+
+from school.models import AttendanceSummary, Class, Grade, StudentProfile
+
+
+def _init_worker():
+    # Worker processes need the app registry to load templates
+    django.setup()
+
+
+def write_atomically(path, content):
+    """Write through a temporary file in the same directory, so a report is either complete or absent."""
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as output:
+            output.write(content)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def render_text_report(report):
+    lines = [
+        f"Progress report: {report['name']} ({report['username']})",
+        f"Session: {report['session']}",
+        '',
+        f"{'Subject':<20}{'Exam':<24}{'Date':<12}{'Grade':>8}",
+    ]
+    for grade in report['grades']:
+        lines.append(f"{grade['subject']:<20}{grade['exam'][:23]:<24}{grade['date']:<12}{grade['value']:>8.2f}")
+    lines += ['', f"{'Subject':<20}{'Average':>8}"]
+    for subject, average in report['averages']:
+        lines.append(f'{subject:<20}{average:>8.2f}')
+    lines += ['', f"{'Class':<30}{'Present':>8}{'Absent':>8}{'Rate':>8}"]
+    for row in report['attendance']:
+        rate = f"{row['rate']:.0%}" if row['rate'] is not None else '-'
+        lines.append(f"{row['class']:<30}{row['present']:>8}{row['absent']:>8}{rate:>8}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_reports(output_dir, reports):
+    """Render and write a chunk of prefetched reports. Runs in the worker processes."""
+    for report in reports:
+        base = os.path.join(output_dir, f"report-{report['student_id']}")
+        write_atomically(base + '.html', render_to_string('progress_report.html', {'report': report}))
+        write_atomically(base + '.txt', render_text_report(report))
+    return len(reports)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate progress reports (HTML and printable text) from grades and attendance '
+        'for every student, or the students of a class, across a process pool.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to write the reports to')
+        parser.add_argument('--class', dest='class_id', type=int, help='Only students enrolled in this class')
+        parser.add_argument('--from', dest='start', type=date.fromisoformat, help='Session start (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', type=date.fromisoformat, help='Session end (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Students per worker task')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Rendering processes (0 renders in this process)')
+        parser.add_argument('--force', action='store_true', help='Rewrite reports that already exist')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        self.verbosity = options['verbosity']
+        output_dir = options['output']
+        os.makedirs(output_dir, exist_ok=True)
+        self.start, self.end = options['start'], options['end']
+        if self.start and self.end and self.start > self.end:
+            raise CommandError('--from must not be after --to.')
+
+        if options['class_id']:
+            if not Class.objects.filter(pk=options['class_id']).exists():
+                raise CommandError(f"Class {options['class_id']} does not exist.")
+            student_ids = Class.students.through.objects.filter(
+                class_id=options['class_id']
+            ).order_by('studentprofile_id').values_list('studentprofile_id', flat=True)
+        else:
+            student_ids = StudentProfile.objects.order_by('pk').values_list('pk', flat=True)
+        student_ids = list(student_ids)
+
+        # Resume: a report that exists is complete, because files are only ever renamed into place
+        if not options['force']:
+            done = set(os.listdir(output_dir))
+            student_ids = [
+                pk for pk in student_ids
+                if not {f'report-{pk}.html', f'report-{pk}.txt'} <= done
+            ]
+        if not student_ids:
+            self.stdout.write('All reports are already written.')
+            return
+
+        chunk_size = options['chunk_size']
+        chunks = [student_ids[i:i + chunk_size] for i in range(0, len(student_ids), chunk_size)]
+        started = time.perf_counter()
+        written = 0
+        if options['workers'] > 0:
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                # Prefetch the next chunks while the workers render earlier ones, keeping
+                # at most two chunks per worker in flight
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(write_reports, output_dir, self.build_reports(chunk)))
+                    if len(pending) >= options['workers'] * 2:
+                        written += pending.popleft().result()
+                        self.report_progress(written, len(student_ids))
+                while pending:
+                    written += pending.popleft().result()
+                    self.report_progress(written, len(student_ids))
+        else:
+            for chunk in chunks:
+                written += write_reports(output_dir, self.build_reports(chunk))
+                self.report_progress(written, len(student_ids))
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} progress reports to {output_dir} in {elapsed:.1f}s'
+        ))
+
+    def report_progress(self, written, total):
+        if self.verbosity > 1:
+            self.stdout.write(f'{written}/{total} reports written')
+
+    def session_label(self):
+        if not (self.start or self.end):
+            return 'All terms'
+        return f"{self.start or '...'} to {self.end or '...'}"
+
+    def build_reports(self, student_ids):
+        """Load everything a chunk of reports needs in three queries, as plain picklable data."""
+        reports = {}
+        for pk, username, first_name, last_name in StudentProfile.objects.filter(
+            pk__in=student_ids
+        ).values_list('pk', 'user__username', 'user__first_name', 'user__last_name'):
+            reports[pk] = {
+                'student_id': pk,
+                'username': username,
+                'name': f'{first_name} {last_name}'.strip() or username,
+                'session': self.session_label(),
+                'grades': [],
+                'averages': [],
+                'attendance': [],
+            }
+
+        grades = Grade.objects.filter(student_id__in=student_ids)
+        if self.start:
+            grades = grades.filter(exam__date__gte=self.start)
+        if self.end:
+            grades = grades.filter(exam__date__lte=self.end)
+        totals = defaultdict(lambda: defaultdict(list))
+        for student_id, subject, title, exam_date, value in grades.order_by('exam__date').values_list(
+            'student_id', 'exam__subject__name', 'exam__title', 'exam__date', 'grade_value',
+        ):
+            reports[student_id]['grades'].append({
+                'subject': subject, 'exam': title or f'{subject} exam', 'date': exam_date.isoformat(), 'value': float(value),
+            })
+            totals[student_id][subject].append(float(value))
+        for student_id, subjects in totals.items():
+            reports[student_id]['averages'] = [
+                (subject, sum(values) / len(values)) for subject, values in sorted(subjects.items())
+            ]
+
+        # Attendance comes from the monthly summary, so the session is rounded to whole months
+        summaries = AttendanceSummary.objects.filter(student_id__in=student_ids)
+        if self.start:
+            summaries = summaries.filter(year__gte=self.start.year).exclude(year=self.start.year, month__lt=self.start.month)
+        if self.end:
+            summaries = summaries.filter(year__lte=self.end.year).exclude(year=self.end.year, month__gt=self.end.month)
+        for student_id, class_title, present, absent in summaries.values_list(
+            'student_id', 'class_instance__title',
+        ).annotate(present=Sum('present'), absent=Sum('absent')).order_by('student_id', 'class_instance__title'):
+            total = present + absent
+            reports[student_id]['attendance'].append({
+                'class': class_title, 'present': present, 'absent': absent, 'rate': present / total if total else None,
+            })
+
+        return [reports[pk] for pk in student_ids if pk in reports]
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from school.gradebook import BAND_LABELS, GROUP_COLUMNS, grade_statistics
+from school.models import Grade
+
+
+class Command(BaseCommand):
+    help = 'Print grade statistics grouped by class, subject and/or exam date.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', default='class,subject,date',
+                            help=f'Comma separated group-by columns from: {", ".join(GROUP_COLUMNS)} (empty for school-wide)')
+        parser.add_argument('--class', dest='class_id', type=int, help='Only grades of this class')
+        parser.add_argument('--subject', dest='subject_id', type=int, help='Only grades of this subject')
+        parser.add_argument('--json', action='store_true', help='Print one JSON object per group')
+
+    def handle(self, *args, **options):
+        by = [name for name in options['by'].split(',') if name]
+        grades = Grade.objects.all()
+        if options['class_id']:
+            grades = grades.filter(exam__class_instance_id=options['class_id'])
+        if options['subject_id']:
+            grades = grades.filter(exam__subject_id=options['subject_id'])
+        try:
+            stats = grade_statistics(grades, by=by)
+        except ValueError as error:
+            raise CommandError(error)
+
+        for index in range(len(stats.count)):
+            row = {name: str(stats.keys[name][index]) if name == 'date' else int(stats.keys[name][index]) for name in by}
+            row.update({
+                'count': int(stats.count[index]),
+                'mean': round(float(stats.mean[index]), 2),
+                'median': round(float(stats.median[index]), 2),
+                'std': round(float(stats.std[index]), 2),
+                'min': float(stats.min[index]),
+                'max': float(stats.max[index]),
+                'distribution': dict(zip(BAND_LABELS, map(int, stats.distribution[index]))),
+            })
+            if options['json']:
+                self.stdout.write(json.dumps(row))
+            else:
+                self.stdout.write(' '.join(f'{key}={value}' for key, value in row.items()))
@@ -0,0 +1,18 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from school.fees import queue_fee_reminders, refresh_fee_statistics
+
+
+class Command(BaseCommand):
+    help = 'Nightly run: compute per-student overdue fees and queue a reminder for each student in arrears.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Run date (default: today)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Reminders per INSERT')
+
+    def handle(self, *args, **options):
+        refresh_fee_statistics()
+        count = queue_fee_reminders(options['date'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Queued reminders for {count} students in arrears.'))
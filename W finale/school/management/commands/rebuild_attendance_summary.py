@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from school.attendance import rebuild_summary, verify_summary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly attendance summary from the attendance history, or check it with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only compare the summary with the history')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Summary rows per INSERT')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            count = rebuild_summary(batch_size=options['batch_size'])
+            self.stdout.write(f'Rebuilt {count} summary rows.')
+
+        mismatches = verify_summary()
+        if mismatches:
+            for student_id, class_id, year, month in mismatches[:20]:
+                self.stderr.write(f'Mismatch: student {student_id}, class {class_id}, {year}-{month:02d}')
+            raise CommandError(f'{len(mismatches)} summary rows do not match the attendance history.')
+        self.stdout.write(self.style.SUCCESS('Attendance summary matches the attendance history.'))
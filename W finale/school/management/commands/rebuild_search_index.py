@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from school.search import index_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the SQLite user search index from the user table, e.g. after bulk writes that skip '
+        'signals. On PostgreSQL the index is maintained by the database and there is nothing to do.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stdout.write(f'The {connection.vendor} search index needs no rebuild.')
+            return
+        started = time.perf_counter()
+        with transaction.atomic():
+            count = index_users()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} users in {time.perf_counter() - started:.1f}s.'))
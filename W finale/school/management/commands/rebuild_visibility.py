@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from school.visibility import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute which students each parent and teacher may see from parent links and class rosters, '
+        'e.g. after bulk writes that skip signals.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} visibility rows in {time.perf_counter() - started:.1f}s.'
+        ))
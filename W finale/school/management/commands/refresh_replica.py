@@ -0,0 +1,50 @@
+import os
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def backup_sqlite(source, path, pages=1024, pause=0.0):
+    """
+    Copy a SQLite connection's database to `path` with the online backup API, in steps
+    of `pages` pages so writers are only held up for one step at a time. The copy is
+    written next to `path` and renamed over it, so readers never see a partial file.
+    """
+    temp_path = f'{path}.tmp'
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target, pages=pages, sleep=pause)
+    finally:
+        target.close()
+    os.replace(temp_path, path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh the local SQLite read replica (SCHOOL_REPLICA_DB) from the primary database '
+        'with the online backup API. Run it periodically, more often than SCHOOL_PRIMARY_PIN_SECONDS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1024, help='Pages copied per backup step')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to let writers in between steps')
+
+    def handle(self, *args, **options):
+        alias = getattr(settings, 'SCHOOL_READ_DATABASE', None)
+        if not alias or alias not in connections.databases:
+            raise CommandError('No read replica is configured (set SCHOOL_REPLICA_DB).')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('refresh_replica copies SQLite files; use the database server\'s replication instead.')
+
+        started = time.perf_counter()
+        primary.ensure_connection()
+        backup_sqlite(primary.connection, replica.settings_dict['NAME'], options['pages'], options['pause'])
+        # Reconnect, so this process's replica reads see the new file
+        replica.close()
+        self.stdout.write(self.style.SUCCESS(
+            f"Replica {replica.settings_dict['NAME']} refreshed in {time.perf_counter() - started:.1f}s"
+        ))
@@ -0,0 +1,46 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from school.jobs import purge_finished, work
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background jobs: claim them in batches, highest priority first, and retry failures with '
+        'backoff. Run several workers for more throughput; jobs of a worker that dies are picked up '
+        'again once their lease expires.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=50, help='Jobs claimed at a time (emails in a batch share one SMTP connection)')
+        parser.add_argument('--lease', type=int, help='Seconds a claimed batch is held (default: SCHOOL_JOB_LEASE_SECONDS)')
+        parser.add_argument('--name', action='append', dest='names', help='Only run jobs of this task (repeatable)')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when no job is ready')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is ready instead of waiting')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs')
+        parser.add_argument('--purge-days', type=int, default=7, help='On start, delete jobs finished this many days ago')
+
+    def handle(self, *args, **options):
+        if options['batch'] < 1:
+            raise CommandError('--batch must be at least 1.')
+        purged = purge_finished(options['purge_days'])
+        if purged and options['verbosity'] > 1:
+            self.stdout.write(f'Purged {purged} finished jobs.')
+
+        # Finish the current batch on SIGTERM/SIGINT instead of abandoning its leases
+        stopping = []
+
+        def stop(signum, frame):
+            stopping.append(signum)
+
+        previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            totals = work(
+                batch=options['batch'], names=options['names'], lease=options['lease'], idle_sleep=options['sleep'],
+                once=options['once'], max_jobs=options['max_jobs'], stop=lambda: bool(stopping),
+            )
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f"Ran {totals['done']} jobs, {totals['failed']} failed."))
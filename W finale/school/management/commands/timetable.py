@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from school.timetable import TimetableError, find_conflicts, generate_timetable, save_timetable
+
+
+class Command(BaseCommand):
+    help = 'Check the timetable for teacher, room and student-group clashes, or generate a new one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['check', 'generate'])
+        parser.add_argument('--class', dest='class_ids', type=int, action='append',
+                            help='Limit to this class (repeatable; default: every class)')
+        parser.add_argument('--dry-run', action='store_true', help='Generate without saving')
+        parser.add_argument('--max-steps', type=int, default=1_000_000, help='Search steps before giving up')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['action'] == 'check':
+            conflicts = find_conflicts(options['class_ids'])
+            for conflict in conflicts:
+                self.stdout.write(
+                    f'{conflict.kind} {conflict.key}: classes {conflict.classes[0]} and {conflict.classes[1]} '
+                    f'on {conflict.day} {conflict.section}'
+                )
+            if conflicts:
+                raise CommandError(f'{len(conflicts)} timetable conflicts found.')
+            self.stdout.write(self.style.SUCCESS(f'No conflicts ({time.perf_counter() - started:.2f}s).'))
+            return
+
+        try:
+            assignments = generate_timetable(options['class_ids'], max_steps=options['max_steps'])
+        except TimetableError as error:
+            raise CommandError(error)
+        sections = sum(len(slots) for slots in assignments.values())
+        if not options['dry_run']:
+            save_timetable(assignments)
+        self.stdout.write(self.style.SUCCESS(
+            f'Scheduled {sections} sections for {len(assignments)} classes in {time.perf_counter() - started:.2f}s'
+            + (' (not saved)' if options['dry_run'] else '')
+        ))
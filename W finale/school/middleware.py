@@ -0,0 +1,129 @@
+import json
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from .instrumentation import record_queries
+from .routers import read_routing
+
+sql_logger = logging.getLogger('school.sql')
+
+
+def get_profile(user):
+    if not user.is_authenticated:
+        return None
+    return user.profile
+
+
+class ProfileMiddleware(MiddlewareMixin):
+    """
+    Expose the current user's role profile as request.profile. It is resolved on
+    first access and, since the authentication backend loads the profile along
+    with the user, it costs no extra query. Falsy for anonymous users and users
+    without a profile.
+    """
+
+    def process_request(self, request):
+        request.profile = SimpleLazyObject(lambda: get_profile(request.user))
+
+
+class HybridMiddleware:
+    """Base for middleware that runs natively under both WSGI and ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class QueryInstrumentationMiddleware(HybridMiddleware):
+    """
+    Record the SQL each request runs and report it as one structured (JSON) log
+    line on the school.sql logger and a Server-Timing header. Statements repeated
+    more than SCHOOL_N_PLUS_ONE_THRESHOLD times are logged as a warning.
+
+    Place it first, so session and authentication queries are counted too. Queries
+    that sync views and the dashboards' loaders run in worker threads are counted;
+    queries run while a streaming response is consumed are not.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.threshold = getattr(settings, 'SCHOOL_N_PLUS_ONE_THRESHOLD', 5)
+        self.server_timing = getattr(settings, 'SCHOOL_SERVER_TIMING', True)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with record_queries() as queries:
+            response = self.get_response(request)
+        return self.report(request, response, queries)
+
+    async def __acall__(self, request):
+        with record_queries() as queries:
+            response = await self.get_response(request)
+        return self.report(request, response, queries)
+
+    def report(self, request, response, queries):
+        n_plus_one = queries.repeated(self.threshold)
+        stats = {
+            'method': request.method,
+            'path': request.path,
+            'view': request.resolver_match.view_name if request.resolver_match else None,
+            'status': response.status_code,
+            'queries': queries.count,
+            'db_ms': round(queries.duration * 1000, 2),
+            'duplicates': sum(count - 1 for count in queries.repeated().values()),
+            'n_plus_one': [{'sql': sql, 'count': count} for sql, count in n_plus_one.items()],
+        }
+        if n_plus_one:
+            sql_logger.warning(json.dumps(stats), extra={'sql_stats': stats})
+        else:
+            sql_logger.info(json.dumps(stats), extra={'sql_stats': stats})
+
+        if self.server_timing:
+            timing = f'db;dur={stats["db_ms"]};desc="{queries.count} queries"'
+            if response.has_header('Server-Timing'):
+                timing = f'{response["Server-Timing"]}, {timing}'
+            response['Server-Timing'] = timing
+        return response
+
+
+class ReplicaPinningMiddleware(HybridMiddleware):
+    """
+    Keep a client on the primary database after it writes. Unsafe requests read
+    the primary throughout, and any request that wrote sets a cookie that pins the
+    client's reads to the primary for SCHOOL_PRIMARY_PIN_SECONDS, which should
+    cover the replica's lag.
+    """
+    cookie_name = 'school_primary'
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.pin_seconds = getattr(settings, 'SCHOOL_PRIMARY_PIN_SECONDS', 30)
+
+    def is_pinned(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') or self.cookie_name in request.COOKIES
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with read_routing(self.is_pinned(request)) as state:
+            response = self.get_response(request)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        with read_routing(self.is_pinned(request)) as state:
+            response = await self.get_response(request)
+        return self.pin(response, state)
+
+    def pin(self, response, state):
+        if state.wrote:
+            response.set_cookie(self.cookie_name, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:55
+
+import school.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customuser',
+            managers=[
+                ('objects', school.models.CustomUserManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0003_attendance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('present', models.IntegerField(default=0)),
+                ('absent', models.IntegerField(default=0)),
+                ('class_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_summaries', to='school.class')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_summaries', to='school.studentprofile')),
+            ],
+            options={
+                'verbose_name_plural': 'attendance summaries',
+                'indexes': [models.Index(fields=['class_instance', 'year', 'month'], name='school_atte_class_i_2a70e4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('student', 'class_instance', 'year', 'month'), name='unique_attendance_summary')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0004_attendance_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exam',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('title', models.CharField(blank=True, max_length=100)),
+                ('class_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exams', to='school.class')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exams', to='school.subject')),
+            ],
+            options={
+                'unique_together': {('class_instance', 'subject', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Grade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grade_value', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('feedback', models.TextField(blank=True)),
+                ('exam', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grades', to='school.exam')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grades', to='school.studentprofile')),
+            ],
+            options={
+                'unique_together': {('exam', 'student')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0005_exam_grade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='class',
+            name='weekly_sections',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='Schedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(choices=[('1st Section', '9:00 am - 10:30 am'), ('2nd Section', '10:45 am - 12:15 pm'), ('3rd Section', '12:45 pm - 1:15 pm'), ('4th Section', '2:00 pm - 3:30 pm')], max_length=20)),
+                ('day_of_week', models.CharField(choices=[('Monday', 'Monday'), ('Tuesday', 'Tuesday'), ('Wednesday', 'Wednesday'), ('Thursday', 'Thursday'), ('Friday', 'Friday')], max_length=10)),
+                ('class_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timetable', to='school.class')),
+                ('subject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scheduled_sections', to='school.subject')),
+            ],
+            options={
+                'unique_together': {('class_instance', 'day_of_week', 'section')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0006_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fee',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount_due', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('due_date', models.DateField()),
+                ('paid', models.BooleanField(default=False)),
+                ('payment_date', models.DateField(blank=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fees', to='school.studentprofile')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('paid', False)), fields=['student', 'due_date', 'amount_due'], name='fee_unpaid_student_idx'), models.Index(condition=models.Q(('paid', False)), fields=['due_date', 'student', 'amount_due'], name='fee_unpaid_due_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='FeeReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('fee_count', models.PositiveIntegerField()),
+                ('oldest_due_date', models.DateField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fee_reminders', to='school.studentprofile')),
+            ],
+            options={
+                'unique_together': {('student', 'run_date')},
+            },
+        ),
+    ]
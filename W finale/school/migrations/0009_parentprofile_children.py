@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0008_user_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parentprofile',
+            name='children',
+            field=models.ManyToManyField(blank=True, related_name='parents', to='school.studentprofile'),
+        ),
+    ]
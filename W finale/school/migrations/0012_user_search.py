@@ -0,0 +1,45 @@
+from django.db import migrations
+
+TABLE = 'school_user_search'
+
+PG_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce(\"school_customuser\".\"username\", '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(\"school_customuser\".\"first_name\", '') || ' ' || "
+    "coalesce(\"school_customuser\".\"last_name\", '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(\"school_customuser\".\"email\", '')), 'C'))"
+)
+
+
+def create_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        # Prefix indexes of 2 and 3 characters keep short prefix queries fast
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+            f"username, first_name, last_name, email, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO {TABLE} (rowid, username, first_name, last_name, email) '
+            f'SELECT id, username, first_name, last_name, email FROM school_customuser'
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX user_search_idx ON school_customuser USING gin ({PG_DOCUMENT})')
+
+
+def drop_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TABLE}')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS user_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0011_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def materialize(apps, schema_editor):
+    StudentVisibility = apps.get_model('school', 'StudentVisibility')
+    ParentProfile = apps.get_model('school', 'ParentProfile')
+    Class = apps.get_model('school', 'Class')
+    parents = ParentProfile.children.through.objects.values_list('parentprofile__user_id', 'studentprofile_id')
+    teachers = Class.students.through.objects.filter(class__assigned_teacher__isnull=False).values_list(
+        'class__assigned_teacher__user_id', 'studentprofile_id',
+    )
+    StudentVisibility.objects.bulk_create(
+        [StudentVisibility(viewer_id=viewer, student_id=student) for viewer, student in set(parents) | set(teachers)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school', '0012_user_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility', to='school.studentprofile')),
+                ('viewer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_visibility', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'student visibility',
+                'unique_together': {('viewer', 'student')},
+            },
+        ),
+        migrations.RunPython(materialize, migrations.RunPython.noop),
+    ]
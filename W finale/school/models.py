@@ -1,8 +1,38 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
+from django.utils import timezone
 from django.db.models.signals import post_save  # Import post_save
 from django.dispatch import receiver  # Import receiver
 
+# Reverse one-to-one accessor of the profile that belongs to each role
+ROLE_PROFILE_ACCESSORS = {
+    'admin': 'adminprofile',
+    'staff': 'staffprofile',
+    'teacher': 'teacherprofile',
+    'student': 'studentprofile',
+    'parent': 'parentprofile',
+}
+
+
+class CustomUserManager(UserManager):
+    def with_profile(self, role=None):
+        """
+        Join the role profile into the user query. With a role only that profile's
+        table is joined; without one (e.g. loading a user by id) all five are, which
+        is still a single query.
+        """
+        if role is None:
+            return self.select_related(*ROLE_PROFILE_ACCESSORS.values())
+        return self.filter(role=role).select_related(ROLE_PROFILE_ACCESSORS[role])
+
+
+# Profiles always display their user, so load it with them
+class ProfileManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().select_related('user')
+
+
 # CustomUser model
 class CustomUser(AbstractUser):
     ROLE_CHOICES = [
@@ -14,9 +44,30 @@ class CustomUser(AbstractUser):
     ]
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
 
+    objects = CustomUserManager()
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Sort keys of the keyset-paginated user listings
+            models.Index(fields=['date_joined', 'id'], name='user_joined_keyset_idx'),
+            models.Index(fields=['role', 'id'], name='user_role_keyset_idx'),
+        ]
+
+    @property
+    def profile(self):
+        """The profile matching this user's role, or None."""
+        accessor = ROLE_PROFILE_ACCESSORS.get(self.role)
+        if accessor is None:
+            return None
+        try:
+            return getattr(self, accessor)
+        except ObjectDoesNotExist:
+            return None
+
 # Profile model for Admin
 class AdminProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
+    objects = ProfileManager()
     # Add any specific fields for Admins
     def __str__(self):
         return f'{self.user.username} (Admin)'
@@ -24,6 +75,7 @@ class AdminProfile(models.Model):
 # Profile model for Staff
 class StaffProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
+    objects = ProfileManager()
     # Add any specific fields for Staff
     def __str__(self):
         return f'{self.user.username} (Staff)'
@@ -31,6 +83,7 @@ class StaffProfile(models.Model):
 # Profile model for Teachers
 class TeacherProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
+    objects = ProfileManager()
     # Add any specific fields for Teachers
     def __str__(self):
         return f'{self.user.username} (Teacher)'
@@ -38,6 +91,7 @@ class TeacherProfile(models.Model):
 # Profile model for Students
 class StudentProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
+    objects = ProfileManager()
     # Add any specific fields for Students
     def __str__(self):
         return f'{self.user.username} (Student)'
@@ -45,6 +99,292 @@ class StudentProfile(models.Model):
 # Profile model for Parents
 class ParentProfile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
+    children = models.ManyToManyField(StudentProfile, blank=True, related_name='parents')
+    objects = ProfileManager()
     # Add any specific fields for Parents
     def __str__(self):
         return f'{self.user.username} (Parent)'
+
+# Subject model
+class Subject(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    description = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.name
+
+# Class model (teacher-student relationships)
+class Class(models.Model):
+    title = models.CharField(max_length=100)
+    assigned_teacher = models.ForeignKey(TeacherProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='assigned_classes')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='classes')
+    students = models.ManyToManyField(StudentProfile, blank=True, related_name='classes')
+    room_number = models.CharField(max_length=10, blank=True)
+    # How many timetable sections the class needs each week
+    weekly_sections = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        verbose_name_plural = 'classes'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded teacher so the visibility signals can refresh both on a change
+        instance._loaded_teacher_id = instance.__dict__.get('assigned_teacher_id')
+        return instance
+
+    def __str__(self):
+        return self.title
+
+# Schedule model (one timetable section of a class)
+class Schedule(models.Model):
+    SECTION_CHOICES = [
+        ('1st Section', '9:00 am - 10:30 am'),
+        ('2nd Section', '10:45 am - 12:15 pm'),
+        ('3rd Section', '12:45 pm - 1:15 pm'),
+        ('4th Section', '2:00 pm - 3:30 pm'),
+    ]
+    DAY_CHOICES = [
+        ('Monday', 'Monday'),
+        ('Tuesday', 'Tuesday'),
+        ('Wednesday', 'Wednesday'),
+        ('Thursday', 'Thursday'),
+        ('Friday', 'Friday'),
+    ]
+    class_instance = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='timetable')
+    section = models.CharField(max_length=20, choices=SECTION_CHOICES)
+    subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True, related_name='scheduled_sections')
+    day_of_week = models.CharField(max_length=10, choices=DAY_CHOICES)
+
+    class Meta:
+        unique_together = ('class_instance', 'day_of_week', 'section')  # A class is in one place at a time
+
+    def __str__(self):
+        return f'{self.class_instance} {self.day_of_week} {self.section}'
+
+# Attendance model (one row per student per class per day)
+class Attendance(models.Model):
+    STATUS_CHOICES = [
+        ('Present', 'Present'),
+        ('Absent', 'Absent'),
+    ]
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='attendances')
+    class_instance = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='attendances')
+    date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+
+    # The fields summary_key is made from
+    SUMMARY_FIELDS = ('student_id', 'class_instance_id', 'date', 'status')
+
+    class Meta:
+        constraints = [
+            # Also the upsert key for bulk marking; leading with the class and date
+            # lets the same index serve "attendance of a class on a day"
+            models.UniqueConstraint(fields=['class_instance', 'date', 'student'], name='unique_attendance_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['student', 'date']),
+        ]
+
+    def __str__(self):
+        return f'{self.student} {self.date} {self.status}'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so the summary signals can undo it on change;
+        # with a key field deferred the signals read the stored key themselves
+        if instance.get_deferred_fields().isdisjoint(cls.SUMMARY_FIELDS):
+            instance._loaded_key = instance.summary_key
+        return instance
+
+    @property
+    def summary_key(self):
+        """(student_id, class_instance_id, year, month, status) this row counts towards."""
+        return (self.student_id, self.class_instance_id, self.date.year, self.date.month, self.status)
+
+# Monthly attendance counters per student and class, kept up to date by
+# attendance writes (see school/attendance.py). The counters are plain integers
+# because corrections are applied as signed deltas in a single upsert.
+class AttendanceSummary(models.Model):
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='attendance_summaries')
+    class_instance = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='attendance_summaries')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    present = models.IntegerField(default=0)
+    absent = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'attendance summaries'
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'class_instance', 'year', 'month'], name='unique_attendance_summary'),
+        ]
+        indexes = [
+            models.Index(fields=['class_instance', 'year', 'month']),
+        ]
+
+    def __str__(self):
+        return f'{self.student} {self.year}-{self.month:02d}: {self.present} present, {self.absent} absent'
+
+# Exam model (an exam sat by a class in a subject on a date)
+class Exam(models.Model):
+    class_instance = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='exams')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='exams')
+    date = models.DateField()
+    title = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        unique_together = ('class_instance', 'subject', 'date')  # Prevents duplicate exam entries
+
+    def __str__(self):
+        return self.title or f'{self.subject} exam {self.date}'
+
+# Grade model (a student's result in an exam)
+class Grade(models.Model):
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='grades')
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='grades')
+    grade_value = models.DecimalField(max_digits=5, decimal_places=2)
+    feedback = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('exam', 'student')
+
+    def __str__(self):
+        return f'{self.student} {self.exam}: {self.grade_value}'
+
+
+class FeeQuerySet(models.QuerySet):
+    # Keep paid=False in every query on unpaid fees, so they can use the
+    # partial indexes below instead of reading paid history
+    def unpaid(self):
+        return self.filter(paid=False)
+
+    def overdue(self, today=None):
+        return self.unpaid().filter(due_date__lt=today or timezone.localdate())
+
+# Fee model (linked to students and payment status)
+class Fee(models.Model):
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='fees')
+    amount_due = models.DecimalField(max_digits=10, decimal_places=2)
+    due_date = models.DateField()
+    paid = models.BooleanField(default=False)
+    payment_date = models.DateField(null=True, blank=True)
+
+    objects = FeeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Only unpaid rows are indexed, so these stay small however much paid history
+            # piles up. amount_due is included so balances and arrears are read from
+            # the index alone.
+            models.Index(fields=['student', 'due_date', 'amount_due'], condition=models.Q(paid=False), name='fee_unpaid_student_idx'),
+            models.Index(fields=['due_date', 'student', 'amount_due'], condition=models.Q(paid=False), name='fee_unpaid_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.student} {self.amount_due} due {self.due_date}'
+
+# Reminder queued for a student's overdue fees by the nightly run
+class FeeReminder(models.Model):
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='fee_reminders')
+    run_date = models.DateField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    fee_count = models.PositiveIntegerField()
+    oldest_due_date = models.DateField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('student', 'run_date')  # One reminder per student per run
+
+    def __str__(self):
+        return f'{self.student} owes {self.amount} ({self.run_date})'
+
+# Announcement to a class (its students and their parents) or the whole school.
+# Small audiences get one InboxItem per recipient when posted ('inbox' delivery);
+# large ones are stored once and merged into each reader's inbox ('feed' delivery).
+class Announcement(models.Model):
+    AUDIENCE_CHOICES = [
+        ('school', 'Whole school'),
+        ('class', 'Class'),
+    ]
+    DELIVERY_CHOICES = [
+        ('inbox', 'Inbox'),
+        ('feed', 'Feed'),
+    ]
+    author = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='announcements')
+    audience = models.CharField(max_length=10, choices=AUDIENCE_CHOICES)
+    class_instance = models.ForeignKey(Class, on_delete=models.CASCADE, null=True, blank=True, related_name='announcements')
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    delivery = models.CharField(max_length=10, choices=DELIVERY_CHOICES)
+    recipient_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Feed announcements of an audience, newest first
+            models.Index(fields=['audience', 'class_instance', '-created_at'], condition=models.Q(delivery='feed'), name='announcement_feed_idx'),
+        ]
+
+    def __str__(self):
+        return self.title
+
+# A delivered announcement in a user's inbox. Also records when a user read a
+# feed announcement.
+class InboxItem(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='inbox_items')
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='inbox_items')
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'announcement')  # Also the index an inbox read goes through
+
+    def __str__(self):
+        return f'{self.user} {self.announcement}'
+
+# Background job (see school/jobs.py). A worker claims a job by leasing it until
+# available_at; a job whose worker dies becomes claimable again when the lease runs out.
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)  # Higher runs first
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    available_at = models.DateTimeField(default=timezone.now)  # Run after; while running, the lease expiry
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    lease = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The claim query: claimable jobs by priority, then age
+            models.Index(
+                fields=['-priority', 'available_at', 'id'], condition=models.Q(status__in=['queued', 'running']),
+                name='job_claim_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+# Which students a parent or teacher may see, one row per (viewer, student):
+# a parent's children and the students of a teacher's assigned classes.
+# Materialized from those relations by school/visibility.py.
+class StudentVisibility(models.Model):
+    viewer = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='student_visibility')
+    student = models.ForeignKey(StudentProfile, on_delete=models.CASCADE, related_name='visibility')
+
+    class Meta:
+        unique_together = ('viewer', 'student')  # Also the index checks and filters go through
+        verbose_name_plural = 'student visibility'
+
+    def __str__(self):
+        return f'{self.viewer} sees {self.student}'
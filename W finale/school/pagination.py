@@ -0,0 +1,123 @@
+import base64
+import json
+from collections import namedtuple
+
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+KeysetPage = namedtuple('KeysetPage', ['object_list', 'next_cursor', 'has_next'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPaginator:
+    """
+    Seek pagination: each page continues after the sort key of the previous page's
+    last row, instead of skipping rows with OFFSET, so every page costs the same.
+
+    `ordering` is a tuple of field names ending in a unique one, e.g.
+    ('date_joined', 'id') or ('role', 'id'); prefix them all with '-' for
+    descending order. Rows may be model instances or dicts from .values().
+    """
+
+    def __init__(self, queryset, ordering, per_page=50):
+        descending = {field.startswith('-') for field in ordering}
+        if len(descending) != 1:
+            raise ValueError('All ordering fields must sort in the same direction.')
+        self.descending = descending.pop()
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.per_page = per_page
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode(cursor)))
+        rows = list(queryset[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = self.encode(self.key(rows[-1])) if has_next else None
+        return KeysetPage(rows, next_cursor, has_next)
+
+    def key(self, row):
+        if isinstance(row, dict):
+            return [row[field] for field in self.fields]
+        return [getattr(row, field) for field in self.fields]
+
+    def after(self, values):
+        """
+        Rows that sort after `values`, written as f1 >= v1 AND (f1 > v1 OR (...)) so
+        the leading column can still drive an index range scan.
+        """
+        past, reach = ('lt', 'lte') if self.descending else ('gt', 'gte')
+        condition = Q(**{f'{self.fields[-1]}__{past}': values[-1]})
+        for field, value in zip(reversed(self.fields[:-1]), reversed(values[:-1])):
+            condition = Q(**{f'{field}__{reach}': value}) & (Q(**{f'{field}__{past}': value}) | Q(**{field: value}) & condition)
+        return condition
+
+    def encode(self, values):
+        raw = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(raw, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    def decode(self, cursor):
+        try:
+            raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if not isinstance(raw, list) or len(raw) != len(self.fields):
+                raise ValueError
+            model = self.queryset.model
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, raw)]
+        except (ValueError, TypeError, LookupError) as error:
+            raise InvalidCursor('Invalid cursor.') from error
+
+
+def estimated_count(queryset, exact_limit=10000):
+    """
+    Count rows without paying for a full COUNT(*) on large tables. Returns
+    (count, is_exact).
+
+    Filtered querysets are counted up to `exact_limit` rows; past that the count
+    is a lower bound. Unfiltered ones use the planner's row estimate (PostgreSQL
+    reltuples, SQLite's ANALYZE statistics) when the table is larger than
+    `exact_limit`.
+    """
+    if queryset.query.where or queryset.query.is_sliced:
+        count = queryset.order_by()[:exact_limit + 1].count()
+        return (count, True) if count <= exact_limit else (exact_limit, False)
+
+    estimate = _table_estimate(queryset.model._meta.db_table)
+    if estimate is not None and estimate > exact_limit:
+        return estimate, False
+    return queryset.count(), True
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Page-number paginator that counts with estimated_count(), so large tables are
+    not scanned for every page. Past `exact_limit` rows the page count is approximate.
+    """
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list, self.exact_limit)[0]
+
+
+def _table_estimate(table):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
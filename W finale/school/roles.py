@@ -0,0 +1,109 @@
+import threading
+from collections import namedtuple
+
+from django.contrib.auth.models import Permission, Group
+from django.db import connection
+from .models import AdminProfile, StaffProfile, TeacherProfile, StudentProfile, ParentProfile
+
+# Map each role to the profile model created for it
+ROLE_PROFILE_MODELS = {
+    'admin': AdminProfile,
+    'staff': StaffProfile,
+    'teacher': TeacherProfile,
+    'student': StudentProfile,
+    'parent': ParentProfile,
+}
+
+# Map each role to its group name and the permission codenames granted to that group
+# (modify the codenames accordingly)
+ROLE_GROUPS = {
+    'admin': ('Admin', [
+        'add_staff', 'change_staff', 'view_staff', 'delete_staff',
+        'add_student', 'change_student', 'view_student', 'delete_student',
+    ]),
+    'staff': ('Staff', [
+        'view_student', 'view_teacher', 'change_teacher',
+    ]),
+    'teacher': ('Teacher', [
+        'add_student', 'change_student', 'view_student', 'delete_student',
+    ]),
+    'student': ('Student', [
+        'view_timetable', 'view_grades',
+    ]),
+    'parent': ('Parent', [
+        'view_student_performance', 'view_student_attendance',
+    ]),
+}
+
+
+def get_role_group(role):
+    """
+    Return the group for a role, creating it with its permissions the first time.
+    Returns (group, created), or (None, False) for an unknown role.
+    """
+    if role not in ROLE_GROUPS:
+        return None, False
+    name, codenames = ROLE_GROUPS[role]
+    group, created = Group.objects.get_or_create(name=name)
+    if created:
+        group.permissions.add(*Permission.objects.filter(codename__in=codenames))
+    return group, created
+
+
+# What a role is granted: its group and the ids of that group's permissions
+RoleGrant = namedtuple('RoleGrant', ['group_id', 'permission_ids'])
+
+
+class RoleRegistry:
+    """
+    In-process cache of RoleGrant per role. Loaded on first use with two queries
+    and cleared by the signal handlers whenever a Group or Permission changes.
+    """
+
+    def __init__(self):
+        self._grants = None
+        self._lock = threading.Lock()
+
+    def get(self, role):
+        grants = self._grants
+        if grants is None:
+            grants = self.load()
+        return grants.get(role)
+
+    def load(self):
+        with self._lock:
+            if self._grants is not None:
+                return self._grants
+
+            names = {name: role for role, (name, codenames) in ROLE_GROUPS.items()}
+            group_ids = {
+                names[name]: pk for pk, name in Group.objects.filter(name__in=names).values_list('pk', 'name')
+            }
+            # Only happens on a fresh database
+            created = False
+            for role in ROLE_GROUPS:
+                if role not in group_ids:
+                    group_ids[role] = get_role_group(role)[0].pk
+                    created = True
+
+            permission_ids = {pk: set() for pk in group_ids.values()}
+            for group_id, permission_id in Group.permissions.through.objects.filter(
+                group_id__in=permission_ids
+            ).values_list('group_id', 'permission_id'):
+                permission_ids[group_id].add(permission_id)
+
+            grants = {
+                role: RoleGrant(group_id, frozenset(permission_ids[group_id]))
+                for role, group_id in group_ids.items()
+            }
+            # Groups created inside a transaction may still be rolled back, so only
+            # cache them once they are known to be committed
+            if not (created and connection.in_atomic_block):
+                self._grants = grants
+            return grants
+
+    def clear(self):
+        self._grants = None
+
+
+role_registry = RoleRegistry()
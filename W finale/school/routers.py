@@ -0,0 +1,96 @@
+"""
+Read/write routing between the primary database and an optional read replica
+(SCHOOL_READ_DATABASE). Only reads of the reporting models go to the replica, and
+only while the current request or task has not written: writes, reads inside a
+transaction on the primary, and any request within SCHOOL_PRIMARY_PIN_SECONDS of
+a write by the same client (see ReplicaPinningMiddleware) read the primary.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Models whose reads can tolerate replica lag: dashboards, reports and exports
+REPORTING_MODELS = {
+    'school.attendance', 'school.attendancesummary', 'school.exam', 'school.grade',
+    'school.fee', 'school.feereminder', 'school.schedule',
+}
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_state = ContextVar('school_routing_state')
+
+
+def current_state():
+    try:
+        return _state.get()
+    except LookupError:
+        # Outside read_routing() (shell, management commands): one state per context
+        state = RoutingState()
+        _state.set(state)
+        return state
+
+
+def read_database():
+    alias = getattr(settings, 'SCHOOL_READ_DATABASE', None)
+    return alias if alias and alias != DEFAULT_DB_ALIAS and alias in connections.databases else None
+
+
+@contextmanager
+def read_routing(pinned=False):
+    """
+    Scope the routing state to a request or task: reads may use the replica until
+    something writes, or always read the primary if `pinned`. Yields the state.
+    """
+    token = _state.set(RoutingState(pinned))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. for a check that must see the latest data."""
+    state = current_state()
+    previous = state.pinned
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = previous or state.wrote
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = read_database()
+        if (
+            alias is None or model._meta.label_lower not in REPORTING_MODELS
+            or current_state().pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes: whatever runs after a write reads the primary
+        state = current_state()
+        state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, read_database()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, never migrated on its own
+        if db == read_database():
+            return False
+        return None
@@ -0,0 +1,181 @@
+"""
+Row-level permissions. Each (permission, role) pair can have a rule saying which
+rows the role holds the permission on, e.g. a teacher may change the grades of
+the exams of their own classes. A rule is both a Q filter, so list views and the
+admin fetch only permitted rows in SQL, and a Python test on one object, which
+follows the relations already loaded on it (select_related/prefetch) instead of
+querying.
+
+Model-wide permissions from groups still grant every row; rules only add
+access. RuleBackend (school/backends.py) answers user.has_perm(perm, obj) from
+this registry, and permitted() filters querysets with it.
+"""
+from abc import ABC, abstractmethod
+
+from django.db.models import Q
+
+from .models import StudentVisibility
+from .visibility import visible_student_ids
+
+# Returned by a path walk that reached a relation that is not loaded
+NOT_LOADED = object()
+
+
+def follow(obj, path):
+    """
+    The value at `path` ('exam__class_instance__assigned_teacher') on `obj`, or
+    NOT_LOADED if a relation on the way is not cached. A foreign key at the end
+    gives its id.
+    """
+    current = obj
+    parts = path.split('__')
+    for part in parts[:-1]:
+        field = current._meta.get_field(part)
+        if not field.is_cached(current):
+            return NOT_LOADED
+        current = field.get_cached_value(current)
+        if current is None:
+            return None
+    last = parts[-1]
+    if last == 'pk':
+        return current.pk
+    return getattr(current, current._meta.get_field(last).attname)
+
+
+class Rule(ABC):
+    """Which rows of a model a user holds a permission on."""
+
+    @abstractmethod
+    def filter(self, user):
+        """A Q on the model selecting the permitted rows."""
+
+    @abstractmethod
+    def test(self, user, obj):
+        """Whether the user holds the permission on `obj`, or NOT_LOADED to ask the database."""
+
+    def check(self, user, obj):
+        allowed = self.test(user, obj)
+        if allowed is NOT_LOADED:
+            return type(obj)._default_manager.filter(self.filter(user), pk=obj.pk).exists()
+        return allowed
+
+
+class Everything(Rule):
+    """Every row."""
+
+    def filter(self, user):
+        return Q()
+
+    def test(self, user, obj):
+        return True
+
+
+class Owned(Rule):
+    """Rows whose `path` leads to the user's own role profile, e.g. Owned('class_instance__assigned_teacher')."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def filter(self, user):
+        if user.profile is None:
+            return Q(pk__in=[])
+        return Q(**{self.path: user.profile.pk})
+
+    def test(self, user, obj):
+        if user.profile is None:
+            return False
+        value = follow(obj, self.path)
+        return value if value is NOT_LOADED else value == user.profile.pk
+
+
+class Visible(Rule):
+    """Rows whose `path` leads to a student the user may see (see school/visibility.py)."""
+
+    def __init__(self, path='student'):
+        self.path = path
+
+    def filter(self, user):
+        return Q(**{f'{self.path}__in': StudentVisibility.objects.filter(viewer=user).values('student')})
+
+    def test(self, user, obj):
+        student_id = follow(obj, self.path)
+        return student_id if student_id is NOT_LOADED else student_id in visible_student_ids(user)
+
+
+class RuleRegistry:
+    def __init__(self):
+        self._rules = {}
+
+    def register(self, perm, roles, rule):
+        for role in [roles] if isinstance(roles, str) else roles:
+            self._rules[perm, role] = rule
+
+    def get(self, perm, role):
+        return self._rules.get((perm, role))
+
+    def perms_for(self, role, app_label=None):
+        """The permissions a role has any rule for."""
+        return {
+            perm for perm, rule_role in self._rules
+            if rule_role == role and (app_label is None or perm.startswith(f'{app_label}.'))
+        }
+
+
+rules = RuleRegistry()
+
+# Staff run the school, so they see and manage every row
+for model in ('class', 'schedule', 'exam', 'grade', 'attendance', 'fee', 'studentprofile'):
+    for action in ('view', 'change'):
+        rules.register(f'school.{action}_{model}', ('admin', 'staff'), Everything())
+
+# Teachers manage their own classes and what happens in them, and see their pupils
+for action in ('view', 'change'):
+    rules.register(f'school.{action}_class', 'teacher', Owned('assigned_teacher'))
+    rules.register(f'school.{action}_schedule', 'teacher', Owned('class_instance__assigned_teacher'))
+    rules.register(f'school.{action}_exam', 'teacher', Owned('class_instance__assigned_teacher'))
+    rules.register(f'school.{action}_grade', 'teacher', Owned('exam__class_instance__assigned_teacher'))
+    rules.register(f'school.{action}_attendance', 'teacher', Owned('class_instance__assigned_teacher'))
+rules.register('school.view_studentprofile', 'teacher', Visible('pk'))
+
+# Parents see their children's records, students their own
+for model in ('grade', 'attendance', 'fee'):
+    rules.register(f'school.view_{model}', 'parent', Visible('student'))
+    rules.register(f'school.view_{model}', 'student', Owned('student'))
+rules.register('school.view_studentprofile', 'parent', Visible('pk'))
+rules.register('school.view_studentprofile', 'student', Owned('pk'))
+
+
+def has_model_perm(user, perm):
+    """Model-wide permission from groups and user permissions, i.e. on every row."""
+    return user.is_active and (user.is_superuser or perm in user.get_all_permissions())
+
+
+def permitted(user, perm, queryset):
+    """The rows of `queryset` the user holds `perm` on, filtered in SQL."""
+    if not user.is_authenticated or not user.is_active:
+        return queryset.none()
+    if has_model_perm(user, perm):
+        return queryset
+    rule = rules.get(perm, user.role)
+    if rule is None:
+        return queryset.none()
+    return queryset.filter(rule.filter(user))
+
+
+def has_object_perm(user, perm, obj):
+    """Whether the user holds `perm` on `obj`; no query when the rule's path is loaded on it."""
+    if has_model_perm(user, perm):
+        return True
+    if not user.is_active:
+        return False
+    rule = rules.get(perm, user.role)
+    if rule is None:
+        return False
+    # Kept on the user for the request, like its permission set, since one page
+    # (e.g. an admin change form) asks about the same object several times
+    if not hasattr(user, '_object_perm_cache'):
+        user._object_perm_cache = {}
+    key = (perm, obj._meta.label, obj.pk)
+    if key not in user._object_perm_cache:
+        user._object_perm_cache[key] = rule.check(user, obj)
+    return user._object_perm_cache[key]
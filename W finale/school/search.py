@@ -0,0 +1,143 @@
+"""
+User search by name, username or email, with prefix matching ("jo smi" finds
+John Smith) and ranked results, through an index instead of icontains scans.
+
+On SQLite the index is the FTS5 table school_user_search, one row per user with
+the user id as rowid. It is kept in step by the CustomUser signal handlers once
+each change commits, and rebuilt with `manage.py rebuild_search_index` after bulk writes that skip
+signals. On PostgreSQL it is a GIN index on a tsvector of the same columns
+(migration 0012), which the database maintains itself. Other databases fall back
+to icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import CustomUser
+
+TABLE = 'school_user_search'
+
+FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+# bm25 / ts_rank weights of FIELDS: a username hit ranks above a name hit above an email hit
+WEIGHTS = (10.0, 5.0, 5.0, 2.0)
+
+# The searched tsvector on PostgreSQL; the GIN index is built on exactly this expression
+PG_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce(\"school_customuser\".\"username\", '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(\"school_customuser\".\"first_name\", '') || ' ' || "
+    "coalesce(\"school_customuser\".\"last_name\", '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(\"school_customuser\".\"email\", '')), 'C'))"
+)
+
+MAX_TERMS = 8
+
+
+def terms(query):
+    """The words of a query, lowercased. Punctuation separates words, as it does in the index."""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def fts5_query(words):
+    # Every word must match, each as a prefix
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def tsquery(words):
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def matching(queryset, query):
+    """Filter a CustomUser queryset to the users matching every word of `query` as a prefix. Unranked."""
+    words = terms(query)
+    if not words:
+        return queryset.none()
+    if connection.vendor == 'sqlite':
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s', [fts5_query(words)],
+        ))
+    if connection.vendor == 'postgresql':
+        return queryset.filter(RawSQL(
+            f"{PG_DOCUMENT} @@ to_tsquery('simple', %s)", [tsquery(words)], output_field=BooleanField(),
+        ))
+    condition = Q()
+    for word in words:
+        condition &= Q(*(Q(**{f'{field}__icontains': word}) for field in FIELDS), _connector=Q.OR)
+    return queryset.filter(condition)
+
+
+def ranked_ids(words, role=None, limit=20):
+    quote = connection.ops.quote_name
+    users = quote(CustomUser._meta.db_table)
+    if connection.vendor == 'sqlite':
+        sql = (
+            f'SELECT {TABLE}.rowid FROM {TABLE} JOIN {users} ON {users}.{quote("id")} = {TABLE}.rowid '
+            f'WHERE {TABLE} MATCH %s' + (f' AND {users}.{quote("role")} = %s' if role else '') +
+            f' ORDER BY bm25({TABLE}, {", ".join(map(str, WEIGHTS))}) LIMIT %s'
+        )
+        params = [fts5_query(words), *([role] if role else []), limit]
+    else:
+        # ts_rank takes the weights of D, C, B, A
+        weights = '{%s, %s, %s, %s}' % (0.0, WEIGHTS[3], WEIGHTS[1], WEIGHTS[0])
+        sql = (
+            f"SELECT {users}.{quote('id')} FROM {users} WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s)"
+            + (f' AND {users}.{quote("role")} = %s' if role else '') +
+            f" ORDER BY ts_rank(%s::real[], {PG_DOCUMENT}, to_tsquery('simple', %s)) DESC LIMIT %s"
+        )
+        params = [tsquery(words), *([role] if role else []), weights, tsquery(words), limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_users(query, role=None, limit=20):
+    """The best `limit` users matching `query`, optionally of one role, best match first."""
+    words = terms(query)
+    if not words:
+        return []
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        users = matching(CustomUser.objects.all(), query)
+        return list((users.filter(role=role) if role else users).order_by('username')[:limit])
+    ids = ranked_ids(words, role, limit)
+    users = CustomUser.objects.in_bulk(ids)
+    return [users[pk] for pk in ids if pk in users]
+
+
+def index_user(user_id, values):
+    """Add or refresh one user's index row from the `values` of FIELDS."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, {", ".join(FIELDS)}) VALUES (%s, %s, %s, %s, %s)',
+            [user_id, *values],
+        )
+
+
+def unindex_user(user_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {TABLE} WHERE rowid = %s', [user_id])
+
+
+def index_users(queryset=None):
+    """
+    Rebuild the index rows of a CustomUser queryset with one INSERT ... SELECT, or
+    of every user when none is given. Returns the number of rows written.
+    """
+    if connection.vendor != 'sqlite':
+        return 0
+    users = CustomUser.objects.all() if queryset is None else queryset
+    select, params = users.order_by().values_list('pk', *FIELDS).query.get_compiler(connection=connection).as_sql()
+    with connection.cursor() as cursor:
+        if queryset is None:
+            cursor.execute(f'DELETE FROM {TABLE}')
+        cursor.execute(f'INSERT OR REPLACE INTO {TABLE} (rowid, {", ".join(FIELDS)}) {select}', params)
+        count = cursor.rowcount
+        if queryset is None:
+            # Merge the index segments the bulk insert left behind
+            cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return count
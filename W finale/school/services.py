@@ -0,0 +1,30 @@
+from django.db import IntegrityError, transaction
+
+from .models import CustomUser
+
+from .jobs import enqueue
+from .tasks import welcome_email
+
+
+def register_user(form):
+    """
+    Create a user from a validated CustomUserCreationForm.
+
+    The user row is written once with its role already set, so the post_save
+    handler creates the role profile and group membership in the same transaction.
+    The welcome email is queued once that transaction commits, and sent by a worker.
+
+    Returns None, with the error added to the form, when a concurrent
+    registration took the username after the form was validated.
+    """
+    try:
+        with transaction.atomic():
+            user = form.save()
+            if user.email:
+                transaction.on_commit(lambda: enqueue('send_email', welcome_email(user), priority=10))
+    except IntegrityError:
+        if not CustomUser.objects.filter(username=form.cleaned_data['username']).exists():
+            raise
+        form.add_error('username', form.instance.unique_error_message(CustomUser, ['username']))
+        return None
+    return user
@@ -83,89 +83,215 @@
 #     user.save()  # Save the user after setting permissions
 
 from django.contrib.auth.models import Permission, Group
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
-from .models import CustomUser, AdminProfile, StaffProfile, TeacherProfile, StudentProfile, ParentProfile
+from .attendance import apply_summary_changes
+from .autocomplete import autocomplete
+from .backends import bump_permission_versions, bump_global_permission_version
+from .jobs import enqueue
+from .models import CustomUser, Attendance, Announcement, Class, ParentProfile, StudentProfile, TeacherProfile
+from .roles import ROLE_PROFILE_MODELS, role_registry
+from .search import FIELDS as SEARCH_FIELDS, index_user, unindex_user
+from .visibility import parent_user_ids, refresh_viewers, teacher_user_ids
 
 
 @receiver(post_save, sender=CustomUser)
 def create_profile_and_assign_permissions(sender, instance, created, **kwargs):
     if created:
-        print(f"User {instance.username} created with role {instance.role}")
-        
+        profile_model = ROLE_PROFILE_MODELS.get(instance.role)
+        if profile_model is None:
+            return
+
         # Create profile based on role
-        if instance.role == 'admin':
-            AdminProfile.objects.create(user=instance)
-            print(f"Admin profile created for {instance.username}")
-
-            # Assign admin permissions (modify the codenames accordingly)
-            admin_permissions = Permission.objects.filter(codename__in=[
-                'add_staff', 'change_staff', 'view_staff', 'delete_staff',
-                'add_student', 'change_student', 'view_student', 'delete_student'
-            ])
-            admin_group, group_created = Group.objects.get_or_create(name='Admin')
-            if group_created:
-                admin_group.permissions.add(*admin_permissions)
-                print(f"Admin group created and permissions added")
-            instance.groups.add(admin_group)
-            print(f"{instance.username} added to Admin group")
-
-        elif instance.role == 'staff':
-            StaffProfile.objects.create(user=instance)
-            print(f"Staff profile created for {instance.username}")
-
-            # Assign staff permissions (modify the codenames accordingly)
-            staff_permissions = Permission.objects.filter(codename__in=[
-                'view_student', 'view_teacher', 'change_teacher'
-            ])
-            staff_group, group_created = Group.objects.get_or_create(name='Staff')
-            if group_created:
-                staff_group.permissions.add(*staff_permissions)
-                print(f"Staff group created and permissions added")
-            instance.groups.add(staff_group)
-            print(f"{instance.username} added to Staff group")
-
-        elif instance.role == 'teacher':
-            TeacherProfile.objects.create(user=instance)
-            print(f"Teacher profile created for {instance.username}")
-
-            # Assign teacher permissions (modify the codenames accordingly)
-            teacher_permissions = Permission.objects.filter(codename__in=[
-                'add_student', 'change_student', 'view_student', 'delete_student'
-            ])
-            teacher_group, group_created = Group.objects.get_or_create(name='Teacher')
-            if group_created:
-                teacher_group.permissions.add(*teacher_permissions)
-                print(f"Teacher group created and permissions added")
-            instance.groups.add(teacher_group)
-            print(f"{instance.username} added to Teacher group")
-
-        elif instance.role == 'student':
-            StudentProfile.objects.create(user=instance)
-            print(f"Student profile created for {instance.username}")
-
-            # Assign student permissions (modify the codenames accordingly)
-            student_permissions = Permission.objects.filter(codename__in=[
-                'view_timetable', 'view_grades'
-            ])
-            student_group, group_created = Group.objects.get_or_create(name='Student')
-            if group_created:
-                student_group.permissions.add(*student_permissions)
-                print(f"Student group created and permissions added")
-            instance.groups.add(student_group)
-            print(f"{instance.username} added to Student group")
-
-        elif instance.role == 'parent':
-            ParentProfile.objects.create(user=instance)
-            print(f"Parent profile created for {instance.username}")
-
-            # Assign parent permissions (modify the codenames accordingly)
-            parent_permissions = Permission.objects.filter(codename__in=[
-                'view_student_performance', 'view_student_attendance'
-            ])
-            parent_group, group_created = Group.objects.get_or_create(name='Parent')
-            if group_created:
-                parent_group.permissions.add(*parent_permissions)
-                print(f"Parent group created and permissions added")
-            instance.groups.add(parent_group)
-            print(f"{instance.username} added to Parent group")
+        profile_model.objects.create(user=instance)
+
+        # Assign role permissions through the role's group; a brand new user has no
+        # memberships yet, so the row is inserted directly instead of via groups.add()
+        grant = role_registry.get(instance.role)
+        CustomUser.groups.through.objects.create(customuser_id=instance.pk, group_id=grant.group_id)
+
+
+# Keep the user search index in step once the change is committed, so writing
+# it is not part of the user's transaction; saves that only touch other fields
+# (such as last_login on every login) leave it alone
+@receiver(post_save, sender=CustomUser)
+def index_saved_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or not update_fields.isdisjoint(SEARCH_FIELDS):
+        user_id, values = instance.pk, [getattr(instance, field) for field in SEARCH_FIELDS]
+        transaction.on_commit(lambda: index_user(user_id, values))
+
+
+@receiver(post_delete, sender=CustomUser)
+def unindex_deleted_user(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: unindex_user(user_id))
+
+
+# Keep this process's autocomplete index in step, once the change is committed
+@receiver(post_save, sender=CustomUser)
+def update_autocomplete(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or not update_fields.isdisjoint({'username', 'first_name', 'last_name', 'role', 'is_active'}):
+        values = (instance.pk, instance.username, instance.first_name, instance.last_name, instance.role, instance.is_active)
+        transaction.on_commit(lambda: autocomplete.update(*values))
+
+
+@receiver(post_delete, sender=CustomUser)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove(user_id))
+
+
+# Keep the role registry in step with the Group and Permission tables
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def clear_role_registry(sender, **kwargs):
+    role_registry.clear()
+
+
+# Keep the cached permission sets in step with memberships and grants
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+def bump_user_permission_version(sender, instance, action, reverse, pk_set, **kwargs):
+    # A forward clear is handled once it is done; a reverse one before, while the
+    # affected users can still be listed
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_permission_versions([instance.pk])
+    elif action == 'pre_clear':
+        bump_permission_versions(instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        bump_permission_versions(pk_set)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def bump_group_permission_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+        groups = [instance.pk]
+    elif action == 'pre_clear':
+        groups = list(instance.group_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        groups = pk_set
+    else:
+        return
+    bump_permission_versions(
+        CustomUser.groups.through.objects.filter(group_id__in=groups).values_list('customuser_id', flat=True)
+    )
+
+
+@receiver(pre_delete, sender=Group)
+def bump_deleted_group_version(sender, instance, **kwargs):
+    bump_permission_versions(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def bump_all_permission_versions(sender, **kwargs):
+    bump_global_permission_version()
+
+
+# Single attendance writes move the monthly summary too; bulk roll calls
+# update it themselves in mark_attendance()
+@receiver(pre_save, sender=Attendance)
+@receiver(pre_delete, sender=Attendance)
+def read_stored_attendance_key(sender, instance, **kwargs):
+    # Loaded with a key field deferred, so what the row counts towards is unknown
+    if instance._state.adding or hasattr(instance, '_loaded_key'):
+        return
+    stored = Attendance.objects.filter(pk=instance.pk).values_list(*Attendance.SUMMARY_FIELDS).first()
+    if stored is not None:
+        student_id, class_id, date, status = stored
+        instance._loaded_key = (student_id, class_id, date.year, date.month, status)
+
+
+@receiver(post_save, sender=Attendance)
+def count_saved_attendance(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_key', None)
+    if loaded == instance.summary_key:
+        return
+    changes = [(instance.summary_key, 1)]
+    if loaded is not None:
+        changes.append((loaded, -1))
+    apply_summary_changes(changes)
+    instance._loaded_key = instance.summary_key
+
+
+# A class or student deleted with its attendance takes the summaries along, so
+# the cascade must not write counters back for it. The pending parents are
+# noted on the object the delete started from, which every signal of one
+# delete() receives as `origin`.
+@receiver(pre_delete, sender=Class)
+@receiver(pre_delete, sender=StudentProfile)
+def note_deleted_summary_parent(sender, instance, origin=None, **kwargs):
+    if origin is not None:
+        origin.__dict__.setdefault('_deleted_summary_parents', set()).add((sender, instance.pk))
+
+
+@receiver(post_delete, sender=Attendance)
+def count_deleted_attendance(sender, instance, origin=None, **kwargs):
+    key = getattr(instance, '_loaded_key', None)
+    deleted = getattr(origin, '_deleted_summary_parents', ())
+    if key is None or (Class, key[1]) in deleted or (StudentProfile, key[0]) in deleted:
+        return
+    apply_summary_changes([(key, -1)])
+
+
+# Keep the student visibility rows in step with parent links and class rosters.
+# A clear() is only seen before it happens, so its viewers are noted then.
+@receiver(m2m_changed, sender=ParentProfile.children.through)
+def refresh_parent_visibility(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._visibility_viewers = (
+            [instance.user_id] if not reverse else parent_user_ids(instance.parents.values_list('pk', flat=True))
+        )
+    elif action == 'post_clear':
+        refresh_viewers(instance.__dict__.pop('_visibility_viewers', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_viewers([instance.user_id] if not reverse else parent_user_ids(pk_set))
+
+
+@receiver(m2m_changed, sender=Class.students.through)
+def refresh_class_visibility(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._visibility_viewers = teacher_user_ids(
+            [instance.assigned_teacher_id] if not reverse
+            else instance.classes.values_list('assigned_teacher_id', flat=True)
+        )
+    elif action == 'post_clear':
+        refresh_viewers(instance.__dict__.pop('_visibility_viewers', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_viewers(teacher_user_ids(
+            [instance.assigned_teacher_id] if not reverse
+            else Class.objects.filter(pk__in=pk_set).values_list('assigned_teacher_id', flat=True)
+        ))
+
+
+@receiver(post_save, sender=Class)
+def refresh_reassigned_teachers(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_teacher_id', None)
+    if not created and loaded != instance.assigned_teacher_id:
+        refresh_viewers(teacher_user_ids([loaded, instance.assigned_teacher_id]))
+    instance._loaded_teacher_id = instance.assigned_teacher_id
+
+
+@receiver(post_delete, sender=Class)
+def refresh_deleted_class_teacher(sender, instance, **kwargs):
+    refresh_viewers(teacher_user_ids([instance.assigned_teacher_id]))
+
+
+@receiver(post_delete, sender=ParentProfile)
+@receiver(post_delete, sender=TeacherProfile)
+def refresh_deleted_profile_viewer(sender, instance, **kwargs):
+    refresh_viewers([instance.user_id])
+
+
+# Announcements are emailed by a worker, never while posting
+@receiver(post_save, sender=Announcement)
+def queue_announcement_email(sender, instance, created, **kwargs):
+    if created:
+        enqueue('email_announcement', {'announcement': instance.pk})
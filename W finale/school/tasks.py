@@ -0,0 +1,78 @@
+"""
+Background tasks run by the job queue (see school/jobs.py). Emails are never sent
+in a request: the work that needs one enqueues a send_email job, and the worker
+sends every email it claims in one batch over a single SMTP connection.
+"""
+from datetime import date
+
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .announcements import recipients
+from .jobs import enqueue_many, task
+from .models import Announcement, CustomUser, FeeReminder
+
+
+def email(to, subject, body):
+    """The payload of a send_email job."""
+    return {'to': list(to), 'subject': subject, 'body': body}
+
+
+def welcome_email(user):
+    return email([user.email], 'Welcome to the school portal', (
+        f'Hello {user.get_full_name() or user.username},\n\n'
+        f'Your {user.get_role_display().lower()} account "{user.username}" is ready.'
+    ))
+
+
+@task('send_email', batch=True)
+def send_emails(payloads):
+    """Send a batch of emails over one connection; a message that fails is retried on its own."""
+    errors = []
+    with get_connection() as connection:
+        for payload in payloads:
+            message = EmailMessage(payload['subject'], payload['body'], to=payload['to'], connection=connection)
+            try:
+                message.send()
+            except Exception as error:
+                errors.append(error)
+            else:
+                errors.append(None)
+    return errors
+
+
+@task('email_announcement')
+def email_announcement(payload):
+    """Queue an email to every recipient of an announcement who has an address."""
+    announcement = Announcement.objects.select_related('class_instance').get(pk=payload['announcement'])
+    addresses = CustomUser.objects.filter(pk__in=recipients(announcement.class_instance)).exclude(email='')
+    subject = announcement.title
+    if announcement.class_instance is not None:
+        subject = f'{announcement.class_instance.title}: {subject}'
+    enqueue_many('send_email', (
+        email([address], subject, announcement.body)
+        for address in addresses.values_list('email', flat=True).iterator(chunk_size=2000)
+    ), priority=-1)
+
+
+@task('send_fee_reminders')
+def send_fee_reminders(payload):
+    """
+    Queue the emails of a reminder run, to each student and their parents, and
+    mark the reminders sent. Reminders already marked are skipped, so a retried
+    or repeated run does not email anyone twice.
+    """
+    reminders = FeeReminder.objects.filter(run_date=date.fromisoformat(payload['run_date']), sent_at__isnull=True)
+    sent = []
+    messages = []
+    for reminder in reminders.select_related('student__user').prefetch_related('student__parents__user').iterator(chunk_size=1000):
+        student = reminder.student.user
+        to = [user.email for user in [student, *(parent.user for parent in reminder.student.parents.all())] if user.email]
+        sent.append(reminder.pk)
+        if to:
+            messages.append(email(to, 'Overdue school fees', (
+                f'{student.get_full_name() or student.username} has {reminder.fee_count} overdue '
+                f'fee(s) totalling {reminder.amount}, the oldest due on {reminder.oldest_due_date}.'
+            )))
+    enqueue_many('send_email', messages)
+    FeeReminder.objects.filter(pk__in=sent).update(sent_at=timezone.now())
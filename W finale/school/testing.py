@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .instrumentation import record_queries
+
+
+@contextmanager
+def query_budget(max_queries=None, max_repeats=None, using=None):
+    """
+    Fail the test if the block runs more than `max_queries` queries, or repeats a
+    statement more than `max_repeats` times (default SCHOOL_N_PLUS_ONE_THRESHOLD).
+    The failure lists the statements run, most repeated first.
+
+        with query_budget(5):
+            self.client.get('/dashboard/')
+    """
+    if max_repeats is None:
+        max_repeats = getattr(settings, 'SCHOOL_N_PLUS_ONE_THRESHOLD', 5)
+    with record_queries(using) as queries:
+        yield queries
+
+    problems = []
+    if max_queries is not None and queries.count > max_queries:
+        problems.append(f'{queries.count} queries run, the budget is {max_queries}')
+    repeated = queries.repeated(max_repeats)
+    if repeated:
+        problems.append(f'{len(repeated)} statement(s) repeated more than {max_repeats} times')
+    if problems:
+        statements = '\n'.join(f'{count:>5}x {sql}' for sql, count in queries.fingerprints.most_common())
+        raise AssertionError('; '.join(problems) + ':\n' + statements)
@@ -1,3 +1,1418 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import Group, Permission
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.management import call_command, CommandError
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import services
+from .benchmark import compare, run_benchmark, seed_users
+from .announcements import inbox, mark_read, post_announcement
+from .autocomplete import MAX_SCAN, AutocompleteIndex, autocomplete
+from .attendance import attendance_rates, mark_attendance, verify_summary
+from .backends import permission_cache, permission_cache_key
+from .forms import CustomUserCreationForm
+from .fees import outstanding_balance, queue_fee_reminders, refresh_fee_statistics
+from .dashboards import gather_queries
+from .generator import SchoolGenerator
+from .gradebook import grade_statistics
+from .instrumentation import fingerprint
+from .jobs import backoff, claim, complete, enqueue, run_jobs, task, TASKS
+from .pagination import EstimatedCountPaginator, KeysetPaginator, estimated_count
+from .models import (
+    CustomUser, StudentProfile, TeacherProfile, ParentProfile, Subject, Class, Attendance, AttendanceSummary,
+    Exam, Grade, Schedule, Fee, FeeReminder, Announcement, InboxItem, Job, StudentVisibility,
+)
+from .management.commands.refresh_replica import backup_sqlite
+from .middleware import QueryInstrumentationMiddleware, ReplicaPinningMiddleware
+from .roles import ROLE_GROUPS, ROLE_PROFILE_MODELS, get_role_group, role_registry
+from .search import index_users, matching, search_users
+from .visibility import can_view_student, filter_visible, rebuild as rebuild_visibility, visibility_cache
+from .routers import ReplicaRouter, primary_reads, read_routing
+from .rules import permitted
+from .testing import query_budget
+from .timetable import find_conflicts, generate_timetable, save_timetable
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class ImportRosterTests(TestCase):
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def write_roster(self, rows):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as roster:
+            for row in rows:
+                roster.write(json.dumps(row) + '\n')
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_creates_users_profiles_and_groups(self):
+        path = self.write_roster([
+            {'username': 'alice', 'email': 'alice@example.com', 'role': 'student', 'password': 'pw-alice'},
+            {'username': 'bob', 'role': 'teacher', 'password': 'pw-bob'},
+            {'username': 'carol', 'role': 'parent'},
+            {'username': 'dave', 'role': 'janitor'},
+        ])
+        call_command('import_roster', path, chunk_size=2, workers=2, stdout=StringIO())
+
+        self.assertEqual(CustomUser.objects.count(), 3)
+        alice = CustomUser.objects.get(username='alice')
+        self.assertTrue(alice.check_password('pw-alice'))
+        self.assertFalse(CustomUser.objects.get(username='carol').has_usable_password())
+        self.assertTrue(StudentProfile.objects.filter(user=alice).exists())
+        self.assertTrue(TeacherProfile.objects.filter(user__username='bob').exists())
+        self.assertTrue(ParentProfile.objects.filter(user__username='carol').exists())
+        self.assertEqual(list(alice.groups.values_list('name', flat=True)), ['Student'])
+
+    def test_existing_usernames_are_skipped(self):
+        path = self.write_roster([{'username': 'alice', 'role': 'student'}])
+        call_command('import_roster', path, workers=0, stdout=StringIO())
+        call_command('import_roster', path, workers=0, stdout=StringIO())
+        self.assertEqual(CustomUser.objects.count(), 1)
+        self.assertEqual(StudentProfile.objects.count(), 1)
+        self.assertEqual(Group.objects.get(name='Student').user_set.count(), 1)
+
+
+class RoleRegistryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for role in ROLE_GROUPS:
+            get_role_group(role)
+
+    def setUp(self):
+        role_registry.clear()
+        self.addCleanup(role_registry.clear)
+
+    def test_user_creation_uses_cached_grants(self):
+        role_registry.load()
+        # user INSERT, profile INSERT, membership INSERT; the search index follows the commit
+        with self.assertNumQueries(3):
+            user = CustomUser.objects.create(username='erin', role='teacher')
+        self.assertTrue(TeacherProfile.objects.filter(user=user).exists())
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Teacher'])
+
+    def test_group_changes_clear_the_registry(self):
+        grant = role_registry.get('student')
+        permission = Permission.objects.get(codename='view_group')
+        Group.objects.get(pk=grant.group_id).permissions.add(permission)
+        self.assertIn(permission.pk, role_registry.get('student').permission_ids)
+
+
+class PermissionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create(username='sam', role='staff', is_staff=True)
+        cls.teacher = CustomUser.objects.create(username='tina', role='teacher')
+        cls.permission = Permission.objects.get(codename='view_group')
+
+    def setUp(self):
+        permission_cache().clear()
+        self.addCleanup(role_registry.clear)
+
+    def get_permissions(self, user_id):
+        # A fresh user object, like the one loaded for each request
+        return CustomUser.objects.get(pk=user_id).get_all_permissions()
+
+    def test_permissions_are_served_from_the_cache(self):
+        self.get_permissions(self.teacher.pk)
+        user = CustomUser.objects.get(pk=self.teacher.pk)
+        with self.assertNumQueries(0):
+            user.get_all_permissions()
+
+    def test_membership_and_grant_changes_invalidate(self):
+        self.assertNotIn('auth.view_group', self.get_permissions(self.teacher.pk))
+        self.teacher.user_permissions.add(self.permission)
+        self.assertIn('auth.view_group', self.get_permissions(self.teacher.pk))
+
+        group = Group.objects.create(name='Helpers')
+        self.teacher.groups.add(group)
+        change_group = Permission.objects.get(codename='change_group')
+        self.assertNotIn('auth.change_group', self.get_permissions(self.teacher.pk))
+        group.permissions.add(change_group)
+        self.assertIn('auth.change_group', self.get_permissions(self.teacher.pk))
+        group.delete()
+        self.assertNotIn('auth.change_group', self.get_permissions(self.teacher.pk))
+
+    def test_sets_cached_before_commit_are_invalidated_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.teacher.user_permissions.add(self.permission)
+            # What a concurrent request that cannot see the grant yet would cache
+            stale = permission_cache_key(CustomUser.objects.get(pk=self.teacher.pk))
+            permission_cache().set(stale, set())
+            self.assertNotIn('auth.view_group', self.get_permissions(self.teacher.pk))
+        for callback in callbacks:
+            callback()
+        self.assertIn('auth.view_group', self.get_permissions(self.teacher.pk))
+
+        self.teacher.user_permissions.clear()
+        self.assertNotIn('auth.view_group', self.get_permissions(self.teacher.pk))
+        self.teacher.user_permissions.add(self.permission)
+        self.permission.user_set.clear()
+        self.assertNotIn('auth.view_group', self.get_permissions(self.teacher.pk))
+
+    def test_check_permissions_endpoint(self):
+        self.teacher.user_permissions.add(self.permission)
+        self.client.force_login(self.staff)
+        response = self.client.get('/check-permissions/', {'username': 'tina'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth.view_group', response.json()['permissions'])
+
+        self.client.force_login(self.teacher)
+        response = self.client.get('/check-permissions/', {'username': 'sam'})
+        self.assertEqual(response.status_code, 403)
+
+
+class ProfileLoadingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = CustomUser.objects.create(username='stu', role='student')
+        for n in range(3):
+            CustomUser.objects.create(username=f'stu{n}', role='student')
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_dashboard_loads_user_and_profile_together(self):
+        self.client.force_login(self.student)
+        # session, then user joined with its profile
+        with self.assertNumQueries(2):
+            response = self.client.get('/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'stu (Student)')
+
+    def test_with_profile_for_a_role(self):
+        with self.assertNumQueries(1):
+            users = list(CustomUser.objects.with_profile('student'))
+            names = [str(user.profile) for user in users]
+        self.assertEqual(len(names), 4)
+
+    def test_profile_lists_load_users(self):
+        with self.assertNumQueries(1):
+            names = [str(profile) for profile in StudentProfile.objects.all()]
+        self.assertIn('stu (Student)', names)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class RegistrationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for role in ROLE_GROUPS:
+            get_role_group(role)
+
+    def setUp(self):
+        role_registry.clear()
+        role_registry.load()
+        self.addCleanup(role_registry.clear)
+
+    def register(self, username, role):
+        return self.client.post('/register/', {
+            'username': username, 'email': f'{username}@example.com', 'role': role,
+            'password1': 'A-long-password-42', 'password2': 'A-long-password-42',
+        })
+
+    def test_registration_query_budget(self):
+        # username checks (clean_username, validate_unique), savepoint, user INSERT,
+        # profile INSERT, membership INSERT, release. The old view took 8: the two
+        # username checks, user INSERT, profile INSERT, group SELECT, membership
+        # INSERT, a second user UPDATE for the role and a profile exists() check.
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(7):
+            response = self.register('newparent', 'parent')
+        self.assertRedirects(response, '/success/')
+        # After the commit: search index INSERT, welcome email job INSERT
+        with self.assertNumQueries(2):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Job.objects.get().payload['to'], ['newparent@example.com'])
+        user = CustomUser.objects.get(username='newparent')
+        self.assertEqual(user.role, 'parent')
+        self.assertEqual(ParentProfile.objects.filter(user=user).count(), 1)
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Parent'])
+
+    def test_role_is_validated(self):
+        response = self.register('nobody', 'janitor')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(CustomUser.objects.filter(username='nobody').exists())
+
+    def test_username_is_validated(self):
+        response = self.register('bad name!/%', 'parent')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('username', response.context['form'].errors)
+        self.assertFalse(CustomUser.objects.filter(username='bad name!/%').exists())
+
+    def test_concurrent_duplicate_becomes_a_form_error(self):
+        # Another registration takes the username between validation and INSERT
+        form = CustomUserCreationForm({
+            'username': 'twin', 'email': 'twin@example.com', 'role': 'parent',
+            'password1': 'A-long-password-42', 'password2': 'A-long-password-42',
+        })
+        self.assertTrue(form.is_valid())
+        CustomUser.objects.create(username='twin', role='parent')
+        self.assertIsNone(services.register_user(form))
+        self.assertIn('username', form.errors)
+        self.assertEqual(CustomUser.objects.filter(username='twin').count(), 1)
+
+
+class AttendanceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = CustomUser.objects.create(username='teach', role='teacher')
+        cls.other_teacher = CustomUser.objects.create(username='other', role='teacher')
+        cls.klass = Class.objects.create(
+            title='Algebra 1', subject=Subject.objects.create(name='Maths'),
+            assigned_teacher=cls.teacher.teacherprofile,
+        )
+        cls.students = [
+            CustomUser.objects.create(username=f'pupil{n}', role='student').studentprofile for n in range(40)
+        ]
+        cls.klass.students.add(*cls.students)
+        cls.outsider = CustomUser.objects.create(username='outsider', role='student').studentprofile
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def post_roll_call(self, statuses, day='2024-09-02'):
+        return self.client.post(
+            f'/classes/{self.klass.pk}/attendance/{day}/',
+            json.dumps({'statuses': statuses}), content_type='application/json',
+        )
+
+    def test_roll_call_takes_constant_queries_and_upserts(self):
+        self.client.force_login(self.teacher)
+        statuses = {student.pk: 'Present' for student in self.students}
+        # session, user, class, enrolment, savepoint, class lock, previous statuses,
+        # upsert, summary upsert, release
+        with self.assertNumQueries(10):
+            response = self.post_roll_call(statuses)
+        self.assertEqual(response.json()['marked'], 40)
+
+        statuses[self.students[0].pk] = 'Absent'
+        self.post_roll_call(statuses)
+        self.assertEqual(Attendance.objects.count(), 40)
+        self.assertEqual(Attendance.objects.get(student=self.students[0]).status, 'Absent')
+
+    def test_roll_call_is_validated(self):
+        self.client.force_login(self.teacher)
+        self.assertEqual(self.post_roll_call({self.outsider.pk: 'Present'}).status_code, 400)
+        self.assertEqual(self.post_roll_call({self.students[0].pk: 'Late'}).status_code, 400)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_summary_follows_bulk_and_single_writes(self):
+        first, second = self.students[:2]
+        mark_attendance(self.klass, date(2024, 9, 2), {first.pk: 'Present', second.pk: 'Present'})
+        mark_attendance(self.klass, date(2024, 9, 3), {first.pk: 'Absent', second.pk: 'Present'})
+        mark_attendance(self.klass, date(2024, 9, 3), {first.pk: 'Present', second.pk: 'Absent'})
+        summary = AttendanceSummary.objects.get(student=first, year=2024, month=9)
+        self.assertEqual((summary.present, summary.absent), (2, 0))
+
+        record = Attendance.objects.get(student=second, date=date(2024, 9, 3))
+        record.status = 'Present'
+        record.save()
+        Attendance.objects.create(student=second, class_instance=self.klass, date=date(2024, 10, 1), status='Absent')
+        Attendance.objects.filter(student=first, date=date(2024, 9, 2)).delete()
+        self.assertEqual(verify_summary(), [])
+
+        with self.assertNumQueries(1):
+            rates = attendance_rates(class_instance=self.klass, year=2024)
+        self.assertEqual([(row['month'], row['present'], row['absent']) for row in rates], [(9, 3, 0), (10, 0, 1)])
+
+    def test_summary_follows_partially_loaded_records(self):
+        first, second = self.students[:2]
+        mark_attendance(self.klass, date(2024, 9, 2), {first.pk: 'Present', second.pk: 'Present'})
+        record = Attendance.objects.defer('status').get(student=first)
+        record.status = 'Absent'
+        record.save()
+        Attendance.objects.only('id').get(student=second).delete()
+        self.assertEqual(verify_summary(), [])
+        summary = AttendanceSummary.objects.get(student=first)
+        self.assertEqual((summary.present, summary.absent), (0, 1))
+
+    def test_deleting_a_class_or_student_with_attendance(self):
+        mark_attendance(self.klass, date(2024, 9, 2), {student.pk: 'Present' for student in self.students})
+        self.students[0].delete()
+        connection.check_constraints()
+        self.assertEqual(verify_summary(), [])
+        self.klass.delete()
+        connection.check_constraints()
+        self.assertFalse(AttendanceSummary.objects.exists())
+
+    def test_rebuild_command(self):
+        mark_attendance(self.klass, date(2024, 9, 2), {student.pk: 'Present' for student in self.students})
+        AttendanceSummary.objects.update(present=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_attendance_summary', verify=True, stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_attendance_summary', stdout=StringIO())
+        self.assertEqual(verify_summary(), [])
+
+    def test_only_the_assigned_teacher_marks_the_class(self):
+        self.client.force_login(self.other_teacher)
+        self.assertEqual(self.post_roll_call({self.students[0].pk: 'Present'}).status_code, 403)
+
+
+class GradebookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths, science = Subject.objects.create(name='Maths'), Subject.objects.create(name='Science')
+        cls.klass = Class.objects.create(title='Year 7', subject=maths)
+        students = [CustomUser.objects.create(username=f'kid{n}', role='student').studentprofile for n in range(5)]
+        cls.values = {
+            Exam.objects.create(class_instance=cls.klass, subject=maths, date=date(2024, 10, 1)): [95, 85, 72, 64, 40],
+            Exam.objects.create(class_instance=cls.klass, subject=science, date=date(2024, 10, 2)): [88, 91],
+        }
+        for exam, values in cls.values.items():
+            Grade.objects.bulk_create([
+                Grade(exam=exam, student=student, grade_value=value) for student, value in zip(students, values)
+            ])
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_statistics_match_numpy_per_exam(self):
+        with self.assertNumQueries(1):
+            stats = grade_statistics(percentiles=(25, 75))
+        self.assertEqual(list(stats.count), [5, 2])
+        self.assertEqual(list(stats.keys['date'].astype(str)), ['2024-10-01', '2024-10-02'])
+        for index, values in enumerate(self.values.values()):
+            values = np.array(values, dtype=float)
+            self.assertAlmostEqual(stats.mean[index], values.mean())
+            self.assertAlmostEqual(stats.median[index], np.median(values))
+            self.assertAlmostEqual(stats.std[index], values.std())
+            np.testing.assert_allclose(stats.percentiles[index], np.percentile(values, [25, 75]))
+        # F, D, C, B, A
+        self.assertEqual(list(stats.distribution[0]), [1, 1, 1, 1, 1])
+
+    def test_school_wide_and_empty(self):
+        stats = grade_statistics(by=())
+        self.assertEqual(list(stats.count), [7])
+        self.assertEqual((stats.min[0], stats.max[0]), (40, 95))
+        self.assertEqual(len(grade_statistics(Grade.objects.none(), by=('subject',)).count), 0)
+
+    def test_report_command(self):
+        out = StringIO()
+        call_command('gradebook_report', by='subject', json=True, stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['count'] for row in rows], [5, 2])
+
+
+class ProgressReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths = Subject.objects.create(name='Maths')
+        cls.klass = Class.objects.create(title='Year 7', subject=maths)
+        exam = Exam.objects.create(class_instance=cls.klass, subject=maths, date=date(2024, 10, 1))
+        for n, value in enumerate([95, 85, 72, 64, 40]):
+            student = CustomUser.objects.create(username=f'kid{n}', role='student').studentprofile
+            Grade.objects.create(exam=exam, student=student, grade_value=value)
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_progress_reports_are_written_and_resumed(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        self.klass.students.add(*StudentProfile.objects.all())
+        mark_attendance(self.klass, date(2024, 10, 1), {self.klass.students.first().pk: 'Present'})
+        call_command('generate_progress_reports', output, class_id=self.klass.pk, workers=0, stdout=StringIO())
+        self.assertEqual(len(os.listdir(output)), 10)
+
+        student = StudentProfile.objects.order_by('pk').first()
+        with open(os.path.join(output, f'report-{student.pk}.txt')) as report:
+            text = report.read()
+        self.assertIn('Maths', text)
+        self.assertIn('95.00', text)
+
+        os.remove(os.path.join(output, f'report-{student.pk}.html'))
+        out = StringIO()
+        call_command('generate_progress_reports', output, workers=2, chunk_size=2, stdout=out)
+        self.assertIn('Wrote 1 progress reports', out.getvalue())
+
+    def test_chunk_size_must_be_positive(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        with self.assertRaisesMessage(CommandError, '--chunk-size must be at least 1.'):
+            call_command('generate_progress_reports', output, chunk_size=0, workers=0, stdout=StringIO())
+
+
+class TimetableTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        subject = Subject.objects.create(name='History')
+        teachers = [CustomUser.objects.create(username=f'prof{n}', role='teacher').teacherprofile for n in range(3)]
+        students = [CustomUser.objects.create(username=f'learner{n}', role='student').studentprofile for n in range(6)]
+        cls.classes = []
+        for n in range(6):
+            klass = Class.objects.create(
+                title=f'History {n}', subject=subject, assigned_teacher=teachers[n % 3],
+                room_number=f'R{n % 2}', weekly_sections=3,
+            )
+            klass.students.add(students[n], students[(n + 1) % 6])
+            cls.classes.append(klass)
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_conflicts_are_found(self):
+        first, second = self.classes[0], self.classes[3]  # same teacher, different rooms
+        Schedule.objects.create(class_instance=first, day_of_week='Monday', section='1st Section')
+        Schedule.objects.create(class_instance=second, day_of_week='Monday', section='1st Section')
+        Schedule.objects.create(class_instance=self.classes[1], day_of_week='Monday', section='2nd Section')
+        Schedule.objects.create(class_instance=self.classes[2], day_of_week='Monday', section='2nd Section')
+        kinds = sorted(conflict.kind for conflict in find_conflicts())
+        # 0 and 3 share a teacher, 1 and 2 share a student
+        self.assertEqual(kinds, ['students', 'teacher'])
+
+    def test_generated_timetable_is_conflict_free(self):
+        # Every pair of classes shares a teacher, a room or a student, so the
+        # 18 sections need 18 distinct slots out of 20
+        assignments = generate_timetable()
+        self.assertEqual({len(slots) for slots in assignments.values()}, {3})
+        save_timetable(assignments)
+        self.assertEqual(Schedule.objects.count(), 18)
+        self.assertEqual(find_conflicts(), [])
+
+    def test_regenerating_some_classes_keeps_the_others_booked(self):
+        # Class 0 shares its teacher with 3, its room with 2 and students with 1,
+        # which already hold the slots a class on its own would get first
+        for klass, day in ((self.classes[3], 'Monday'), (self.classes[2], 'Tuesday'), (self.classes[1], 'Wednesday')):
+            Schedule.objects.create(class_instance=klass, day_of_week=day, section='1st Section')
+        save_timetable(generate_timetable([self.classes[0].pk]))
+        self.assertEqual(Schedule.objects.filter(class_instance=self.classes[0]).count(), 3)
+        self.assertEqual(find_conflicts(), [])
+
+        Class.objects.filter(pk=self.classes[0].pk).update(weekly_sections=0)
+        save_timetable(generate_timetable([self.classes[0].pk]))
+        self.assertFalse(Schedule.objects.filter(class_instance=self.classes[0]).exists())
+
+
+class FeeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.students = [CustomUser.objects.create(username=f'payer{n}', role='student').studentprofile for n in range(3)]
+        first, second, third = cls.students
+        Fee.objects.bulk_create([
+            Fee(student=first, amount_due='100.00', due_date=date(2024, 1, 1), paid=True, payment_date=date(2024, 1, 2)),
+            Fee(student=first, amount_due='50.00', due_date=date(2024, 2, 1)),
+            Fee(student=first, amount_due='25.00', due_date=date(2024, 3, 1)),
+            Fee(student=second, amount_due='80.00', due_date=date(2024, 12, 1)),
+            Fee(student=third, amount_due='10.00', due_date=date(2024, 1, 15)),
+        ])
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_outstanding_balance_reads_the_partial_index(self):
+        self.assertEqual(outstanding_balance(self.students[0]), Decimal('75.00'))
+        self.assertEqual(outstanding_balance(StudentProfile.objects.create(user=CustomUser.objects.create(username='x'))), 0)
+        # Years of paid history next to a few open fees
+        Fee.objects.bulk_create([
+            Fee(student=student, amount_due='10.00', due_date=date(2020, 1, 1), paid=True)
+            for student in self.students for _ in range(100)
+        ])
+        refresh_fee_statistics()
+        plan = Fee.objects.unpaid().filter(student=self.students[0]).values('amount_due').explain()
+        self.assertIn('fee_unpaid_student_idx', plan)
+
+    def test_reminders_are_queued_once_per_run(self):
+        self.assertEqual(queue_fee_reminders(date(2024, 6, 1), chunk_size=1), 2)
+        queue_fee_reminders(date(2024, 6, 1))
+        reminders = FeeReminder.objects.order_by('student_id')
+        self.assertEqual([(r.student_id, r.amount, r.fee_count) for r in reminders], [
+            (self.students[0].pk, Decimal('75.00'), 2), (self.students[2].pk, Decimal('10.00'), 1),
+        ])
+        self.assertEqual(reminders[0].oldest_due_date, date(2024, 2, 1))
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create(username='clerk', role='staff')
+        cls.students = [CustomUser.objects.create(username=f'alum{n}', role='student') for n in range(3)]
+        klass = Class.objects.create(title='Art', subject=Subject.objects.create(name='Art'))
+        klass.students.add(cls.students[0].studentprofile)
+        cls.klass = klass
+        Fee.objects.create(student=cls.students[0].studentprofile, amount_due='12.50', due_date=date(2024, 5, 1))
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_user_export_streams_csv(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/export/users/', {'role': 'student'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'username'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn(str(self.students[0].studentprofile.pk), lines[1].split(','))
+
+    def test_filters_and_jsonl(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/export/fees/', {'format': 'jsonl', 'class': self.klass.pk, 'to': '2024-12-31'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['username'], row['amount_due']) for row in rows], [('alum0', '12.50')])
+        self.assertEqual(self.client.get('/export/fees/', {'from': 'yesterday'}).status_code, 400)
+
+    def test_students_cannot_export(self):
+        self.client.force_login(self.students[0])
+        self.assertEqual(self.client.get('/export/users/').status_code, 403)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_data', 'users', format='jsonl', role='staff', stdout=out)
+        self.assertEqual([json.loads(line)['username'] for line in out.getvalue().splitlines()], ['clerk'])
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create(username='registrar', role='staff')
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'pupil{n:02}', role='student' if n % 3 else 'parent') for n in range(30)
+        ])
+        ParentProfile.objects.bulk_create([ParentProfile(user=user) for user in CustomUser.objects.filter(role='parent')])
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def walk(self, paginator):
+        rows, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            rows += page.object_list
+            if not page.has_next:
+                return rows
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_row_once(self):
+        for ordering in (('date_joined', 'id'), ('-date_joined', '-id'), ('role', 'id')):
+            users = CustomUser.objects.values('id', 'role', 'date_joined')
+            rows = self.walk(KeysetPaginator(users, ordering, per_page=7))
+            self.assertEqual(rows, list(users.order_by(*ordering)))
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        paginator = KeysetPaginator(CustomUser.objects.all(), ('role', 'id'), per_page=5)
+        with self.assertNumQueries(1):
+            page = paginator.page()
+        for _ in range(4):
+            with self.assertNumQueries(1):
+                page = paginator.page(page.next_cursor)
+        self.assertEqual(len(page.object_list), 5)
+
+    def test_estimated_count(self):
+        self.assertEqual(estimated_count(CustomUser.objects.all()), (31, True))
+        self.assertEqual(estimated_count(CustomUser.objects.filter(role='parent'), exact_limit=5), (5, False))
+
+    def test_user_api(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/users/', {'role': 'student', 'per_page': 15}).json()
+        self.assertEqual((len(response['results']), response['count'], response['count_is_exact']), (15, 20, True))
+        response = self.client.get('/api/users/', {'role': 'student', 'per_page': 15, 'cursor': response['next_cursor']})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertIsNone(response.json()['next_cursor'])
+        self.assertEqual(self.client.get('/api/users/', {'cursor': 'not-a-cursor'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/users/', {'order': 'password'}).status_code, 400)
+
+    def test_profile_api_and_directory(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/profiles/parent/', {'count': 'none'}).json()
+        self.assertEqual(len(response['results']), 10)
+        self.assertEqual(self.client.get('/api/profiles/janitor/').status_code, 404)
+        self.assertContains(self.client.get('/users/', {'per_page': 10}), 'Next page')
+
+    def test_students_cannot_list_users(self):
+        self.client.force_login(CustomUser.objects.get(username='pupil01'))
+        self.assertEqual(self.client.get('/api/users/').status_code, 403)
+        self.assertEqual(self.client.get('/users/').status_code, 403)
+
+
+class AdminQueryBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create(username='head', role='admin', is_staff=True, is_superuser=True)
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        self.client.force_login(self.admin)
+
+    def add_students(self, count):
+        start = CustomUser.objects.count()
+        users = CustomUser.objects.bulk_create([
+            CustomUser(username=f'enrolled{start + n}', role='student') for n in range(count)
+        ])
+        StudentProfile.objects.bulk_create([StudentProfile(user=user) for user in users])
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_profile_changelist_queries_do_not_grow_with_rows(self):
+        self.add_students(100)
+        small = self.changelist_queries('/admin/school/studentprofile/')
+        self.add_students(150)
+        large = self.changelist_queries('/admin/school/studentprofile/')
+        self.assertEqual(len(small), len(large))
+        self.assertLessEqual(len(large), 6)
+        filtered = self.changelist_queries('/admin/school/customuser/?q=enrolled1&is_staff__exact=0')
+        self.assertLessEqual(len(filtered), 8)
+
+    def test_large_tables_are_estimated(self):
+        self.add_students(30)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator = EstimatedCountPaginator(StudentProfile.objects.order_by('pk'), 10)
+        paginator.exact_limit = 10
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 30)
+        self.assertNotIn('COUNT', queries[0]['sql'])
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create(username='auditor', role='staff')
+        klass = Class.objects.create(title='Music', subject=Subject.objects.create(name='Music'))
+        for n in range(8):
+            klass.students.add(CustomUser.objects.create(username=f'singer{n}', role='student').studentprofile)
+        cls.klass = klass
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        self.client.force_login(self.staff)
+
+    def test_fingerprints_ignore_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'x' LIMIT 21"),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)  AND name = %s LIMIT 1'),
+        )
+        self.assertEqual(fingerprint('INSERT INTO t (a) VALUES (%s), (%s)'), 'INSERT INTO t (a) VALUES (...)')
+
+    def test_requests_are_logged_with_server_timing(self):
+        with self.assertLogs('school.sql', 'INFO') as logs:
+            response = self.client.get('/dashboard/')
+        stats = json.loads(logs.records[0].getMessage())
+        self.assertEqual((stats['view'], stats['queries'], stats['n_plus_one']), ('dashboard', 2, []))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    async def test_queries_are_counted_under_asgi(self):
+        # The ORM runs in a worker thread, not on the event loop's
+        await self.async_client.aforce_login(self.staff)
+        with self.assertLogs('school.sql', 'INFO') as logs:
+            response = await self.async_client.get('/dashboard/')
+        stats = json.loads(logs.records[0].getMessage())
+        self.assertEqual((stats['view'], stats['queries']), ('dashboard', 2))
+        self.assertIn('desc="2 queries"', response['Server-Timing'])
+
+    @override_settings(SCHOOL_N_PLUS_ONE_THRESHOLD=3)
+    def test_n_plus_one_is_flagged(self):
+        def profile_names(request):
+            return HttpResponse(', '.join(str(profile) for profile in StudentProfile.objects.select_related(None)))
+
+        middleware = QueryInstrumentationMiddleware(profile_names)
+        with self.assertLogs('school.sql', 'WARNING') as logs:
+            middleware(RequestFactory().get('/names/'))
+        stats = logs.records[0].sql_stats
+        self.assertEqual([query['count'] for query in stats['n_plus_one']], [8])
+        with self.assertRaisesMessage(AssertionError, 'repeated more than 3 times'):
+            with query_budget():
+                [str(profile) for profile in StudentProfile.objects.select_related(None)]
+
+    def test_view_query_budgets(self):
+        with query_budget(2):
+            self.client.get('/dashboard/')
+        with query_budget(5):
+            self.client.get('/api/users/', {'per_page': 5})
+        with query_budget(4):
+            self.client.get(f'/classes/{self.klass.pk}/attendance/2024-03-04/')
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        autocomplete.reset()
+        self.addCleanup(autocomplete.reset)
+
+    def test_seeded_scenarios_run_without_errors(self):
+        staff = seed_users(120, batch_size=50)
+        self.assertEqual(CustomUser.objects.filter(role='student').count(), 70)
+        self.assertEqual(StudentProfile.objects.count(), 70)
+        results = run_benchmark(120, staff, requests=4)
+        self.assertEqual({stats['errors'] for stats in results.values()}, {0})
+        self.assertTrue(all(stats['p50_ms'] <= stats['p99_ms'] for stats in results.values()))
+
+    def test_regressions_against_a_baseline(self):
+        baseline = {'scenarios': {'login': {'p95_ms': 10.0, 'rps': 100.0}}}
+        self.assertEqual(compare({'scenarios': {'login': {'p95_ms': 11.0, 'rps': 95.0}}}, baseline), [])
+        self.assertEqual(len(compare({'scenarios': {'login': {'p95_ms': 15.0, 'rps': 60.0}}}, baseline)), 2)
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class GeneratorTests(TestCase):
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def generate(self, **options):
+        return SchoolGenerator(200, school_days=10, class_size=20, classes_per_student=2, batch_size=500, **options).generate()
+
+    def test_generated_school_is_consistent(self):
+        counts = self.generate()
+        self.assertEqual(counts['school_customuser'], 200)
+        self.assertEqual(StudentProfile.objects.count(), 140)
+        self.assertEqual(Class.objects.count(), 14)
+        self.assertEqual(Attendance.objects.count(), 140 * 2 * 10)
+        self.assertEqual(Grade.objects.count(), 140 * 2 * 4)
+        self.assertEqual(Fee.objects.count(), 140 * 3)
+        self.assertTrue(ParentProfile.objects.filter(children__isnull=False).exists())
+        self.assertEqual(verify_summary(), [])
+        user = CustomUser.objects.get(username='user0000010')
+        self.assertTrue(user.check_password('school-Pass-2024'))
+        self.assertEqual(list(user.groups.values_list('name', flat=True)), ['Parent'])
+
+    def test_sequences_move_past_explicit_ids(self):
+        with mock.patch.object(connection.ops, 'sequence_reset_sql', return_value=[]) as reset:
+            self.generate(years=0)
+        reset_models = {model for call in reset.call_args_list for model in call.args[1]}
+        self.assertEqual(reset_models, {CustomUser, Class, *ROLE_PROFILE_MODELS.values()})
+        # And the next ORM inserts get fresh ids
+        CustomUser.objects.create(username='after', role='teacher')
+        Class.objects.create(title='After', subject=Subject.objects.first())
+
+    def test_same_seed_same_school(self):
+        self.generate(seed=7)
+        first = list(Attendance.objects.order_by('pk').values_list('status', flat=True))
+        with self.assertRaises(ValueError):
+            self.generate(seed=7)
+        self.generate(seed=7, prefix='again')
+        second = list(Attendance.objects.order_by('pk').values_list('status', flat=True))[len(first):]
+        self.assertEqual(first, second)
+
+
+@override_settings(SCHOOL_READ_DATABASE='replica')
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        # Declare the replica without connecting to it; only the routing decisions are tested
+        replica = mock.patch.dict(connections.databases, {'replica': connections.databases['default']})
+        replica.start()
+        self.addCleanup(replica.stop)
+        self.router = ReplicaRouter()
+
+    def test_reporting_reads_use_the_replica_until_a_write(self):
+        with read_routing():
+            self.assertEqual(self.router.db_for_read(Attendance), 'replica')
+            self.assertIsNone(self.router.db_for_read(CustomUser))
+            with primary_reads():
+                self.assertIsNone(self.router.db_for_read(Grade))
+            self.assertEqual(self.router.db_for_read(Grade), 'replica')
+            self.assertEqual(self.router.db_for_write(Attendance), 'default')
+            self.assertIsNone(self.router.db_for_read(Attendance))
+        with read_routing(pinned=True):
+            self.assertIsNone(self.router.db_for_read(Fee))
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Attendance))
+            if request.method == 'POST':
+                self.router.db_for_write(Attendance)
+            return HttpResponse()
+
+        middleware = ReplicaPinningMiddleware(view)
+        factory = RequestFactory()
+        self.assertNotIn('school_primary', middleware(factory.get('/')).cookies)
+        response = middleware(factory.post('/'))
+        self.assertEqual(response.cookies['school_primary']['max-age'], 30)
+        pinned = factory.get('/')
+        pinned.COOKIES['school_primary'] = '1'
+        middleware(pinned)
+        self.assertEqual(seen, ['replica', None, None])
+
+    def test_replica_backup(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = sqlite3.connect(os.path.join(directory, 'primary.sqlite3'))
+        self.addCleanup(primary.close)
+        primary.execute('CREATE TABLE grades (value INTEGER)')
+        primary.executemany('INSERT INTO grades VALUES (?)', [(n,) for n in range(5000)])
+        primary.commit()
+
+        path = os.path.join(directory, 'replica.sqlite3')
+        backup_sqlite(primary, path, pages=4)
+        replica = sqlite3.connect(path)
+        self.addCleanup(replica.close)
+        self.assertEqual(replica.execute('SELECT COUNT(*) FROM grades').fetchone(), (5000,))
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+
+@override_settings(SCHOOL_DASHBOARD_PARALLEL=False)
+class DashboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = CustomUser.objects.create(username='mum', role='parent')
+        children = [CustomUser.objects.create(username=f'kid{n}', role='student').studentprofile for n in range(2)]
+        cls.parent.parentprofile.children.add(*children)
+        teacher = CustomUser.objects.create(username='mr_k', role='teacher')
+        klass = Class.objects.create(title='Maths 1', subject=Subject.objects.create(name='Maths'), assigned_teacher=teacher.teacherprofile)
+        klass.students.add(*children)
+        mark_attendance(klass, date(2024, 3, 4), {children[0].pk: 'Present', children[1].pk: 'Absent'})
+        exam = Exam.objects.create(class_instance=klass, subject=klass.subject, date=date(2024, 3, 8), title='Quiz')
+        Grade.objects.create(exam=exam, student=children[0], grade_value='88.50')
+        Fee.objects.create(student=children[1], amount_due='40.00', due_date=date(2024, 4, 1))
+        # Created out of order, and Friday sorts first alphabetically
+        for day, section in [('Friday', '1st Section'), ('Monday', '2nd Section'), ('Tuesday', '1st Section'), ('Monday', '1st Section')]:
+            Schedule.objects.create(class_instance=klass, subject=klass.subject, day_of_week=day, section=section)
+        cls.teacher = teacher
+        cls.children = children
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    async def test_parent_sees_every_child(self):
+        await self.async_client.aforce_login(self.parent)
+        response = await self.async_client.get('/dashboard/overview/', {'format': 'json'})
+        students = response.json()['students']
+        self.assertEqual([student['name'] for student in students], ['kid0', 'kid1'])
+        self.assertEqual(students[0]['grades'][0]['grade'], '88.50')
+        self.assertEqual(students[0]['attendance'][0]['rate'], 1.0)
+        self.assertEqual(students[1]['fees'], [{'amount': '40.00', 'due_date': '2024-04-01'}])
+        self.assertEqual(
+            [(row['day'], row['section']) for row in students[1]['timetable']],
+            [('Monday', '1st Section'), ('Monday', '2nd Section'), ('Tuesday', '1st Section'), ('Friday', '1st Section')],
+        )
+
+    async def test_teacher_and_staff_dashboards_render(self):
+        await self.async_client.aforce_login(self.teacher)
+        response = await self.async_client.get('/dashboard/overview/')
+        self.assertContains(response, 'Maths 1')
+        self.assertContains(response, '50%')
+        timetable = (await self.async_client.get('/dashboard/overview/', {'format': 'json'})).json()['timetable']
+        self.assertEqual([row['day'] for row in timetable], ['Monday', 'Monday', 'Tuesday', 'Friday'])
+        staff = await CustomUser.objects.acreate(username='office', role='staff')
+        await self.async_client.aforce_login(staff)
+        data = (await self.async_client.get('/dashboard/overview/', {'format': 'json'})).json()
+        self.assertEqual(data['users']['student'], 2)
+        self.assertEqual(data['overdue_fees']['students'], 1)
+
+
+class GatherQueriesTests(SimpleTestCase):
+    async def test_loaders_run_concurrently(self):
+        # Each loader waits for the other three, so run one after another they
+        # would break the barrier instead of returning
+        barrier = threading.Barrier(4, timeout=5)
+        results = await gather_queries(**{f'q{n}': (barrier.wait,) for n in range(4)})
+        self.assertEqual(sorted(results.values()), [0, 1, 2, 3])
+
+
+class AnnouncementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = CustomUser.objects.create(username='ms_a', role='teacher')
+        cls.students = [CustomUser.objects.create(username=f'pupil{n}', role='student') for n in range(3)]
+        cls.parent = CustomUser.objects.create(username='dad', role='parent')
+        cls.parent.parentprofile.children.add(cls.students[0].studentprofile, cls.students[1].studentprofile)
+        cls.outsider = CustomUser.objects.create(username='other', role='student')
+        cls.klass = Class.objects.create(title='Art 1', subject=Subject.objects.create(name='Art'), assigned_teacher=cls.teacher.teacherprofile)
+        cls.klass.students.add(*(student.studentprofile for student in cls.students))
+        cls.staff = CustomUser.objects.create(username='office', role='staff')
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def test_class_post_reaches_students_and_parents_once(self):
+        announcement = post_announcement(self.teacher, 'Trip', 'Bring a coat', self.klass)
+        self.assertEqual(announcement.delivery, 'inbox')
+        self.assertEqual(announcement.recipient_count, 4)
+        self.assertEqual(
+            set(InboxItem.objects.values_list('user__username', flat=True)),
+            {'pupil0', 'pupil1', 'pupil2', 'dad'},
+        )
+        self.assertEqual([item.title for item in inbox(self.parent)], ['Trip'])
+        self.assertEqual(list(inbox(self.outsider)), [])
+
+    @override_settings(SCHOOL_ANNOUNCEMENT_INBOX_LIMIT=2)
+    def test_large_audiences_are_read_as_a_feed(self):
+        school_wide = post_announcement(self.staff, 'Closed on Friday')
+        class_post = post_announcement(self.teacher, 'Trip', class_instance=self.klass)
+        self.assertEqual((school_wide.delivery, class_post.delivery), ('feed', 'feed'))
+        self.assertFalse(InboxItem.objects.exists())
+        self.assertEqual([item.title for item in inbox(self.parent)], ['Trip', 'Closed on Friday'])
+        self.assertEqual([item.title for item in inbox(self.outsider)], ['Closed on Friday'])
+
+        with self.assertNumQueries(1):
+            items = list(inbox(self.students[2]))
+        self.assertEqual([item.read for item in items], [False, False])
+        self.assertEqual(mark_read(self.students[2], [class_post.pk]), 1)
+        self.assertEqual([item.read for item in inbox(self.students[2])], [True, False])
+        # Announcements the user cannot see are not marked
+        self.assertEqual(mark_read(self.outsider, [class_post.pk]), 0)
+
+    def test_inbox_reads_go_through_indexes(self):
+        plan = inbox(self.parent).explain()
+        self.assertNotIn('SCAN school_announcement', plan)
+        self.assertIn('announcement_feed_idx (audience=? AND class_instance_id=?)', plan)
+
+    def test_posting_permissions(self):
+        self.client.force_login(self.students[0])
+        response = self.client.post('/announcements/', {'title': 'Hi'}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        other = Class.objects.create(title='Art 2', subject=self.klass.subject)
+        self.client.force_login(self.teacher)
+        response = self.client.post('/announcements/', {'title': 'Hi', 'class': other.pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/announcements/', {'title': 'Hi', 'class': self.klass.pk}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['recipients'], 4)
+
+        self.client.force_login(self.parent)
+        items = self.client.get('/announcements/').json()['announcements']
+        self.assertEqual([(item['title'], item['read']) for item in items], [('Hi', False)])
+        response = self.client.post('/announcements/read/', {'ids': [items[0]['id']]}, content_type='application/json')
+        self.assertEqual(response.json(), {'marked': 1})
+        self.assertTrue(self.client.get('/announcements/').json()['announcements'][0]['read'])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        self.calls = []
+        self.addCleanup(TASKS.pop, 'test_task', None)
+
+        @task('test_task')
+        def test_task(payload):
+            self.calls.append(payload)
+            if payload.get('fail'):
+                raise RuntimeError('boom')
+
+    def test_claims_by_priority_in_batches(self):
+        low = enqueue('test_task', {'n': 1})
+        high = enqueue('test_task', {'n': 2}, priority=5)
+        enqueue('test_task', {'n': 3}, delay=60)
+        first = claim(limit=1)
+        self.assertEqual([job.pk for job in first], [high.pk])
+        self.assertEqual([job.pk for job in claim(limit=10)], [low.pk])
+        self.assertEqual(claim(limit=10), [])
+        self.assertEqual(run_jobs(first), {'done': 1, 'failed': 0})
+        self.assertEqual(Job.objects.get(pk=high.pk).status, 'done')
+
+    def test_expired_lease_is_claimed_again(self):
+        job = enqueue('test_task', {'n': 1})
+        [crashed] = claim()
+        # The worker died; its lease runs out
+        Job.objects.filter(pk=job.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        [again] = claim()
+        self.assertEqual(again.attempts, 2)
+        self.assertFalse(complete(crashed))
+        self.assertTrue(complete(again))
+
+    @override_settings(SCHOOL_JOB_BACKOFF_SECONDS=10)
+    def test_failures_are_retried_with_backoff(self):
+        job = enqueue('test_task', {'fail': True}, max_attempts=2)
+        with self.assertLogs('school.jobs', 'ERROR'):
+            self.assertEqual(run_jobs(claim()), {'done': 0, 'failed': 1})
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ('queued', 'RuntimeError: boom'))
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(claim(), [])
+
+        Job.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        with self.assertLogs('school.jobs', 'ERROR'):
+            run_jobs(claim())
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'failed')
+        self.assertEqual([backoff(n) for n in (1, 2, 3)], [10, 20, 40])
+
+    def test_emails_are_sent_in_one_connection_per_batch(self):
+        for n in range(3):
+            enqueue('send_email', {'to': [f'p{n}@example.com'], 'subject': 'Hi', 'body': ''})
+        with mock.patch('school.tasks.get_connection', wraps=get_connection) as connect:
+            call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertEqual(connect.call_count, 1)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['p0@example.com', 'p1@example.com', 'p2@example.com'])
+
+    def test_announcements_and_fee_reminders_are_emailed_by_the_worker(self):
+        parent = CustomUser.objects.create(username='mum', role='parent', email='mum@example.com')
+        student = CustomUser.objects.create(username='kid', role='student', email='kid@example.com')
+        parent.parentprofile.children.add(student.studentprofile)
+        klass = Class.objects.create(title='Art 1', subject=Subject.objects.create(name='Art'))
+        klass.students.add(student.studentprofile)
+        Fee.objects.create(student=student.studentprofile, amount_due='40.00', due_date=date(2024, 1, 1))
+
+        post_announcement(parent, 'Trip', 'Bring a coat', klass)
+        queue_fee_reminders(date(2024, 3, 1))
+        self.assertEqual(mail.outbox, [])
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+        self.assertEqual(
+            sorted((message.subject, tuple(message.to)) for message in mail.outbox),
+            [('Art 1: Trip', ('kid@example.com',)), ('Art 1: Trip', ('mum@example.com',)),
+             ('Overdue school fees', ('kid@example.com', 'mum@example.com'))],
+        )
+        self.assertTrue(FeeReminder.objects.get().sent_at)
+        self.assertFalse(Job.objects.exclude(status='done').exists())
+
+
+class UserSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.create_users()
+
+    @classmethod
+    def create_users(cls):
+        cls.john = CustomUser.objects.create(username='jsmith', first_name='John', last_name='Smith', email='john@example.com', role='parent')
+        cls.joan = CustomUser.objects.create(username='joan', first_name='Joan', last_name='Smithers', email='jo@school.org', role='student')
+        cls.zoe = CustomUser.objects.create(username='zoe', first_name='Zoë', last_name='Jones', role='teacher')
+        cls.staff = CustomUser.objects.create(username='office', role='staff')
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+
+    def names(self, users):
+        return [user.username for user in users]
+
+    def test_prefix_words_ranked_and_filtered(self):
+        self.assertEqual(sorted(self.names(search_users('smi'))), ['joan', 'jsmith'])
+        self.assertEqual(self.names(search_users('jo smi')), ['joan', 'jsmith'])  # username hit ranks first
+        self.assertEqual(self.names(search_users('smi', role='parent')), ['jsmith'])
+        self.assertEqual(self.names(search_users('school.org')), ['joan'])
+        self.assertEqual(self.names(search_users('zoe jon')), ['zoe'])  # diacritics folded
+        self.assertEqual(search_users('"*)'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.john.last_name = 'Baker'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.john.save()
+        self.assertEqual(self.names(search_users('baker')), ['jsmith'])
+        self.assertEqual(self.names(search_users('smith')), ['joan'])
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(1):
+            self.john.save(update_fields=['last_login'])
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.joan.delete()
+        self.assertEqual(search_users('smi'), [])
+
+        # Bulk writes skip the signals until the index is rebuilt
+        CustomUser.objects.filter(pk=self.zoe.pk).update(last_name='Quinn')
+        self.assertEqual(search_users('quinn'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.names(search_users('quinn')), ['zoe'])
+        self.assertEqual(index_users(CustomUser.objects.filter(pk=self.zoe.pk)), 1)
+
+    def test_admin_and_api_use_the_index(self):
+        self.assertEqual(self.names(matching(CustomUser.objects.order_by('pk'), 'j')), ['jsmith', 'joan', 'zoe'])
+        admin = CustomUser.objects.create_superuser('root', 'root@example.com', 'pw', role='admin')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/school/customuser/', {'q': 'smith jo'})
+        self.assertEqual([user.username for user in response.context['cl'].result_list], ['joan', 'jsmith'])
+
+        self.client.force_login(self.staff)
+        results = self.client.get('/api/users/search/', {'q': 'smi', 'role': 'student'}).json()['results']
+        self.assertEqual([(row['username'], row['role']) for row in results], [('joan', 'student')])
+        self.assertEqual(self.client.get('/api/users/search/', {'q': 'a', 'role': 'janitor'}).status_code, 400)
+        self.client.force_login(self.john)
+        self.assertEqual(self.client.get('/api/users/search/', {'q': 'smi'}).status_code, 403)
+
+
+class AutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.john = CustomUser.objects.create(username='jsmith', first_name='John', last_name='Smith', role='parent')
+        cls.joan = CustomUser.objects.create(username='joan', first_name='Joan', last_name='Smithers', role='student')
+        cls.zoe = CustomUser.objects.create(username='zoe', first_name='Zoë', last_name='Jones', role='teacher')
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        autocomplete.reset()
+        self.addCleanup(autocomplete.reset)
+
+    def usernames(self, *args, **kwargs):
+        return [suggestion.username for suggestion in autocomplete.complete(*args, **kwargs)]
+
+    def test_prefixes_roles_and_words(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.usernames('jo'), ['joan', 'jsmith', 'zoe'])  # joan, john, jones
+        with self.assertNumQueries(0):
+            self.assertEqual(self.usernames('JO', role='student'), ['joan'])
+            self.assertEqual(self.usernames('smi jo'), ['jsmith', 'joan'])  # smith, smithers
+            self.assertEqual(self.usernames('zoe j'), ['zoe'])
+            self.assertEqual(self.usernames('smith', limit=1), ['jsmith'])
+            self.assertEqual(self.usernames('  '), [])
+
+    def test_committed_changes_update_the_index(self):
+        self.usernames('jo')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.john.first_name = 'Jack'
+            self.john.save()
+            self.zoe.role = 'staff'
+            self.zoe.save()
+            self.joan.delete()
+            CustomUser.objects.create(username='jonah', role='student', is_active=False)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.usernames('jo'), ['zoe'])
+            self.assertEqual(self.usernames('ja'), ['jsmith'])
+            self.assertEqual(self.usernames('zo', role='staff'), ['zoe'])
+            self.assertEqual(self.usernames('zo', role='teacher'), [])
+
+    def test_endpoint_answers_without_querying_users(self):
+        staff = CustomUser.objects.create(username='office', role='staff')
+        self.usernames('jo')
+        self.client.force_login(staff)
+        # The session and the logged-in user are all the queries
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/autocomplete/', {'q': 'smi', 'role': 'parent'})
+        self.assertEqual(response.json()['results'], [
+            {'id': self.john.pk, 'username': 'jsmith', 'name': 'John Smith', 'role': 'parent'},
+        ])
+        self.client.force_login(self.joan)
+        self.assertEqual(self.client.get('/api/users/autocomplete/', {'q': 'jo'}).status_code, 403)
+
+    def test_matches_beyond_the_scan_limit_are_found(self):
+        index = AutocompleteIndex()
+        # 'al' and 'smith' each match more keys than SELECTIVE, and the first keys
+        # of 'al' all belong to users without a 'smith'
+        index.load([
+            *((n, f'al{n:05d}', 'Al', 'Jones', 'student') for n in range(25000)),
+            *((n, f'bob{n:05d}', 'Bob', 'Smith', 'student') for n in range(25000, 50000)),
+            (50000, 'zed', 'Alz', 'Smith', 'student'),
+        ])
+        self.assertEqual([suggestion.username for suggestion in index.complete('al smith')], ['zed'])
+
+        # Both words selective, but more shared users than RANK_LIMIT
+        index.load([
+            *((n, f'al{n:05d}', 'Al', 'Jones', 'parent') for n in range(3000)),
+            *((n, f'al{n:05d}', 'Al', 'Smith', 'parent') for n in range(5000, 5100)),
+        ])
+        self.assertEqual(len(index.complete('al smith', limit=10)), 10)
+
+    def test_queries_during_the_first_build_wait_for_it(self):
+        autocomplete.build_lock.acquire()
+        self.addCleanup(autocomplete.build_lock.release)
+        # Another thread is building: no second build, no suggestions yet
+        with mock.patch('school.autocomplete.BUILD_WAIT', 0.01), self.assertNumQueries(0):
+            self.assertEqual(self.usernames('jo'), [])
+
+
+class CountedLookups(dict):
+    lookups = 0
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super().__getitem__(key)
+
+
+class AutocompleteScanTests(SimpleTestCase):
+    # Latency is measured by the autocomplete scenario of `manage.py benchmark`;
+    # this checks the bound on work per query that keeps it low
+    def test_common_prefixes_stop_within_max_scan(self):
+        first = ['Amara', 'Ben', 'Chen', 'Dara', 'Eli', 'Farah', 'Gus', 'Hana', 'Ivo', 'Jun', 'Kai', 'Lena']
+        last = ['Adams', 'Baker', 'Costa', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes', 'Ito', 'Jensen']
+        roles = ['student', 'parent', 'teacher']
+        index = AutocompleteIndex()
+        index.load(
+            (n, f'user{n:07d}', first[n % 12], f'{last[n % 10]}{n % 997}', roles[n % 3]) for n in range(60000)
+        )
+        index.users = CountedLookups(index.users)
+        for query in ['a', 'be', 'user00', 'hana gar', 'lena i', 'user0059', 'ko', 'diaz1']:
+            for role in [None, *roles]:
+                partitions = 1 if role else len(roles)
+                with self.subTest(query=query, role=role), mock.patch.object(index, '_narrowest') as narrowest:
+                    index.users.lookups = 0
+                    index.complete(query, role=role)
+                    narrowest.assert_not_called()
+                    self.assertLessEqual(index.users.lookups, MAX_SCAN * partitions)
+
+
+class StudentVisibilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.parent = CustomUser.objects.create(username='mum', role='parent')
+        cls.teacher = CustomUser.objects.create(username='mr_t', role='teacher')
+        cls.other_teacher = CustomUser.objects.create(username='ms_o', role='teacher')
+        cls.kids = [CustomUser.objects.create(username=f'kid{n}', role='student').studentprofile for n in range(4)]
+        cls.klass = Class.objects.create(title='Maths 1', subject=Subject.objects.create(name='Maths'), assigned_teacher=cls.teacher.teacherprofile)
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        visibility_cache().clear()
+        self.addCleanup(visibility_cache().clear)
+
+    def pairs(self, user):
+        return set(StudentVisibility.objects.filter(viewer=user).values_list('student_id', flat=True))
+
+    def check(self, user, student):
+        # A fresh user object, as in a new request
+        return can_view_student(CustomUser.objects.with_profile().get(pk=user.pk), student.pk)
+
+    def test_rows_follow_links_rosters_and_reassignment(self):
+        kids = self.kids
+        self.parent.parentprofile.children.add(kids[0], kids[1])
+        kids[2].parents.add(self.parent.parentprofile)
+        self.klass.students.add(kids[1], kids[3])
+        kids[0].classes.add(self.klass)
+        self.assertEqual(self.pairs(self.parent), {kids[0].pk, kids[1].pk, kids[2].pk})
+        self.assertEqual(self.pairs(self.teacher), {kids[0].pk, kids[1].pk, kids[3].pk})
+
+        # Still in another of the teacher's classes: still visible
+        second = Class.objects.create(title='Maths 2', subject=self.klass.subject, assigned_teacher=self.teacher.teacherprofile)
+        second.students.add(kids[3])
+        self.klass.students.remove(kids[3])
+        self.assertIn(kids[3].pk, self.pairs(self.teacher))
+        second.delete()
+        self.assertNotIn(kids[3].pk, self.pairs(self.teacher))
+
+        self.parent.parentprofile.children.clear()
+        self.assertEqual(self.pairs(self.parent), set())
+
+        klass = Class.objects.get(pk=self.klass.pk)
+        klass.assigned_teacher = self.other_teacher.teacherprofile
+        klass.save()
+        self.assertEqual(self.pairs(self.teacher), set())
+        self.assertEqual(self.pairs(self.other_teacher), {kids[0].pk, kids[1].pk})
+        kids[0].classes.clear()
+        self.assertEqual(self.pairs(self.other_teacher), {kids[1].pk})
+
+    def test_checks_are_cached_and_invalidated_on_commit(self):
+        self.parent.parentprofile.children.add(self.kids[0])
+        user = CustomUser.objects.with_profile().get(pk=self.parent.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(can_view_student(user, self.kids[0].pk))
+            self.assertFalse(can_view_student(user, self.kids[1].pk))
+        fresh = CustomUser.objects.with_profile().get(pk=self.parent.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(can_view_student(fresh, self.kids[0].pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parent.parentprofile.children.add(self.kids[1])
+        self.assertTrue(self.check(self.parent, self.kids[1]))
+        self.assertTrue(self.check(self.kids[2].user, self.kids[2]))
+        self.assertFalse(self.check(self.kids[2].user, self.kids[1]))
+        self.assertTrue(self.check(CustomUser.objects.create(username='office', role='staff'), self.kids[3]))
+
+    def test_listing_costs_the_same_for_any_number_of_students(self):
+        self.client.force_login(self.teacher)
+        self.klass.students.add(self.kids[0])
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(len(self.client.get('/api/students/').json()['results']), 1)
+        self.klass.students.add(*self.kids[1:])
+        with CaptureQueriesContext(connection) as many:
+            results = self.client.get('/api/students/').json()['results']
+        self.assertEqual([row['username'] for row in results], ['kid0', 'kid1', 'kid2', 'kid3'])
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(
+            filter_visible(Grade.objects.all(), self.other_teacher, 'student').count(), 0,
+        )
+
+    def test_record_endpoint_and_rebuild(self):
+        self.parent.parentprofile.children.add(self.kids[0])
+        self.client.force_login(self.parent)
+        self.assertEqual(self.client.get(f'/api/students/{self.kids[0].pk}/').json()['name'], 'kid0')
+        self.assertEqual(self.client.get(f'/api/students/{self.kids[1].pk}/').status_code, 403)
+
+        # Bulk writes skip the signals until a rebuild
+        ParentProfile.children.through.objects.create(parentprofile=self.parent.parentprofile, studentprofile=self.kids[1])
+        StudentVisibility.objects.filter(student=self.kids[0]).delete()
+        call_command('rebuild_visibility', stdout=StringIO())
+        self.assertEqual(self.pairs(self.parent), {self.kids[0].pk, self.kids[1].pk})
+        self.assertEqual(rebuild_visibility(CustomUser.objects.filter(pk=self.parent.pk)), 2)
+
+
+class RulePermissionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = CustomUser.objects.create(username='mr_t', role='teacher')
+        cls.other_teacher = CustomUser.objects.create(username='ms_o', role='teacher')
+        cls.parent = CustomUser.objects.create(username='mum', role='parent')
+        cls.kids = [CustomUser.objects.create(username=f'kid{n}', role='student').studentprofile for n in range(3)]
+        subject = Subject.objects.create(name='Maths')
+        cls.mine = Class.objects.create(title='Maths 1', subject=subject, assigned_teacher=cls.teacher.teacherprofile)
+        cls.theirs = Class.objects.create(title='Maths 2', subject=subject, assigned_teacher=cls.other_teacher.teacherprofile)
+        for klass in (cls.mine, cls.theirs):
+            exam = Exam.objects.create(class_instance=klass, subject=subject, date=date(2024, 5, 1))
+            for kid in cls.kids:
+                Grade.objects.create(exam=exam, student=kid, grade_value=Decimal('70'))
+        cls.parent.parentprofile.children.add(cls.kids[0])
+
+    def setUp(self):
+        self.addCleanup(role_registry.clear)
+        visibility_cache().clear()
+        self.addCleanup(visibility_cache().clear)
+
+    def fresh(self, user):
+        return CustomUser.objects.with_profile().get(pk=user.pk)
+
+    def test_rules_compile_to_filters(self):
+        teacher = self.fresh(self.teacher)
+        grades = permitted(teacher, 'school.change_grade', Grade.objects.all())
+        self.assertEqual(set(grades.values_list('exam__class_instance', flat=True)), {self.mine.pk})
+        self.assertEqual(permitted(self.fresh(self.parent), 'school.view_grade', Grade.objects.all()).count(), 2)
+        self.assertEqual(permitted(self.fresh(self.parent), 'school.change_grade', Grade.objects.all()).count(), 0)
+        student = self.fresh(self.kids[1].user)
+        self.assertEqual(set(permitted(student, 'school.view_grade', Grade.objects.all()).values_list('student', flat=True)), {self.kids[1].pk})
+        self.assertEqual(permitted(CustomUser.objects.create(username='office', role='staff'), 'school.change_grade', Grade.objects.all()).count(), 6)
+
+        # A model-wide permission still grants every row
+        self.other_teacher.user_permissions.add(Permission.objects.get(codename='change_grade'))
+        self.assertEqual(permitted(self.fresh(self.other_teacher), 'school.change_grade', Grade.objects.all()).count(), 6)
+
+    def test_object_checks_use_loaded_relations(self):
+        teacher = self.fresh(self.teacher)
+        teacher.get_all_permissions()
+        grades = list(Grade.objects.select_related('exam__class_instance').order_by('pk'))
+        with self.assertNumQueries(0):
+            allowed = [teacher.has_perm('school.change_grade', grade) for grade in grades]
+        self.assertEqual(allowed, [grade.exam.class_instance_id == self.mine.pk for grade in grades])
+
+        # Without the joins a check falls back to one query, remembered for the request
+        teacher = self.fresh(self.teacher)
+        teacher.get_all_permissions()
+        grade = Grade.objects.get(exam__class_instance=self.theirs, student=self.kids[0])
+        with self.assertNumQueries(1):
+            self.assertFalse(teacher.has_perm('school.change_grade', grade))
+            self.assertFalse(teacher.has_perm('school.change_grade', grade))
+        self.assertTrue(self.fresh(self.parent).has_perm('school.view_grade', grade))
+        self.assertFalse(teacher.has_perm('school.change_grade'))
+
+    def test_grade_listing_and_attendance_use_the_rules(self):
+        self.client.force_login(self.teacher)
+        self.client.get('/api/grades/')
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get('/api/grades/').json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(row['can_change'] for row in results))
+        Grade.objects.create(exam=self.mine.exams.get(), student=CustomUser.objects.create(username='kid9', role='student').studentprofile, grade_value=Decimal('50'))
+        with CaptureQueriesContext(connection) as more:
+            self.assertEqual(len(self.client.get('/api/grades/').json()['results']), 4)
+        self.assertEqual(len(queries), len(more))
+
+        self.assertEqual(self.client.get(f'/classes/{self.mine.pk}/attendance/2024-05-01/').status_code, 200)
+        self.assertEqual(self.client.get(f'/classes/{self.theirs.pk}/attendance/2024-05-01/').status_code, 403)
+
+    def test_admin_changelist_shows_permitted_rows(self):
+        self.teacher.is_staff = True
+        self.teacher.save()
+        self.client.force_login(self.teacher)
+        response = self.client.get('/admin/school/grade/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        mine = Grade.objects.filter(exam__class_instance=self.mine).first()
+        theirs = Grade.objects.filter(exam__class_instance=self.theirs).first()
+        self.assertEqual(self.client.get(f'/admin/school/grade/{mine.pk}/change/').status_code, 200)
+        self.assertNotEqual(self.client.get(f'/admin/school/grade/{theirs.pk}/change/').status_code, 200)
@@ -0,0 +1,262 @@
+"""
+Timetable engine. Every teacher, room and class gets a week-by-section bitmask
+(5 days x 4 sections = 20 bits), so "is this slot free?" is one AND per resource.
+"""
+from collections import defaultdict, namedtuple
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Class, Schedule
+
+DAYS = [day for day, label in Schedule.DAY_CHOICES]
+SECTIONS = [section for section, label in Schedule.SECTION_CHOICES]
+SLOT_COUNT = len(DAYS) * len(SECTIONS)
+FULL_WEEK = (1 << SLOT_COUNT) - 1
+
+# kind is 'teacher', 'room' or 'students'; key is the teacher profile id, the room
+# number, or the pair of classes sharing students
+Conflict = namedtuple('Conflict', ['kind', 'key', 'day', 'section', 'classes'])
+
+
+class TimetableError(Exception):
+    pass
+
+
+def slot_index(day, section):
+    return DAYS.index(day) * len(SECTIONS) + SECTIONS.index(section)
+
+
+def slot_label(index):
+    return DAYS[index // len(SECTIONS)], SECTIONS[index % len(SECTIONS)]
+
+
+def bits(mask):
+    """Yield the slot indexes set in a mask."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def load_classes(class_ids=None):
+    """{class id: (teacher profile id, room number, subject id, weekly sections)}"""
+    classes = Class.objects.all()
+    if class_ids is not None:
+        classes = classes.filter(pk__in=class_ids)
+    return {
+        pk: (teacher_id, room or None, subject_id, weekly)
+        for pk, teacher_id, room, subject_id, weekly in classes.values_list(
+            'pk', 'assigned_teacher_id', 'room_number', 'subject_id', 'weekly_sections',
+        )
+    }
+
+
+def shared_student_classes(class_ids):
+    """{class id: set of other classes with at least one student in common}"""
+    classes_of_student = defaultdict(list)
+    for class_id, student_id in Class.students.through.objects.filter(
+        class_id__in=class_ids
+    ).values_list('class_id', 'studentprofile_id').iterator():
+        classes_of_student[student_id].append(class_id)
+
+    neighbours = defaultdict(set)
+    for classes in classes_of_student.values():
+        for first, second in combinations(classes, 2):
+            neighbours[first].add(second)
+            neighbours[second].add(first)
+    return neighbours
+
+
+def booked_elsewhere(classes):
+    """
+    The slots already taken in the saved timetable of every class outside
+    `classes` (as returned by load_classes), as bitmasks: ({teacher profile id:
+    mask}, {room number: mask}, {class id: mask of the outside classes it shares
+    students with}).
+    """
+    teachers = {teacher_id for teacher_id, room, subject_id, weekly in classes.values() if teacher_id is not None}
+    rooms = {room for teacher_id, room, subject_id, weekly in classes.values() if room is not None}
+    teacher_masks = defaultdict(int)
+    room_masks = defaultdict(int)
+    entries = Schedule.objects.exclude(class_instance_id__in=classes).filter(
+        Q(class_instance__assigned_teacher_id__in=teachers) | Q(class_instance__room_number__in=rooms)
+    ).values_list('class_instance__assigned_teacher_id', 'class_instance__room_number', 'day_of_week', 'section')
+    for teacher_id, room, day, section in entries.iterator():
+        bit = 1 << slot_index(day, section)
+        if teacher_id in teachers:
+            teacher_masks[teacher_id] |= bit
+        if room in rooms:
+            room_masks[room] |= bit
+
+    # Outside classes sharing a student with one of ours
+    enrolments = Class.students.through.objects
+    classes_of_student = defaultdict(list)
+    for class_id, student_id in enrolments.filter(class_id__in=classes).values_list('class_id', 'studentprofile_id').iterator():
+        classes_of_student[student_id].append(class_id)
+    other_enrolments = enrolments.filter(
+        studentprofile_id__in=enrolments.filter(class_id__in=classes).values('studentprofile_id'),
+    ).exclude(class_id__in=classes)
+    outside = defaultdict(set)
+    for student_id, other in other_enrolments.values_list('studentprofile_id', 'class_id').iterator():
+        for class_id in classes_of_student[student_id]:
+            outside[class_id].add(other)
+    other_masks = defaultdict(int)
+    for class_id, day, section in Schedule.objects.filter(
+        class_instance_id__in={other for others in outside.values() for other in others},
+    ).values_list('class_instance_id', 'day_of_week', 'section').iterator():
+        other_masks[class_id] |= 1 << slot_index(day, section)
+    student_masks = defaultdict(int)
+    for class_id, others in outside.items():
+        for other in others:
+            student_masks[class_id] |= other_masks[other]
+    return teacher_masks, room_masks, student_masks
+
+
+def find_conflicts(class_ids=None):
+    """
+    Every teacher, room and student-group double booking in the current timetable,
+    found in one pass over the Schedule rows.
+    """
+    classes = load_classes(class_ids)
+    entries = Schedule.objects.filter(class_instance_id__in=classes).values_list(
+        'class_instance_id', 'day_of_week', 'section',
+    )
+
+    conflicts = []
+    masks = defaultdict(int)
+    owners = {}
+    class_masks = defaultdict(int)
+    for class_id, day, section in entries.iterator():
+        index = slot_index(day, section)
+        bit = 1 << index
+        class_masks[class_id] |= bit
+        teacher_id, room, subject_id, weekly = classes[class_id]
+        for kind, key in (('teacher', teacher_id), ('room', room)):
+            if key is None:
+                continue
+            if masks[kind, key] & bit:
+                conflicts.append(Conflict(kind, key, day, section, (owners[kind, key, index], class_id)))
+            else:
+                masks[kind, key] |= bit
+                owners[kind, key, index] = class_id
+
+    for class_id, others in shared_student_classes(list(classes)).items():
+        for other in others:
+            if class_id < other:
+                for index in bits(class_masks[class_id] & class_masks[other]):
+                    day, section = slot_label(index)
+                    conflicts.append(Conflict('students', (class_id, other), day, section, (class_id, other)))
+    return conflicts
+
+
+def generate_timetable(class_ids=None, max_steps=1_000_000):
+    """
+    Find slots for every class's weekly_sections with no teacher, room or
+    student-group clash. Returns {class id: [slot index, ...]}, with an empty
+    list for classes that have no weekly sections.
+
+    Sessions are placed most-constrained class first, each on the least used day
+    for its class, with iterative backtracking when a session has no free slot.
+    When only some classes are generated, the saved slots of the other classes
+    stay booked for their teachers, rooms and students.
+    """
+    classes = load_classes(class_ids)
+    neighbours = shared_student_classes(list(classes))
+    if class_ids is None:
+        teacher_masks, room_masks, student_masks = defaultdict(int), defaultdict(int), defaultdict(int)
+    else:
+        teacher_masks, room_masks, student_masks = booked_elsewhere(classes)
+
+    teacher_load = defaultdict(int)
+    room_load = defaultdict(int)
+    for teacher_id, mask in teacher_masks.items():
+        teacher_load[teacher_id] += bin(mask).count('1')
+    for room, mask in room_masks.items():
+        room_load[room] += bin(mask).count('1')
+    for teacher_id, room, subject_id, weekly in classes.values():
+        teacher_load[teacher_id] += weekly
+        room_load[room] += weekly
+    for class_id, (teacher_id, room, subject_id, weekly) in classes.items():
+        if weekly > SLOT_COUNT:
+            raise TimetableError(f'Class {class_id} needs more sections than a week has.')
+        for key, load in (('teacher', teacher_load[teacher_id] if teacher_id else 0), ('room', room_load[room] if room else 0)):
+            if load > SLOT_COUNT:
+                raise TimetableError(f'The {key} of class {class_id} is booked for more sections than a week has.')
+
+    def difficulty(class_id):
+        teacher_id, room, subject_id, weekly = classes[class_id]
+        return (
+            (teacher_load[teacher_id] if teacher_id else 0) + (room_load[room] if room else 0)
+            + sum(classes[other][3] for other in neighbours[class_id]),
+            weekly,
+        )
+
+    sessions = [
+        class_id
+        for class_id in sorted(classes, key=lambda pk: (difficulty(pk), -pk), reverse=True)
+        for _ in range(classes[class_id][3])
+    ]
+
+    class_masks = defaultdict(int)
+
+    def place(class_id, bit):
+        teacher_id, room, subject_id, weekly = classes[class_id]
+        class_masks[class_id] ^= bit
+        if teacher_id is not None:
+            teacher_masks[teacher_id] ^= bit
+        if room is not None:
+            room_masks[room] ^= bit
+
+    def candidates(class_id):
+        teacher_id, room, subject_id, weekly = classes[class_id]
+        busy = class_masks[class_id] | student_masks[class_id] | teacher_masks.get(teacher_id, 0) | room_masks.get(room, 0)
+        for other in neighbours[class_id]:
+            busy |= class_masks[other]
+        taken = class_masks[class_id]
+        day_load = [bin((taken >> (day * len(SECTIONS))) & ((1 << len(SECTIONS)) - 1)).count('1') for day in range(len(DAYS))]
+        free = sorted(bits(FULL_WEEK & ~busy), key=lambda index: (day_load[index // len(SECTIONS)], index))
+        # Reversed so the preferred slot can be popped off the end
+        return [1 << index for index in reversed(free)]
+
+    chosen = [0] * len(sessions)
+    options = [None] * len(sessions)
+    position = steps = 0
+    while 0 <= position < len(sessions):
+        steps += 1
+        if steps > max_steps:
+            raise TimetableError(f'No timetable found within {max_steps} steps.')
+        class_id = sessions[position]
+        if chosen[position]:
+            place(class_id, chosen[position])
+            chosen[position] = 0
+        if options[position] is None:
+            options[position] = candidates(class_id)
+        if options[position]:
+            chosen[position] = options[position].pop()
+            place(class_id, chosen[position])
+            position += 1
+        else:
+            options[position] = None
+            position -= 1
+    if position < 0:
+        raise TimetableError('No conflict-free timetable exists for these classes.')
+
+    # Classes with no weekly sections are included, so saving clears their old slots
+    return {class_id: sorted(bits(class_masks[class_id])) for class_id in classes}
+
+
+def save_timetable(assignments):
+    """Replace the timetable of the assigned classes with one bulk insert."""
+    subjects = dict(Class.objects.filter(pk__in=assignments).values_list('pk', 'subject_id'))
+    with transaction.atomic():
+        Schedule.objects.filter(class_instance_id__in=assignments).delete()
+        Schedule.objects.bulk_create([
+            Schedule(
+                class_instance_id=class_id, subject_id=subjects[class_id],
+                day_of_week=slot_label(index)[0], section=slot_label(index)[1],
+            )
+            for class_id, slots in assignments.items()
+            for index in slots
+        ], batch_size=1000)
@@ -1,8 +1,29 @@
+from django.contrib.auth import views as auth_views
 from django.urls import path
-from .views import register_user, success, check_permissions
+from .views import (
+    register_user, success, check_permissions, dashboard, role_dashboard, class_attendance, export_data,
+    user_directory, user_list_api, user_search_api, user_autocomplete_api, profile_list_api,
+    student_list_api, student_record_api, grade_list_api, announcements, read_announcements,
+)
 
 urlpatterns = [
     path('register/', register_user, name='register'),
     path('success/', success, name='success'),
     path('check-permissions/', check_permissions, name='check_permissions'),
+    path('login/', auth_views.LoginView.as_view(template_name='login.html'), name='login'),
+    path('logout/', auth_views.LogoutView.as_view(), name='logout'),
+    path('dashboard/', dashboard, name='dashboard'),
+    path('dashboard/overview/', role_dashboard, name='role_dashboard'),
+    path('classes/<int:class_id>/attendance/<str:day>/', class_attendance, name='class_attendance'),
+    path('export/<str:dataset>/', export_data, name='export_data'),
+    path('announcements/', announcements, name='announcements'),
+    path('announcements/read/', read_announcements, name='read_announcements'),
+    path('users/', user_directory, name='user_directory'),
+    path('api/students/', student_list_api, name='student_list_api'),
+    path('api/students/<int:student_id>/', student_record_api, name='student_record_api'),
+    path('api/grades/', grade_list_api, name='grade_list_api'),
+    path('api/users/autocomplete/', user_autocomplete_api, name='user_autocomplete_api'),
+    path('api/users/search/', user_search_api, name='user_search_api'),
+    path('api/users/', user_list_api, name='user_list_api'),
+    path('api/profiles/<str:role>/', profile_list_api, name='profile_list_api'),
 ]
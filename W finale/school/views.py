@@ -1,37 +1,33 @@
-from django.shortcuts import render, redirect
+import json
+from datetime import date
+
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.views.decorators.http import require_http_methods
+from . import services
+from .announcements import inbox, mark_read, post_announcement
+from .dashboards import (
+    attendance_by_student, dashboard_data, recent_grades_by_student, student_names, unpaid_fees_by_student,
+)
+from .attendance import mark_attendance
+from .autocomplete import autocomplete
+from .exports import DATASETS, FORMATS, export_lines
 from .forms import CustomUserCreationForm
-from .models import AdminProfile, StaffProfile, TeacherProfile, StudentProfile, ParentProfile, CustomUser
+from .models import Attendance, Class, CustomUser, Grade, StudentProfile
+from .pagination import InvalidCursor, KeysetPaginator, estimated_count
+from .roles import ROLE_PROFILE_MODELS
+from .rules import permitted
+from .search import search_users
+from .visibility import can_view_student, filter_visible
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth.models import Group
 
 @csrf_exempt
 def register_user(request):
     if request.method == "POST":
         form = CustomUserCreationForm(request.POST)
-        if form.is_valid():
-            user = form.save()
-            # Assign role-based profile creation
-            role = request.POST.get('role')  # Ensure role is captured from form input
-            user.role = role  # Set the role from the form
-            user.save()
-
-            # Check if the profile already exists before creating a new one
-            if role == 'admin':
-                if not AdminProfile.objects.filter(user=user).exists():
-                    AdminProfile.objects.create(user=user)
-            elif role == 'staff':
-                if not StaffProfile.objects.filter(user=user).exists():
-                    StaffProfile.objects.create(user=user)
-            elif role == 'teacher':
-                if not TeacherProfile.objects.filter(user=user).exists():
-                    TeacherProfile.objects.create(user=user)
-            elif role == 'student':
-                if not StudentProfile.objects.filter(user=user).exists():
-                    StudentProfile.objects.create(user=user)
-            elif role == 'parent':
-                if not ParentProfile.objects.filter(user=user).exists():
-                    ParentProfile.objects.create(user=user)
-
+        if form.is_valid() and services.register_user(form) is not None:
             return redirect('success')  # Redirect to login after registration
     else:
         form = CustomUserCreationForm()
@@ -41,20 +37,340 @@ def register_user(request):
 def success(request):
     return render(request, 'success.html')
 
+@login_required
+def dashboard(request):
+    # request.profile comes from ProfileMiddleware, already loaded with the user
+    return render(request, 'dashboard.html', {'profile': request.profile})
+
+@login_required
+async def role_dashboard(request):
+    """
+    The role's dashboard data (children's attendance, grades, fees and timetable for
+    parents, classes for teachers, school totals for staff), fetched concurrently.
+    ?format=json returns the data itself.
+    """
+    user = await request.auser()
+    data = await dashboard_data(user)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(data)
+    # Pass the user already loaded; the template context's own is a lazy sync lookup
+    return render(request, 'role_dashboard.html', {'data': data, 'user': user})
+
 def check_permissions(request):
-    # Replace 'username' with the actual username of the user you want to test
-    username = 'fourthuser'  # example username
-    try:
-        user = CustomUser.objects.get(username=username)
-        permissions = user.get_all_permissions()
-
-        # Print the permissions to the terminal
-        print(f'Permissions for {username}:')
-        if permissions:
-            for perm in permissions:
-                print(perm)
-        else:
-            print('No permissions found for this user.')
-
-    except CustomUser.DoesNotExist:
-        print('User does not exist.')
+    """Report the permissions of ?username= (default: the current user) as JSON."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+
+    username = request.GET.get('username', request.user.username)
+    if username != request.user.username and not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can check other users.'}, status=403)
+
+    if username == request.user.username:
+        user = request.user
+    else:
+        try:
+            user = CustomUser.objects.get(username=username)
+        except CustomUser.DoesNotExist:
+            return JsonResponse({'error': 'User does not exist.'}, status=404)
+
+    # Served from the shared permission cache (see school.backends)
+    return JsonResponse({
+        'username': user.username,
+        'role': user.role,
+        'permissions': sorted(user.get_all_permissions()),
+    })
+
+def is_school_staff(user):
+    return user.is_staff or user.role in ('admin', 'staff')
+
+def can_manage_class(request, class_instance):
+    """Admins and staff manage every class, teachers only the ones assigned to them."""
+    return is_school_staff(request.user) or request.user.has_perm('school.change_class', class_instance)
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def class_attendance(request, class_id, day):
+    """
+    GET returns the roll call of a class for a day. POST takes
+    {"statuses": {"<student profile id>": "Present" | "Absent", ...}} and writes
+    the whole roll call at once.
+    """
+    class_instance = get_object_or_404(Class, pk=class_id)
+    if not can_manage_class(request, class_instance):
+        return JsonResponse({'error': 'You cannot manage attendance for this class.'}, status=403)
+    try:
+        day = date.fromisoformat(day)
+    except ValueError:
+        return JsonResponse({'error': 'Dates must look like YYYY-MM-DD.'}, status=400)
+
+    if request.method == 'POST':
+        try:
+            statuses = {int(student_id): status for student_id, status in json.loads(request.body)['statuses'].items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Expected {"statuses": {"<student id>": "<status>"}}.'}, status=400)
+        try:
+            marked = mark_attendance(class_instance, day, statuses)
+        except ValidationError as error:
+            return JsonResponse({'error': error.messages}, status=400)
+        return JsonResponse({'class': class_instance.pk, 'date': day.isoformat(), 'marked': marked})
+
+    records = Attendance.objects.filter(class_instance=class_instance, date=day).values_list('student_id', 'status')
+    return JsonResponse({'class': class_instance.pk, 'date': day.isoformat(), 'statuses': dict(records)})
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def announcements(request):
+    """
+    GET returns the user's inbox (?limit=, default 50). POST takes
+    {"title": ..., "body": ..., "class": <class id or omitted for the whole school>};
+    teachers post to their own classes, admins and staff anywhere.
+    """
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body)
+            title = str(payload['title']).strip()
+            class_id = payload.get('class')
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Expected {"title": "...", "body": "...", "class": <id>}.'}, status=400)
+        if not title:
+            return JsonResponse({'error': 'An announcement needs a title.'}, status=400)
+        class_instance = get_object_or_404(Class, pk=class_id) if class_id is not None else None
+        allowed = can_manage_class(request, class_instance) if class_instance else is_school_staff(request.user)
+        if not allowed:
+            return JsonResponse({'error': 'You cannot post to this audience.'}, status=403)
+        announcement = post_announcement(request.user, title, str(payload.get('body', '')), class_instance)
+        return JsonResponse({
+            'id': announcement.pk, 'delivery': announcement.delivery, 'recipients': announcement.recipient_count,
+        }, status=201)
+
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 50)), 200))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    return JsonResponse({'announcements': [
+        {
+            'id': item.pk, 'title': item.title, 'body': item.body, 'created_at': item.created_at.isoformat(),
+            'author': item.author.username if item.author else None, 'class': item.class_instance_id, 'read': item.read,
+        }
+        for item in inbox(request.user, limit)
+    ]})
+
+@login_required
+@require_http_methods(['POST'])
+def read_announcements(request):
+    """Mark announcements as read: {"ids": [...]}."""
+    try:
+        ids = [int(pk) for pk in json.loads(request.body)['ids']]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected {"ids": [<announcement id>, ...]}.'}, status=400)
+    return JsonResponse({'marked': mark_read(request.user, ids)})
+
+@login_required
+def export_data(request, dataset):
+    """
+    Stream users, attendance, grades or fees as CSV or JSONL (?format=csv|jsonl),
+    filtered by ?role=, ?class= and a ?from=/&to= date range.
+    """
+    if not is_school_staff(request.user):
+        return JsonResponse({'error': 'Only staff can export data.'}, status=403)
+    if dataset not in DATASETS:
+        return JsonResponse({'error': f'Unknown export {dataset}.'}, status=404)
+    fmt = request.GET.get('format', 'csv')
+    try:
+        lines = export_lines(
+            dataset, fmt,
+            role=request.GET.get('role') or None,
+            class_id=int(request.GET['class']) if request.GET.get('class') else None,
+            start=date.fromisoformat(request.GET['from']) if request.GET.get('from') else None,
+            end=date.fromisoformat(request.GET['to']) if request.GET.get('to') else None,
+        )
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    response = StreamingHttpResponse(lines, content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+    return response
+
+# Sort orders offered by the user listings, each ending in the unique id
+USER_ORDERINGS = {
+    'date_joined': ('date_joined', 'id'),
+    '-date_joined': ('-date_joined', '-id'),
+    'role': ('role', 'id'),
+}
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name', 'email', 'role', 'date_joined')
+
+def page_size(request, default=50, maximum=200):
+    try:
+        return max(1, min(int(request.GET.get('per_page', default)), maximum))
+    except ValueError:
+        return default
+
+def count_for(request, queryset):
+    """?count=estimate (default), exact or none."""
+    mode = request.GET.get('count', 'estimate')
+    if mode == 'none':
+        return None, None
+    if mode == 'exact':
+        return queryset.count(), True
+    return estimated_count(queryset)
+
+def user_page(request):
+    ordering = USER_ORDERINGS.get(request.GET.get('order', 'date_joined'))
+    if ordering is None:
+        raise InvalidCursor(f'Order by one of: {", ".join(USER_ORDERINGS)}.')
+    users = CustomUser.objects.values(*USER_FIELDS)
+    if request.GET.get('role'):
+        users = users.filter(role=request.GET['role'])
+    page = KeysetPaginator(users, ordering, per_page=page_size(request)).page(request.GET.get('cursor'))
+    return page, count_for(request, users)
+
+@login_required
+def user_directory(request):
+    if not is_school_staff(request.user):
+        return render(request, 'users.html', {'error': 'Only staff can browse the user directory.'}, status=403)
+    try:
+        page, (count, exact) = user_page(request)
+    except InvalidCursor as error:
+        return render(request, 'users.html', {'error': str(error)}, status=400)
+    next_query = request.GET.copy()
+    next_query['cursor'] = page.next_cursor or ''
+    return render(request, 'users.html', {
+        'page': page, 'count': count, 'count_is_exact': exact, 'next_query': next_query.urlencode(),
+    })
+
+@login_required
+def user_list_api(request):
+    """
+    JSON user listing with keyset pagination: ?order=date_joined|-date_joined|role,
+    ?role=, ?per_page=, ?cursor= (the next_cursor of the previous page).
+    """
+    if not is_school_staff(request.user):
+        return JsonResponse({'error': 'Only staff can list users.'}, status=403)
+    try:
+        page, (count, exact) = user_page(request)
+    except InvalidCursor as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({
+        'results': page.object_list, 'next_cursor': page.next_cursor, 'count': count, 'count_is_exact': exact,
+    })
+
+@login_required
+def user_search_api(request):
+    """
+    Ranked user search by name, username or email: ?q= (every word matches as a
+    prefix), ?role=, ?limit= (default 20, at most 100).
+    """
+    if not is_school_staff(request.user):
+        return JsonResponse({'error': 'Only staff can search users.'}, status=403)
+    role = request.GET.get('role') or None
+    if role is not None and role not in ROLE_PROFILE_MODELS:
+        return JsonResponse({'error': f'Unknown role {role}.'}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    users = search_users(request.GET.get('q', ''), role=role, limit=limit)
+    return JsonResponse({'results': [
+        {field: getattr(user, field) for field in USER_FIELDS} for user in users
+    ]})
+
+@login_required
+def user_autocomplete_api(request):
+    """
+    Type-ahead for user pickers, answered from memory: ?q=, ?role=, ?limit=
+    (default 10, at most 50). Staff and teachers only.
+    """
+    if not (is_school_staff(request.user) or request.user.role == 'teacher'):
+        return JsonResponse({'error': 'Only staff and teachers can look up users.'}, status=403)
+    role = request.GET.get('role') or None
+    if role is not None and role not in ROLE_PROFILE_MODELS:
+        return JsonResponse({'error': f'Unknown role {role}.'}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 10)), 50))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+    suggestions = autocomplete.complete(request.GET.get('q', ''), role=role, limit=limit)
+    return JsonResponse({'results': [suggestion._asdict() for suggestion in suggestions]})
+
+@login_required
+def student_list_api(request):
+    """The students the user may see (a parent's children, a teacher's pupils, everyone for staff), keyset-paginated."""
+    students = filter_visible(StudentProfile.objects.all(), request.user).values(
+        'id', 'user__username', 'user__first_name', 'user__last_name',
+    )
+    try:
+        page = KeysetPaginator(students, ('id',), per_page=page_size(request)).page(request.GET.get('cursor'))
+    except InvalidCursor as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({
+        'results': [
+            {
+                'id': row['id'], 'username': row['user__username'],
+                'name': f"{row['user__first_name']} {row['user__last_name']}".strip() or row['user__username'],
+            }
+            for row in page.object_list
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+@login_required
+def student_record_api(request, student_id):
+    """One student's attendance, latest grades and unpaid fees, for users who may see the student."""
+    if not can_view_student(request.user, student_id):
+        return JsonResponse({'error': 'You cannot see this student.'}, status=403)
+    ids = [student_id]
+    names = student_names(ids)
+    if student_id not in names:
+        return JsonResponse({'error': 'No such student.'}, status=404)
+    return JsonResponse({
+        'id': student_id, 'name': names[student_id],
+        'attendance': attendance_by_student(ids).get(student_id, []),
+        'grades': recent_grades_by_student(ids).get(student_id, []),
+        'fees': unpaid_fees_by_student(ids).get(student_id, []),
+    })
+
+@login_required
+def grade_list_api(request):
+    """
+    The grades the user may see (a teacher's classes, a parent's children, a
+    student's own), keyset-paginated, each flagged with whether the user may change it.
+    """
+    grades = permitted(request.user, 'school.view_grade', Grade.objects.select_related(
+        'student__user', 'exam__subject', 'exam__class_instance',
+    ))
+    try:
+        page = KeysetPaginator(grades, ('id',), per_page=page_size(request)).page(request.GET.get('cursor'))
+    except InvalidCursor as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    # The rules read the joined exam and class, so this costs no query per row
+    return JsonResponse({
+        'results': [
+            {
+                'id': grade.pk, 'student': grade.student_id, 'username': grade.student.user.username,
+                'exam': grade.exam_id, 'subject': grade.exam.subject.name, 'date': grade.exam.date.isoformat(),
+                'grade': grade.grade_value, 'can_change': request.user.has_perm('school.change_grade', grade),
+            }
+            for grade in page.object_list
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+@login_required
+def profile_list_api(request, role):
+    """JSON listing of one role's profiles, keyset-paginated by profile id."""
+    if not is_school_staff(request.user):
+        return JsonResponse({'error': 'Only staff can list profiles.'}, status=403)
+    if role not in ROLE_PROFILE_MODELS:
+        return JsonResponse({'error': f'Unknown role {role}.'}, status=404)
+    profiles = ROLE_PROFILE_MODELS[role].objects.values('id', 'user_id', 'user__username')
+    try:
+        page = KeysetPaginator(profiles, ('id',), per_page=page_size(request)).page(request.GET.get('cursor'))
+    except InvalidCursor as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    count, exact = count_for(request, ROLE_PROFILE_MODELS[role].objects.all())
+    return JsonResponse({
+        'results': [
+            {'id': row['id'], 'user_id': row['user_id'], 'username': row['user__username']} for row in page.object_list
+        ],
+        'next_cursor': page.next_cursor, 'count': count, 'count_is_exact': exact,
+    })
@@ -0,0 +1,154 @@
+"""
+"May this user see student X?" answered from the StudentVisibility table instead
+of joining through ParentProfile.children or Class.students/assigned_teacher.
+
+A viewer's rows are recomputed from those relations whenever one of them changes
+(see the signal handlers), and each viewer's set of student ids is cached as a
+sorted integer array, so a check costs a set lookup and a list filter costs one
+semi-join whatever the number of rows.
+"""
+from array import array
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from .models import Class, ParentProfile, StudentVisibility, TeacherProfile
+
+# Roles that see every student
+ALL_STUDENTS_ROLES = ('admin', 'staff')
+
+
+def visibility_cache():
+    return caches[getattr(settings, 'SCHOOL_VISIBILITY_CACHE', 'default')]
+
+
+def _cache_key(user_id):
+    return f'visibility:{user_id}'
+
+
+def source_pairs(viewers=None):
+    """
+    (viewer user id, student id) of every parent-child link and every student of
+    an assigned teacher's classes, for the given CustomUser ids or queryset (all
+    viewers when None), as one query.
+    """
+    parents = ParentProfile.children.through.objects.values_list('parentprofile__user_id', 'studentprofile_id')
+    teachers = Class.students.through.objects.filter(class__assigned_teacher__isnull=False).values_list(
+        'class__assigned_teacher__user_id', 'studentprofile_id',
+    )
+    if viewers is not None:
+        parents = parents.filter(parentprofile__user__in=viewers)
+        teachers = teachers.filter(class__assigned_teacher__user__in=viewers)
+    return parents.union(teachers)
+
+
+def refresh_viewers(user_ids):
+    """Bring the rows of the given viewers in line with the relations. Returns (added, removed)."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return 0, 0
+    wanted = set(source_pairs(user_ids))
+    stored = set(StudentVisibility.objects.filter(viewer_id__in=user_ids).values_list('viewer_id', 'student_id'))
+    added = wanted - stored
+    removed = stored - wanted
+    with transaction.atomic():
+        by_viewer = {}
+        for viewer, student in removed:
+            by_viewer.setdefault(viewer, []).append(student)
+        for viewer, students in by_viewer.items():
+            StudentVisibility.objects.filter(viewer_id=viewer, student_id__in=students).delete()
+        StudentVisibility.objects.bulk_create(
+            [StudentVisibility(viewer_id=viewer, student_id=student) for viewer, student in added],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        if added or removed:
+            forget(user_ids)
+    return len(added), len(removed)
+
+
+def rebuild(viewers=None):
+    """
+    Recompute the rows of the given viewers (a CustomUser queryset), or of
+    everyone, with one DELETE and one INSERT ... SELECT. For bulk loads that
+    skip signals. Returns the number of rows written.
+    """
+    rows = StudentVisibility.objects.all() if viewers is None else StudentVisibility.objects.filter(viewer__in=viewers)
+    select, params = source_pairs(viewers).query.get_compiler(connection=connection).as_sql()
+    quote = connection.ops.quote_name
+    with transaction.atomic():
+        rows.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(StudentVisibility._meta.db_table)} ({quote("viewer_id")}, {quote("student_id")}) {select}',
+                params,
+            )
+            count = cursor.rowcount
+        if viewers is None:
+            transaction.on_commit(visibility_cache().clear)
+        else:
+            forget(viewers.values_list('pk', flat=True))
+    return count
+
+
+def forget(user_ids):
+    """Drop the cached sets of the given viewers once the current transaction commits."""
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: visibility_cache().delete_many(keys))
+
+
+def visible_student_ids(user):
+    """The student ids a parent or teacher may see, cached and kept on the user for the request."""
+    if not hasattr(user, '_visible_student_ids'):
+        cache = visibility_cache()
+        key = _cache_key(user.pk)
+        packed = cache.get(key)
+        if packed is None:
+            ids = array('q', sorted(StudentVisibility.objects.filter(viewer=user).values_list('student_id', flat=True)))
+            packed = ids.tobytes()
+            cache.set(key, packed, getattr(settings, 'SCHOOL_VISIBILITY_CACHE_TIMEOUT', 24 * 60 * 60))
+        ids = array('q')
+        ids.frombytes(packed)
+        user._visible_student_ids = frozenset(ids)
+    return user._visible_student_ids
+
+
+def sees_all_students(user):
+    return user.is_superuser or user.role in ALL_STUDENTS_ROLES
+
+
+def can_view_student(user, student_id):
+    """Whether `user` may see the student profile `student_id`: staff any, students themselves, parents and teachers theirs."""
+    if not user.is_authenticated:
+        return False
+    if sees_all_students(user):
+        return True
+    if user.role == 'student':
+        return user.profile is not None and user.profile.pk == student_id
+    return student_id in visible_student_ids(user)
+
+
+def filter_visible(queryset, user, field='pk'):
+    """
+    Restrict a queryset to rows whose `field` (a StudentProfile, e.g. 'pk' on
+    StudentProfile, 'student' on Grade or Fee) the user may see.
+    """
+    if not user.is_authenticated:
+        return queryset.none()
+    if sees_all_students(user):
+        return queryset
+    if user.role == 'student':
+        return queryset.filter(**{field: user.profile.pk}) if user.profile is not None else queryset.none()
+    return queryset.filter(**{f'{field}__in': StudentVisibility.objects.filter(viewer=user).values('student')})
+
+
+def teacher_user_ids(teacher_ids):
+    teacher_ids = [pk for pk in teacher_ids if pk is not None]
+    if not teacher_ids:
+        return []
+    return list(TeacherProfile.objects.filter(pk__in=teacher_ids).values_list('user_id', flat=True))
+
+
+def parent_user_ids(parent_ids):
+    return list(ParentProfile.objects.filter(pk__in=parent_ids).values_list('user_id', flat=True))
+